@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+
+# Usage: benchlogblitz.py [size in MiB] [benchmark...]
+# Generates synthetic logfiles in a temporary directory, and compares the
+# search paths of logblitz.py against each other.
+
+import sys
+import os
+import re
+import time
+import random
+import tempfile
+import gzip
+import bz2
+import lzma
+import shutil
+
+import logblitz
+
+PROGRAMS = ("sshd", "cron", "kernel", "postfix/smtpd", "named", "dhcpd")
+MESSAGES = (
+    "Accepted publickey for admin from 192.0.2.17 port 50022 ssh2",
+    "Failed password for root from 198.51.100.4 port 41122 ssh2",
+    "(root) CMD (run-parts /etc/periodic/hourly)",
+    "eth0: link state changed to UP",
+    "connect from unknown[203.0.113.9]",
+    "client 192.0.2.53#53: query: example.org IN A +",
+    "DHCPACK on 10.0.0.23 to 00:11:22:33:44:55 via em0",
+)
+
+
+def make_logfile(path, size_mib):
+    rnd = random.Random(size_mib)
+    with open(path, "w") as fp:
+        written = 0
+        while written < size_mib * 1024**2:
+            line = "Oct 17 %02d:%02d:%02d host %s[%d]: %s\n" % (
+                rnd.randrange(24), rnd.randrange(60), rnd.randrange(60),
+                rnd.choice(PROGRAMS), rnd.randrange(1, 65536),
+                rnd.choice(MESSAGES))
+            fp.write(line)
+            written += len(line)
+
+
+def make_ordered_logfile(path, size_mib):
+    # one line every second, with ISO 8601 timestamps, so that a time range
+    # starts somewhere within the logfile
+    rnd = random.Random(size_mib)
+    secs = time.mktime((2026, 10, 17, 0, 0, 0, 0, 0, -1))
+    with open(path, "w") as fp:
+        written = 0
+        while written < size_mib * 1024**2:
+            line = "%s host %s[%d]: %s\n" % (
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(secs)),
+                rnd.choice(PROGRAMS), rnd.randrange(1, 65536),
+                rnd.choice(MESSAGES))
+            fp.write(line)
+            written += len(line)
+            secs += 1
+
+
+def make_tree(path, num_files, rotated=True):
+    # rotated logfiles spread over a directory per host, like a central
+    # syslog server keeps them, or logfiles not rotated yet
+    rnd = random.Random(num_files)
+    num_dirs = max(num_files // 1000, 1)
+    for num_dir in range(num_dirs):
+        dirname = os.path.join(path, f"host{num_dir:03d}")
+        os.makedirs(dirname, exist_ok=True)
+        for num_file in range(num_files // num_dirs):
+            if rotated:
+                name = "%s.%d%s" % (rnd.choice(("messages", "auth.log",
+                                                "daemon.log", "cron")),
+                                    num_file,
+                                    rnd.choice(("", ".gz", ".bz2")))
+            else:
+                name = f"app{num_file:04d}.log"
+            with open(os.path.join(dirname, name), "w"):
+                pass
+
+
+def timeit(label, func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<40} {best:8.3f}s")
+    return result
+
+
+def run_search(logfile, query, regex=False, ignorecase=False, invert=False,
+               boolean=False, reverse=False, before="0", after="0",
+               limitlines="1000", limitmemory="1", fast=False, workers=1,
+               index_dir="", timestamp="", timefrom="", timeto="",
+               charset="utf-8", tail=None, cache_size=0, cache_dir="",
+               paging=None):
+    logdir = os.path.dirname(logfile)
+    logfiles = logblitz.LogFiles()
+    logblitz.traverse_logdir(logdir, logblitz.re.compile(""),
+                             logblitz.re.compile(""),
+                             logblitz.re.compile(""), logfiles, False, True)
+    options = logblitz.SearchOptions(charset, query, reverse, ignorecase,
+                                     invert, regex, boolean, before, after,
+                                     limitlines, limitmemory, fast, workers,
+                                     index_dir, timestamp, timefrom, timeto)
+    return logblitz.search([logdir], logfiles, [logfile], options, tail,
+                           cache_size, cache_dir, paging=paging)
+
+
+def bench_mmap(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+    # just rotated logfiles are mapped, the current one is read in chunks
+    rotated = logfile + ".1"
+    shutil.copyfile(logfile, rotated)
+
+    for label, kwargs in (
+            ("literal, no hits", {"query": "10.0.0.23 to 00:11:22:33:44:56"}),
+            ("literal, ignorecase", {"query": "FAILED PASSWORD FOR ADMIN",
+                                     "ignorecase": True}),
+            ("regex", {"query": r"Failed password for (root|admin) from",
+                       "regex": True}),
+            ("literal, context", {"query": "example.org", "before": "3",
+                                  "after": "3"})):
+        print(f"{label}:")
+        orig_min_size = logblitz.MMAP_MIN_SIZE
+        logblitz.MMAP_MIN_SIZE = sys.maxsize
+        per_line = timeit("per line loop", lambda: run_search(logfile,
+                                                               **kwargs))
+        logblitz.MMAP_MIN_SIZE = orig_min_size
+        chunked = timeit("chunks", lambda: run_search(logfile, **kwargs))
+        whole = timeit("mmap whole buffer", lambda: run_search(rotated,
+                                                                **kwargs))
+        if (per_line != chunked or whole[0] != per_line[0] or
+                [line.replace(rotated, logfile) for line in whole[1]] !=
+                per_line[1]):
+            print("  Error: results differ")
+    os.remove(rotated)
+
+
+def bench_decompress(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+
+    for suffix, opener in ((".gz", gzip.open), (".bz2", bz2.open),
+                           (".xz", lzma.open)):
+        compressed = logfile + suffix
+        with open(logfile, "rb") as src, opener(compressed, "wb") as dst:
+            dst.write(src.read())
+
+        for label, kwargs in (
+                ("literal", {"query": "Failed password for admin"}),
+                ("inverted literal", {"query": "sshd", "invert": True})):
+            print(f"{suffix}, {label}:")
+            orig_depth = logblitz.DECOMPRESS_QUEUE_DEPTH
+            logblitz.DECOMPRESS_QUEUE_DEPTH = 0
+            single = timeit("single thread", lambda: run_search(compressed,
+                                                               **kwargs))
+            logblitz.DECOMPRESS_QUEUE_DEPTH = orig_depth
+            pipelined = timeit("decompression thread",
+                               lambda: run_search(compressed, **kwargs))
+            if single != pipelined:
+                print("  Error: results differ")
+
+        os.remove(compressed)
+
+
+def bench_index(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+
+    index_dir = os.path.join(tmpdir, "index")
+    os.makedirs(index_dir, exist_ok=True)
+    for suffix, opener in (("", open), (".gz", gzip.open)):
+        rotated = logfile + ".1" + suffix
+        with open(logfile, "rb") as src, opener(rotated, "wb") as dst:
+            dst.write(src.read())
+
+        timeit("build index", lambda: logblitz.build_index(index_dir,
+                                                            rotated),
+               repeat=1)
+        for label, kwargs in (
+                ("literal, no hits", {"query": "segfault at 0"}),
+                ("regex, no hits", {"query": r"segfault at [0-9a-f]+ ip",
+                                    "regex": True}),
+                ("literal", {"query": "Failed password for root"})):
+            print(f"{rotated[len(tmpdir) + 1:]}, {label}:")
+            full = timeit("full scan", lambda: run_search(rotated, **kwargs))
+            indexed = timeit("trigram index",
+                             lambda: run_search(rotated, index_dir=index_dir,
+                                                **kwargs))
+            if full != indexed:
+                print("  Error: results differ")
+
+        os.remove(rotated)
+
+
+def bench_checkpoints(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+
+    index_dir = os.path.join(tmpdir, "checkpoints")
+    os.makedirs(index_dir, exist_ok=True)
+    rotated = logfile + ".1.gz"
+    with open(logfile, "rb") as src, gzip.open(rotated, "wb") as dst:
+        # a single rare line in the middle of the logfile
+        data = src.read()
+        middle = data.find(b"\n", len(data) // 2) + 1
+        dst.write(data[:middle])
+        dst.write(b"Oct 17 12:00:00 host kernel: segfault at 0 ip 0\n")
+        dst.write(data[middle:])
+
+    # without libz, a gzip compressed logfile is decompressed from its
+    # start, even if its index holds checkpoints
+    for label, span, libz in (
+            ("no checkpoints", sys.maxsize, None),
+            ("checkpoints", logblitz.CHECKPOINT_SPAN, None),
+            ("libz missing", logblitz.CHECKPOINT_SPAN, False)):
+        orig_span = logblitz.CHECKPOINT_SPAN
+        logblitz.CHECKPOINT_SPAN = span
+        if libz is None:
+            for name in os.listdir(index_dir):
+                os.remove(os.path.join(index_dir, name))
+            timeit(f"build index, {label}",
+                   lambda: logblitz.build_index(index_dir, rotated),
+                   repeat=1)
+        logblitz.CHECKPOINT_SPAN = orig_span
+        orig_libz = logblitz.GzipReader.libz
+        if libz is not None:
+            logblitz.GzipReader.libz = libz
+
+        for query, kwargs in (("rare literal", {}),
+                              ("rare literal, context", {"before": "3",
+                                                         "after": "3"})):
+            result = timeit(f"{query}, {label}",
+                            lambda: run_search(rotated, "segfault at 0",
+                                               index_dir=index_dir,
+                                               **kwargs))
+            if result != run_search(rotated, "segfault at 0", **kwargs):
+                print("  Error: results differ")
+        logblitz.GzipReader.libz = orig_libz
+
+    os.remove(rotated)
+
+
+def bench_timerange(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages.ordered")
+    make_ordered_logfile(logfile, size_mib)
+    index_dir = os.path.join(tmpdir, "timerange")
+    os.makedirs(index_dir, exist_ok=True)
+    # a time range starting early, and one starting an hour before the
+    # last line
+    with open(logfile, "rb") as fp:
+        fp.seek(-1024, os.SEEK_END)
+        last_line = fp.read().splitlines()[-1].decode()
+    last_secs = time.mktime(time.strptime(last_line[:19],
+                                          "%Y-%m-%dT%H:%M:%S"))
+    # a logfile not written since a time range began is skipped
+    os.utime(logfile, (last_secs + 1, last_secs + 1))
+    ranges = (("early", "2026-10-17T10:00:00"),
+              ("last hour", time.strftime("%Y-%m-%dT%H:%M:%S",
+                                          time.localtime(last_secs - 3600))))
+
+    for range_label, timefrom in ranges:
+        kwargs = {"query": "Failed password for root",
+                  "timestamp": logblitz.TIMESTAMP_FORMATS["iso8601"],
+                  "timefrom": timefrom, "limitlines": "100000",
+                  "limitmemory": "100"}
+        print(f"plain, {range_label}:")
+        plain = timeit("binary search", lambda: run_search(logfile,
+                                                           **kwargs))
+        for suffix, opener in ((".gz", gzip.open), (".xz", lzma.open)):
+            compressed = logfile + ".1" + suffix
+            if not os.path.exists(compressed):
+                with open(logfile, "rb") as src:
+                    with opener(compressed, "wb") as dst:
+                        dst.write(src.read())
+                os.utime(compressed, (last_secs + 1, last_secs + 1))
+                logblitz.build_index(index_dir, compressed)
+
+            print(f"{suffix}, {range_label}:")
+            # the lines, and their numbers, must be the same as in the plain
+            # logfile, just the path of the logfile differs; without libz,
+            # a gzip compressed logfile is decompressed entirely
+            orig_libz = logblitz.GzipReader.libz
+            for label, index, libz in (
+                    ("decompressed entirely", "", orig_libz),
+                    ("from checkpoint", index_dir, orig_libz),
+                    ("libz missing", index_dir, False)):
+                if libz is False and suffix != ".gz":
+                    continue
+                logblitz.GzipReader.libz = libz
+                result = timeit(label,
+                                lambda: run_search(compressed,
+                                                   index_dir=index,
+                                                   **kwargs))
+                logblitz.GzipReader.libz = orig_libz
+                if ([line.replace(compressed, logfile)
+                     for line in result[1]] != plain[1]):
+                    print("  Error: results differ")
+
+    for suffix in (".gz", ".xz"):
+        os.remove(logfile + ".1" + suffix)
+    os.remove(logfile)
+
+
+def bench_tail(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages.tail")
+    make_logfile(logfile, size_mib)
+
+    for label, kwargs in (
+            ("literal", {"query": "192.0.2.1 port"}),
+            ("regex, reverse, context", {"query": r"192\.0\.2\.1 port",
+                                         "regex": True, "reverse": True,
+                                         "before": "3", "after": "3"})):
+        print(f"{label}:")
+        tail = {}
+        run_search(logfile, tail=tail, **kwargs)
+
+        def tick(tail):
+            with open(logfile, "a") as fp:
+                fp.write("Oct 17 23:59:59 host sshd[1]: Failed password for "
+                         "admin from 192.0.2.1 port 22 ssh2\n")
+            return run_search(logfile, tail=tail, **kwargs)
+
+        timeit("full search", lambda: tick(None))
+        tailed = timeit("appended lines only", lambda: tick(tail))
+        if tailed != run_search(logfile, **kwargs):
+            print("  Error: results differ")
+
+    os.remove(logfile)
+
+
+def bench_prefilter(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+    compressed = logfile + ".gz"
+    with open(logfile, "rb") as src, gzip.open(compressed, "wb") as dst:
+        dst.write(src.read())
+
+    orig_required_literals = logblitz.required_literals
+    for path in (logfile, compressed):
+        for label, kwargs in (
+                ("no literal prefix", {"query": r"\d+ Failed password for "
+                                                r"(\w+)", "regex": True}),
+                ("literal prefix", {"query": r"sshd.*Failed password for "
+                                             r"(\w+)", "regex": True}),
+                ("ignorecase", {"query": r"(root|admin) FROM 192\.0\.2",
+                                "regex": True, "ignorecase": True})):
+            print(f"{os.path.basename(path)}, {label}:")
+            logblitz.required_literals = lambda pattern: []
+            full = timeit("regex only", lambda: run_search(path, **kwargs))
+            logblitz.required_literals = orig_required_literals
+            prefiltered = timeit("required literal",
+                                 lambda: run_search(path, **kwargs))
+            if full != prefiltered:
+                print("  Error: results differ")
+
+    os.remove(compressed)
+
+
+def bench_boolean(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+
+    for label, lookahead, boolean in (
+            ("and not", r"^(?!.*root).*Failed password",
+             "Failed password -root"),
+            ("or, and", r"^(?=.*(?:smtpd|dhcpd)).*(?:connect|DHCPACK)",
+             "(smtpd OR dhcpd) AND (connect OR DHCPACK)"),
+            ("or, no hits", r"segfault|oom-killer|I/O error",
+             "segfault OR oom-killer OR \"I/O error\"")):
+        print(f"{label}:")
+        regex = timeit("regex", lambda: run_search(logfile, lookahead,
+                                                    regex=True))
+        terms = timeit("boolean", lambda: run_search(logfile, boolean,
+                                                      boolean=True))
+        # the highlighted spans differ
+        unmarked = logblitz.re.compile(r'<span class="sr">|</span>')
+        if ([unmarked.sub("", line) for line in regex[1]] !=
+                [unmarked.sub("", line) for line in terms[1]]):
+            print("  Error: results differ")
+
+
+def bench_cache(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+    rotated = logfile + ".1.gz"
+    with open(logfile, "rb") as src, gzip.open(rotated, "wb") as dst:
+        dst.write(src.read())
+
+    for label, kwargs in (
+            ("literal", {"query": "Failed password for admin"}),
+            ("regex, context", {"query": r"port 4\d+ ssh2", "regex": True,
+                                "before": "2", "after": "2"})):
+        print(f"{label}:")
+        full = timeit("uncached", lambda: run_search(rotated, **kwargs))
+        logblitz.result_cache = logblitz.ResultCache()
+        cached = timeit("result cache",
+                        lambda: run_search(rotated, cache_size=64 * 1024**2,
+                                           **kwargs))
+        if full[1] != cached[1]:
+            print("  Error: results differ")
+
+    os.remove(rotated)
+
+
+def bench_paging(tmpdir, size_mib):
+    logfile = os.path.join(tmpdir, "messages")
+    if not os.path.exists(logfile):
+        make_logfile(logfile, size_mib)
+
+    def shown_lines(lines):
+        # the line numbers are padded to the widest one of each page
+        return [re.sub(r'(class="ln">) +', r"\1", line) for line in lines
+                if line.startswith('<div class="sl">')]
+
+    def page_through(**kwargs):
+        paging = {}
+        lines = []
+        while True:
+            _, page_lines = run_search(logfile, paging=paging, **kwargs)
+            lines += shown_lines(page_lines)
+            if not paging.get("next"):
+                return lines
+            paging = {"resume": paging["next"]}
+
+    # the pages must show each line of a single search exactly once, even
+    # if a match not shown lies within the after context of the last one
+    for label, kwargs in (
+            ("literal", {"query": "Failed password for root"}),
+            ("literal, context", {"query": "Failed password", "before": "2",
+                                  "after": "3"})):
+        print(f"{label}:")
+        full = timeit("single search",
+                      lambda: run_search(logfile, limitlines="100000000",
+                                         limitmemory="1000000", **kwargs))
+        pages = timeit("pages", lambda: page_through(limitlines="10000",
+                                                     **kwargs), repeat=1)
+        if pages != shown_lines(full[1]):
+            print("  Error: results differ")
+
+
+def bench_tree(tmpdir, size_mib):
+    # rotated logfiles, and logfiles still written, e.g. one per application,
+    # which are stat()ed by each listing unless watched by inotify
+    for label, rotated in (("100000 rotated files", True),
+                           ("100000 current files", False)):
+        logdir = os.path.join(tmpdir, "tree" if rotated else "current")
+        make_tree(logdir, 100000, rotated)
+
+        def traverse(filefilter="", use_inotify=False):
+            logfiles = logblitz.LogFiles()
+            logblitz.traverse_logdir(logdir, logblitz.re.compile(""),
+                                     logblitz.re.compile(""),
+                                     logblitz.re.compile(filefilter),
+                                     logfiles, False, True,
+                                     use_inotify=use_inotify)
+            return logfiles.dir2files
+
+        def uncached():
+            logblitz.dir_cache = logblitz.DirCache()
+            return traverse()
+
+        print(f"{label}:")
+        full = timeit("full scan", uncached)
+        # the directories have just been created, so they would be scanned
+        # again
+        orig_slack = logblitz.DIRCACHE_MTIME_SLACK
+        logblitz.DIRCACHE_MTIME_SLACK = 0
+        traverse()
+        cached = timeit("cached, mtime revalidated", traverse)
+        timeit("cached, filtered", lambda: traverse(r"\.gz$"))
+        logblitz.DIRCACHE_MTIME_SLACK = orig_slack
+        if full != cached:
+            print("  Error: results differ")
+
+        # inotify spares the stat() of each directory, and of each logfile
+        # not rotated yet, unless it has been reported
+        logblitz.dir_cache = logblitz.DirCache()
+        if not logblitz.dir_cache.start_inotify():
+            print("  inotify is not available")
+            continue
+        traverse(use_inotify=True)
+        watched = timeit("cached, inotify",
+                         lambda: traverse(use_inotify=True))
+        if full != watched:
+            print("  Error: results differ")
+
+
+BENCHMARKS = {
+    "mmap": bench_mmap,
+    "decompress": bench_decompress,
+    "index": bench_index,
+    "checkpoints": bench_checkpoints,
+    "timerange": bench_timerange,
+    "tail": bench_tail,
+    "prefilter": bench_prefilter,
+    "boolean": bench_boolean,
+    "cache": bench_cache,
+    "paging": bench_paging,
+    "tree": bench_tree,
+}
+
+
+if __name__ == "__main__":
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    names = sys.argv[2:] or BENCHMARKS.keys()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in names:
+            print(f"== {name} ({size_mib} MiB)")
+            BENCHMARKS[name](tmpdir, size_mib)
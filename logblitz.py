@@ -15,6 +15,26 @@ import lzma
 import collections
 import http.cookies
 import codecs
+import mmap
+import threading
+import queue
+import io
+import hashlib
+import hmac
+import base64
+import json
+import struct
+import tempfile
+import calendar
+import itertools
+import copy
+import secrets
+import zlib
+import bisect
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 try:
     import re2 as re
     RE_MODULE = "re2"
@@ -26,6 +46,97 @@ VERSION = "21"
 COOKIE_MAX_AGE = 365*24*60*60
 DATETIME_FMT = "%Y/%m/%d %H:%M:%S"
 HTML_CHARSET = "utf-8"
+# uncompressed logfiles of at least this size are searched as a whole if
+# rotated, and in chunks otherwise, see FileBuffer
+MMAP_MIN_SIZE = 1024**2
+MMAP_CHUNK_SIZE = 16 * 1024**2
+# uncompressed logfiles are read backwards in blocks of this size
+BACKWARD_BLOCK_SIZE = 64 * 1024
+# compressed logfiles are decompressed by a background thread in chunks of
+# this size, of which up to DECOMPRESS_QUEUE_DEPTH are buffered; a depth of 0
+# disables the background thread
+DECOMPRESS_CHUNK_SIZE = 1024**2
+DECOMPRESS_QUEUE_DEPTH = 4
+# the trigram index splits rotated logfiles into blocks of about this many
+# uncompressed bytes, and hashes the trigrams of each block into a bitmap
+INDEX_VERSION = 2
+INDEX_BLOCK_SIZE = 4 * 1024**2
+INDEX_BITS = 17
+INDEX_BLOCK_STRUCT = struct.Struct("<QQQ")
+# a compressed logfile without a number, e.g. rotated by dateext, is taken as
+# rotated once it has not been modified for this many seconds, as it may
+# still be written by a compressing logger, or by gzip itself
+ROTATED_MIN_AGE = 60*60
+# the index of a compressed logfile also keeps checkpoints, from which
+# decompression may resume, about every CHECKPOINT_SPAN uncompressed bytes;
+# each consists of the uncompressed and compressed offset, the number of
+# bits of the compressed byte before which belong to it, and the length of
+# the last 32 KiB of uncompressed data in front of it, which follow
+CHECKPOINT_SPAN = 1024**2
+CHECKPOINT_STRUCT = struct.Struct("<QQBI")
+# predefined values of the timestamp option; any other value is taken as a
+# regex matching at the start of each line, whose named groups Y, m or b, d,
+# H, M, S, and optionally z denote the year, the month as number or name, the
+# day, hour, minute, second, and time zone offset
+TIMESTAMP_FORMATS = {
+    "syslog":  r"(?P<b>[A-Z][a-z]{2}) (?P<d>[ \d]\d) "
+               r"(?P<H>\d\d):(?P<M>\d\d):(?P<S>\d\d)",
+    "iso8601": r"(?P<Y>\d{4})-(?P<m>\d\d)-(?P<d>\d\d)[T ]"
+               r"(?P<H>\d\d):(?P<M>\d\d):(?P<S>\d\d)(?:[.,]\d+)?"
+               r"(?P<z>Z|[+-]\d\d:?\d\d)?",
+    "apache":  r"[^[\n]*\[(?P<d>\d\d)/(?P<b>[A-Z][a-z]{2})/(?P<Y>\d{4}):"
+               r"(?P<H>\d\d):(?P<M>\d\d):(?P<S>\d\d) (?P<z>[+-]\d{4})\]",
+}
+MONTHS = {month.encode(): number for number, month in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+     "Nov", "Dec"), 1)}
+# timestamps are looked for within the first bytes of each line, and a
+# logfile without any timestamp within its first lines is searched entirely
+TIMESTAMP_MAX_LEN = 1024
+TIMESTAMP_PROBE_LINES = 100
+# autorefresh keeps the state of each session for this many seconds
+SESSION_MAX_AGE = 24*60*60
+# a page is sent in chunks of this many characters while being searched
+STREAM_CHUNK_SIZE = 64*1024
+# cached results on disk which have not been used for this many seconds are
+# removed, which is checked at most once per RESULT_CACHE_EXPIRE_INTERVAL
+RESULT_CACHE_MAX_AGE = 7*24*60*60
+RESULT_CACHE_EXPIRE_INTERVAL = 60*60
+# the catalog forgets logfiles which have vanished, which is checked at most
+# once per CATALOG_PRUNE_INTERVAL seconds
+CATALOG_PRUNE_INTERVAL = 60*60
+# a profiled request records the lines which allocated the most memory
+PROFILE_TOP_ALLOCATIONS = 50
+# upper bounds in seconds of the buckets of the request and phase durations
+# exported by ?metrics
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 300)
+
+# the current logfile, and its rotated logfiles numbered and compressed
+LOGFILE_NUMBER_RE = re.compile(r"(?i:(.*)\.(\d+)(\.(bz2|gz|xz))?)$")
+# config files parsed by this process, see load_config()
+config_cache = {}
+# catalogs loaded by this process, see load_catalog()
+catalogs = {}
+# a directory modified within this many seconds before it has been scanned
+# may be modified again without changing its mtime, see DirCache
+DIRCACHE_MTIME_SLACK = 2
+# inotify events which change the entries of a watched directory, which
+# change a single entry, and which discard all watches
+IN_DIR_EVENTS = 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800 | 0x8000
+IN_ENTRY_EVENTS = 0x2 | 0x4
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+INOTIFY_EVENT_STRUCT = struct.Struct("iIII")
+# return values and flush modes of libz's inflate(), see GzipReader
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+# the blocks of a xz compressed logfile lie between the stream header and
+# the index, which is followed by the stream footer, see xz_checkpoints()
+XZ_HEADER_SIZE = 12
+XZ_FOOTER_SIZE = 12
 
 
 class LogFiles:
@@ -40,6 +151,1175 @@ class LogFiles:
         self.total_dirs = 0
 
 
+class Timings:
+    # seconds spent in each phase of a request, which are sent as
+    # Server-Timing header, and how each logfile has been searched, which is
+    # shown if the debug option is set to timings, see render_timings(); the
+    # latter, and rendering each line, are timed just if detailed is set
+    def __init__(self):
+        self.phases = {}
+        self.logfiles = []
+        self.errors = []
+        self.detailed = False
+
+    def measure(self, phase, start):
+        # adds the seconds since start to phase, and returns the current time
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - start
+        return now
+
+    def add_logfile(self, logfile, source, scan, total_lines, total_bytes):
+        # records a logfile just searched by scan, or taken from source,
+        # given the totals of scan before
+        self.logfiles.append({"path": logfile["path"],
+                              "size": logfile["size"],
+                              "source": source,
+                              "lines": scan.total_lines - total_lines,
+                              "bytes": scan.total_bytes - total_bytes,
+                              "stats": scan.file_stats,
+                              **scan.file_times})
+
+    def add_error(self, error):
+        # records an error which does not fail the request, e.g. of the
+        # catalog, once
+        if error and error not in self.errors:
+            self.errors.append(error)
+
+    def server_timing(self):
+        return ", ".join(f"{phase};dur={secs * 1000:.1f}"
+                         for phase, secs in self.phases.items())
+
+
+class RequestProfile:
+    # profiles a request by cProfile, and optionally traces its memory
+    # allocations by tracemalloc, while its page is sent; just one request
+    # of a process is profiled at a time
+    lock = threading.Lock()
+
+    def __init__(self, profile_dir, trace_memory):
+        # imported just here, as importing them would slow down every CGI
+        # request
+        import cProfile
+        import tracemalloc
+
+        self.profile_dir = profile_dir
+        self.params = {}
+        self.start = time.perf_counter()
+        self.tracemalloc = tracemalloc if trace_memory else None
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self.profiler = cProfile.Profile()
+
+    def page(self, chunks):
+        # profiles the generation of each chunk of the page just while it is
+        # sent, and saves the profile once the page has been sent; the
+        # allocations are taken from between the chunks which most memory
+        # has been allocated at; the lock is taken just here, so that
+        # nothing runs between taking and releasing it but this generator
+        if not self.lock.acquire(blocking=False):
+            # another request of this process is being profiled
+            yield from chunks
+            return
+
+        try:
+            if self.tracemalloc and self.tracemalloc.is_tracing():
+                # traced by someone else, who stops tracing as well
+                self.tracemalloc = None
+            elif self.tracemalloc:
+                self.tracemalloc.start()
+            chunks = iter(chunks)
+            while True:
+                self.profiler.enable()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    self.profiler.disable()
+                if self.tracemalloc:
+                    traced = self.tracemalloc.get_traced_memory()[0]
+                    if traced > self.snapshot_bytes:
+                        self.snapshot = None
+                        self.snapshot = self.tracemalloc.take_snapshot()
+                        self.snapshot_bytes = traced
+                yield chunk
+        finally:
+            try:
+                self.save()
+            except OSError:
+                pass
+            finally:
+                if self.tracemalloc:
+                    self.tracemalloc.stop()
+                self.lock.release()
+
+    def save(self):
+        # writes the profile to <name>.prof, and the parameters of the
+        # request, its phases, and its top memory allocations to <name>.json
+        name = os.path.join(self.profile_dir, "%s-%d-%s" % (
+            time.strftime("%Y%m%d-%H%M%S"), os.getpid(),
+            secrets.token_hex(4)))
+        self.profiler.dump_stats(name + ".prof")
+
+        params = {**self.params,
+                  "seconds": time.perf_counter() - self.start}
+        if self.snapshot:
+            snapshot = self.snapshot.filter_traces(
+                (self.tracemalloc.Filter(False, self.tracemalloc.__file__),))
+            params["peak_bytes"] = self.tracemalloc.get_traced_memory()[1]
+            params["snapshot_bytes"] = self.snapshot_bytes
+            params["allocations"] = [
+                {"file": stat.traceback[0].filename,
+                 "line": stat.traceback[0].lineno,
+                 "bytes": stat.size,
+                 "count": stat.count}
+                for stat in snapshot.statistics("lineno")[
+                    :PROFILE_TOP_ALLOCATIONS]]
+        with open(name + ".json", "w") as fp:
+            json.dump(params, fp, indent=1)
+
+
+class Metrics:
+    # the durations of the requests and their phases, and what has been
+    # searched, counted over all requests of a WSGI process, which ?metrics
+    # exports in the text format of Prometheus, see render()
+    def __init__(self):
+        self.lock = threading.Lock()
+        # each histogram maps its label to the count of each bucket, the
+        # last one being +Inf, and the sum
+        self.requests = {}
+        self.phases = {}
+        # lines and uncompressed bytes by codec
+        self.scanned = {}
+        self.searches = 0
+        self.active_searches = 0
+        self.matching_lines = 0
+        self.shown_lines = 0
+        self.limited = {"limitlines": 0, "limitmemory": 0}
+        self.catalog_hits = 0
+        self.catalog_misses = 0
+
+    @staticmethod
+    def observe(histogram, label, seconds):
+        buckets = histogram.setdefault(
+            label, [0] * (len(METRICS_BUCKETS) + 1) + [0.0])
+        buckets[bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        buckets[-1] += seconds
+
+    def add_request(self, kind, timings, seconds):
+        with self.lock:
+            self.observe(self.requests, kind, seconds)
+            for phase, phase_seconds in timings.phases.items():
+                self.observe(self.phases, phase, phase_seconds)
+
+    def add_logfile(self, path, lines, num_bytes):
+        # counts the lines and bytes of a logfile which has been read
+        codec = os.path.splitext(path)[1].lower().removeprefix(".")
+        if codec not in ("gz", "bz2", "xz"):
+            codec = "plain"
+        with self.lock:
+            scanned = self.scanned.setdefault(codec, [0, 0])
+            scanned[0] += lines
+            scanned[1] += num_bytes
+
+    def add_catalog(self, hit):
+        with self.lock:
+            if hit:
+                self.catalog_hits += 1
+            else:
+                self.catalog_misses += 1
+
+    def start_search(self):
+        with self.lock:
+            self.active_searches += 1
+
+    def end_search(self):
+        with self.lock:
+            self.active_searches -= 1
+
+    def add_search(self, scan):
+        # counts the results of a search which has been completed
+        with self.lock:
+            self.searches += 1
+            self.matching_lines += scan.matching_lines
+            self.shown_lines += scan.shown_lines
+            if scan.shown_lines >= scan.limit_lines:
+                self.limited["limitlines"] += 1
+            if scan.shown_bytes >= scan.limit_bytes:
+                self.limited["limitmemory"] += 1
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, text, samples):
+            lines.append(f"# HELP logblitz_{name} {text}")
+            lines.append(f"# TYPE logblitz_{name} {kind}")
+            for suffix, labels, value in samples:
+                labels = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"logblitz_{name}{suffix}"
+                             f"{'{' + labels + '}' if labels else ''} "
+                             f"{value}")
+
+        def histogram(name, label, histograms, text):
+            samples = []
+            for value, buckets in sorted(histograms.items()):
+                for le, count in zip(
+                        [*METRICS_BUCKETS, "+Inf"],
+                        itertools.accumulate(buckets[:-1])):
+                    samples.append(("_bucket", {label: value, "le": le},
+                                    count))
+                samples.append(("_sum", {label: value}, buckets[-1]))
+                samples.append(("_count", {label: value}, sum(buckets[:-1])))
+            metric(name, "histogram", text, samples)
+
+        with self.lock:
+            histogram("request_duration_seconds", "kind", self.requests,
+                      "Duration of requests by kind")
+            histogram("phase_duration_seconds", "phase", self.phases,
+                      "Duration of the phases of requests")
+            metric("scanned_lines_total", "counter",
+                   "Lines read from logfiles by codec",
+                   [("", {"codec": codec}, scanned[0])
+                    for codec, scanned in sorted(self.scanned.items())])
+            metric("scanned_bytes_total", "counter",
+                   "Uncompressed bytes read from logfiles by codec",
+                   [("", {"codec": codec}, scanned[1])
+                    for codec, scanned in sorted(self.scanned.items())])
+            metric("searches_total", "counter", "Searches completed",
+                   [("", {}, self.searches)])
+            metric("active_searches", "gauge", "Searches in progress",
+                   [("", {}, self.active_searches)])
+            metric("matching_lines_total", "counter",
+                   "Lines matching the queries of searches",
+                   [("", {}, self.matching_lines)])
+            metric("shown_lines_total", "counter",
+                   "Lines returned by searches",
+                   [("", {}, self.shown_lines)])
+            metric("limited_searches_total", "counter",
+                   "Searches which reached a limit",
+                   [("", {"limit": limit}, count)
+                    for limit, count in self.limited.items()])
+            caches = {"result": (result_cache.hits, result_cache.misses),
+                      "dir": (dir_cache.hits, dir_cache.misses),
+                      "catalog": (self.catalog_hits, self.catalog_misses)}
+            metric("cache_hits_total", "counter", "Hits of caches",
+                   [("", {"cache": cache}, counts[0])
+                    for cache, counts in caches.items()])
+            metric("cache_misses_total", "counter", "Misses of caches",
+                   [("", {"cache": cache}, counts[1])
+                    for cache, counts in caches.items()])
+        return "\n".join(lines) + "\n"
+
+
+class DirCache:
+    # listings of the directories below the logdirs, shared by all requests
+    # of a WSGI process; a directory is scanned again only if its mtime has
+    # changed, or, if it is watched by inotify, once an entry has been
+    # created, removed, or renamed; the files of a listing, which may grow
+    # without changing the mtime of their directory, are stat()ed again,
+    # i.e. those which are not rotated, or those which inotify reported
+    def __init__(self):
+        # each directory maps to its mtime, its inotify watch, its entries,
+        # and the names of the entries reported by inotify
+        self.dirs = {}
+        self.lock = threading.Lock()
+        self.libc = None
+        self.inotify_fd = None
+        self.watches = {}
+        self.hits = 0
+        self.misses = 0
+
+    def start_inotify(self):
+        # returns whether inotify is available; ctypes is imported just here,
+        # as importing it would slow down every CGI request
+        if self.inotify_fd is None:
+            self.inotify_fd = -1
+            try:
+                import ctypes
+                self.libc = ctypes.CDLL(None, use_errno=True)
+                self.inotify_fd = self.libc.inotify_init1(os.O_NONBLOCK |
+                                                          os.O_CLOEXEC)
+            except (OSError, AttributeError):
+                pass
+        return self.inotify_fd >= 0
+
+    def read_inotify(self):
+        # invalidates the listings, or the single entries, of the watched
+        # directories which inotify reported
+        while True:
+            try:
+                buf = os.read(self.inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                return
+
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, name_len = INOTIFY_EVENT_STRUCT.unpack_from(buf,
+                                                                         pos)
+                pos += INOTIFY_EVENT_STRUCT.size
+                name = os.fsdecode(buf[pos:pos + name_len].rstrip(b"\0"))
+                pos += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    self.dirs.clear()
+                    continue
+                path = self.watches.get(wd)
+                if mask & 0x8000:
+                    # the watch has been removed along with its directory
+                    self.watches.pop(wd, None)
+                if path is None or path not in self.dirs:
+                    continue
+                if mask & IN_DIR_EVENTS or not name:
+                    del self.dirs[path]
+                elif mask & IN_ENTRY_EVENTS:
+                    self.dirs[path][3].add(name)
+
+    def scan(self, path, use_inotify):
+        wd = -1
+        if use_inotify and self.start_inotify():
+            # watch before scanning, so that no change goes unnoticed
+            wd = self.libc.inotify_add_watch(
+                self.inotify_fd, os.fsencode(path),
+                IN_DIR_EVENTS | IN_ENTRY_EVENTS | IN_ONLYDIR)
+            if wd >= 0:
+                self.watches[wd] = path
+
+        stat = os.stat(path)
+        uid = os.getuid()
+        gids = {os.getgid(), *os.getgroups()}
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append({"name":   entry.name,
+                                    "path":   entry.path,
+                                    "is_dir": True})
+                elif entry.is_file(follow_symlinks=False):
+                    try:
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append({"name":     entry.name,
+                                    "path":     entry.path,
+                                    "is_dir":   False,
+                                    "rotated":  is_rotated(entry.path,
+                                                          entry_stat.st_mtime),
+                                    "stat":     entry_stat,
+                                    "readable": is_readable(entry_stat, uid,
+                                                            gids)})
+
+        entries.sort(key=lambda entry: logfile_sort_key(entry["name"]))
+
+        if path in self.dirs:
+            # forget the listings of subdirectories which have been removed
+            subdirs = {entry["path"] for entry in entries if entry["is_dir"]}
+            for entry in self.dirs[path][2]:
+                if entry["is_dir"] and entry["path"] not in subdirs:
+                    prefix = entry["path"] + os.path.sep
+                    for subdir in [subdir for subdir in self.dirs
+                                   if subdir == entry["path"] or
+                                   subdir.startswith(prefix)]:
+                        del self.dirs[subdir]
+
+        mtime = stat.st_mtime_ns
+        if time.time() - stat.st_mtime < DIRCACHE_MTIME_SLACK:
+            mtime = None
+        self.dirs[path] = [mtime, wd, entries, set()]
+        return entries
+
+    def listing(self, path, use_inotify=False):
+        # returns the entries of a directory sorted as shown, or None
+        with self.lock:
+            if self.inotify_fd is not None and self.inotify_fd >= 0:
+                self.read_inotify()
+
+            cached = self.dirs.get(path)
+            try:
+                if cached is None:
+                    self.misses += 1
+                    return self.scan(path, use_inotify)
+                if cached[1] in self.watches:
+                    stale = [entry for entry in cached[2]
+                             if entry["name"] in cached[3]]
+                    cached[3].clear()
+                elif cached[0] != os.stat(path).st_mtime_ns:
+                    self.misses += 1
+                    return self.scan(path, use_inotify)
+                else:
+                    stale = [entry for entry in cached[2]
+                             if not entry["is_dir"] and not entry["rotated"]]
+                self.hits += 1
+            except OSError:
+                self.dirs.pop(path, None)
+                return None
+
+            uid = os.getuid()
+            gids = {os.getgid(), *os.getgroups()}
+            for entry in stale:
+                try:
+                    entry["stat"] = os.stat(entry["path"],
+                                            follow_symlinks=False)
+                    entry["readable"] = is_readable(entry["stat"], uid, gids)
+                except OSError:
+                    # the file will vanish along with the next scan
+                    pass
+            return cached[2]
+
+
+class ResultCache:
+    # results of searching single logfiles on their own, i.e. the line
+    # number and LogScan returned by scan_logfile_worker(), shared by all
+    # requests of a WSGI process up to a total size in bytes, and optionally
+    # kept on disk; a result is keyed by the path and fingerprint of its
+    # logfile, and the search parameters, thus a logfile which has changed
+    # in any way is searched again
+    def __init__(self):
+        self.results = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @staticmethod
+    def filename(cache_dir, key):
+        return os.path.join(cache_dir,
+                            hashlib.sha1(repr(key).encode(
+                                errors="surrogateescape")).hexdigest() +
+                            ".result")
+
+    @staticmethod
+    def result_size(result):
+        # roughly the memory taken by the lines kept
+        return 1024 + result[1].shown_bytes + 128 * len(result[1].lines)
+
+    def get(self, key, cache_dir="", max_size=0):
+        # returns a copy of the result, or None
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return cached[0], cached[1].copy()
+
+        result = None
+        if cache_dir:
+            # kept as JSON, as unpickling a file planted into cache_dir
+            # could run any code
+            filename = self.filename(cache_dir, key)
+            try:
+                with open(filename, "r", encoding="utf-8") as fp:
+                    cached = json.load(fp)
+                if cached["key"] == repr(key):
+                    result = (cached["line_number"],
+                              LogScan.from_json(cached["scan"]))
+                    os.utime(filename)
+            except (OSError, ValueError, KeyError, TypeError,
+                    AttributeError):
+                result = None
+
+        with self.lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if max_size:
+            self.put(key, result, max_size)
+        return result[0], result[1].copy()
+
+    def put(self, key, result, max_size, cache_dir=""):
+        # keeps a copy of the result, and evicts the least recently used
+        # results beyond max_size
+        size = self.result_size(result)
+        if size <= max_size:
+            with self.lock:
+                if key in self.results:
+                    self.size -= self.result_size(self.results.pop(key))
+                self.results[key] = (result[0], result[1].copy())
+                self.size += size
+                while self.size > max_size:
+                    _, evicted = self.results.popitem(last=False)
+                    self.size -= self.result_size(evicted)
+
+        if cache_dir:
+            self.save(cache_dir, key, result)
+
+    def save(self, cache_dir, key, result):
+        # a cache_dir which cannot be written to just keeps the result from
+        # being cached on disk
+        tmpname = None
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=cache_dir, prefix=".logblitz")
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump({"key": repr(key), "line_number": result[0],
+                           "scan": result[1].to_json()}, fp)
+            os.replace(tmpname, self.filename(cache_dir, key))
+        except OSError:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except OSError:
+                    pass
+            return
+
+        now = time.time()
+        if now - self.expired < RESULT_CACHE_EXPIRE_INTERVAL:
+            return
+        self.expired = now
+        try:
+            entries = list(os.scandir(cache_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if (entry.name.endswith(".result") and
+                        entry.stat().st_mtime < now - RESULT_CACHE_MAX_AGE):
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+class Catalog:
+    # the uncompressed size, number of lines, and timestamps of the first and
+    # last line of each logfile which has been read completely, kept in a
+    # JSON file shared by all processes; an entry is valid as long as the
+    # fingerprint of its logfile is unchanged
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.updates = {}
+        self.fingerprint = None
+        self.pruned = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        # reads the file again if another process has changed it; a file
+        # which cannot be read leaves the entries as they are, and its error
+        # is kept for the timings, whereas a file not yet written is none
+        try:
+            fingerprint = logfile_fingerprint(os.stat(self.filename))
+            if fingerprint != self.fingerprint:
+                with open(self.filename, "rb") as fp:
+                    entries = json.load(fp)
+                if not isinstance(entries, dict):
+                    raise ValueError("not a JSON object")
+                self.entries = {**entries, **self.updates}
+                self.fingerprint = fingerprint
+            self.error = None
+        except FileNotFoundError:
+            self.error = None
+        except (OSError, ValueError) as e:
+            self.error = f"Cannot read catalog {self.filename}: {e}"
+
+    def get(self, path, fingerprint):
+        entry = self.entries.get(path)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        return entry
+
+    def update(self, path, fingerprint, stats):
+        with self.lock:
+            entry = {"fingerprint": fingerprint, **stats}
+            self.entries[path] = self.updates[path] = entry
+
+    def save(self):
+        # merges the entries added by this process into the file
+        with self.lock:
+            if not self.updates:
+                return
+            self.refresh()
+            now = time.time()
+            if now - self.pruned >= CATALOG_PRUNE_INTERVAL:
+                self.pruned = now
+                self.entries = {path: entry
+                                for path, entry in self.entries.items()
+                                if os.path.exists(path)}
+
+            # a directory which cannot be written to just keeps the entries
+            # within this process, and its error is kept for the timings
+            tmpname = None
+            try:
+                fd, tmpname = tempfile.mkstemp(
+                    dir=os.path.dirname(self.filename) or ".",
+                    prefix=".logblitz")
+                with os.fdopen(fd, "w") as fp:
+                    json.dump(self.entries, fp)
+                os.replace(tmpname, self.filename)
+                self.fingerprint = logfile_fingerprint(os.stat(self.filename))
+            except OSError as e:
+                self.error = f"Cannot write catalog {self.filename}: {e}"
+                if tmpname:
+                    try:
+                        os.unlink(tmpname)
+                    except OSError:
+                        pass
+                return
+            self.updates.clear()
+
+
+def load_catalog(filename):
+    # returns the catalog of this process, read again if it has changed
+    catalog = catalogs.get(filename)
+    if catalog is None:
+        catalog = catalogs.setdefault(filename, Catalog(filename))
+    with catalog.lock:
+        catalog.refresh()
+    return catalog
+
+
+class LogIndex:
+    # trigram index of a rotated, i.e. immutable logfile; each block of the
+    # uncompressed logfile is described by its offset, length, number of
+    # lines, and a bitmap of the hashed trigrams of its lowercased content;
+    # a compressed logfile is accompanied by checkpoints, see open_region()
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.blocks = []
+        self.checkpoints = []
+        self.total_lines = 0
+        self.total_bytes = 0
+        self.trigrams = set()
+        self.block_bytes = 0
+        self.block_lines = 0
+        self.last_byte = b"\n"
+
+    def feed(self, buf):
+        # adds the next part of the uncompressed logfile, which must end at a
+        # line boundary unless it is the last part
+        pos = 0
+        while pos < len(buf):
+            end = min(pos + INDEX_BLOCK_SIZE - self.block_bytes, len(buf))
+            end = buf.find(b"\n", end - 1) + 1 or len(buf)
+            piece = buf[pos:end].lower()
+            self.trigrams.update(zip(piece, piece[1:], piece[2:]))
+            self.block_bytes += len(piece)
+            self.block_lines += piece.count(b"\n")
+            self.last_byte = piece[-1:]
+            if self.block_bytes >= INDEX_BLOCK_SIZE:
+                self.add_block()
+            pos = end
+
+    def add_block(self):
+        if self.last_byte != b"\n":
+            self.block_lines += 1
+            self.last_byte = b"\n"
+        bitmap = bytearray(1 << (INDEX_BITS - 3))
+        for bit in map(trigram_bit, self.trigrams):
+            bitmap[bit >> 3] |= 1 << (bit & 7)
+        self.blocks.append((self.total_bytes, self.block_bytes,
+                            self.block_lines, bytes(bitmap)))
+        self.total_bytes += self.block_bytes
+        self.total_lines += self.block_lines
+        self.trigrams = set()
+        self.block_bytes = 0
+        self.block_lines = 0
+
+    def finish(self):
+        if self.block_bytes > 0:
+            self.add_block()
+
+    def candidates(self, bits):
+        # returns for each block whether it may contain all of the trigrams
+        return [all(bitmap[bit >> 3] & (1 << (bit & 7)) for bit in bits)
+                for _, _, _, bitmap in self.blocks]
+
+    def save(self, index_dir):
+        header = json.dumps({"version":     INDEX_VERSION,
+                             "path":        self.path,
+                             "fingerprint": self.fingerprint,
+                             "bits":        INDEX_BITS,
+                             "blocks":      len(self.blocks),
+                             "checkpoints": len(self.checkpoints),
+                             "lines":       self.total_lines,
+                             "bytes":       self.total_bytes})
+        fd, tmpname = tempfile.mkstemp(dir=index_dir, prefix=".logblitz")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(header.encode() + b"\n")
+                for offset, length, lines, bitmap in self.blocks:
+                    fp.write(INDEX_BLOCK_STRUCT.pack(offset, length, lines))
+                    fp.write(bitmap)
+                for out_offset, in_offset, bits, window in self.checkpoints:
+                    fp.write(CHECKPOINT_STRUCT.pack(out_offset, in_offset,
+                                                    bits, len(window)))
+                    fp.write(window)
+            os.replace(tmpname, index_filename(index_dir, self.path))
+        except OSError:
+            os.unlink(tmpname)
+            raise
+
+    @staticmethod
+    def load(index_dir, path, fingerprint):
+        # returns the index of path unless it is missing or outdated
+        try:
+            with open(index_filename(index_dir, path), "rb") as fp:
+                header = json.loads(fp.readline())
+                if (header["version"] != INDEX_VERSION or
+                        header["path"] != path or
+                        header["fingerprint"] != fingerprint or
+                        header["bits"] != INDEX_BITS):
+                    return None
+                index = LogIndex(path, fingerprint)
+                bitmap_len = 1 << (INDEX_BITS - 3)
+                for _ in range(header["blocks"]):
+                    offset, length, lines = INDEX_BLOCK_STRUCT.unpack(
+                        fp.read(INDEX_BLOCK_STRUCT.size))
+                    index.blocks.append((offset, length, lines,
+                                         fp.read(bitmap_len)))
+                for _ in range(header["checkpoints"]):
+                    checkpoint = CHECKPOINT_STRUCT.unpack(
+                        fp.read(CHECKPOINT_STRUCT.size))
+                    index.checkpoints.append((*checkpoint[:3],
+                                              fp.read(checkpoint[3])))
+                index.total_lines = header["lines"]
+                index.total_bytes = header["bytes"]
+                return index
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+
+class GzipReader(io.RawIOBase):
+    # decompresses a gzip compressed logfile like gzip.open(), but calls
+    # libz directly, whose inflate() may stop at the end of each deflate
+    # block, and may resume from there given the bits of the compressed
+    # byte it ended in, and the last 32 KiB of uncompressed data; the
+    # checkpoints found after every CHECKPOINT_SPAN uncompressed bytes are
+    # appended to checkpoints, or decompression resumes at checkpoint
+    libz = None
+
+    @classmethod
+    def load_libz(cls):
+        # returns whether libz is available; ctypes is imported just here, as
+        # importing it would slow down every CGI request
+        if cls.libz is None:
+            cls.libz = False
+            import ctypes
+            import ctypes.util
+
+            class ZStream(ctypes.Structure):
+                # zlib's z_stream
+                _fields_ = [("next_in", ctypes.c_void_p),
+                            ("avail_in", ctypes.c_uint),
+                            ("total_in", ctypes.c_ulong),
+                            ("next_out", ctypes.c_void_p),
+                            ("avail_out", ctypes.c_uint),
+                            ("total_out", ctypes.c_ulong),
+                            ("msg", ctypes.c_char_p),
+                            ("state", ctypes.c_void_p),
+                            ("zalloc", ctypes.c_void_p),
+                            ("zfree", ctypes.c_void_p),
+                            ("opaque", ctypes.c_void_p),
+                            ("data_type", ctypes.c_int),
+                            ("adler", ctypes.c_ulong),
+                            ("reserved", ctypes.c_ulong)]
+
+            cls.ctypes = ctypes
+            cls.ZStream = ZStream
+            try:
+                libz = ctypes.CDLL(ctypes.util.find_library("z"))
+                libz.zlibVersion.restype = ctypes.c_char_p
+                # inflateGetDictionary() requires zlib 1.2.8 or later
+                libz.inflateGetDictionary
+                cls.libz = libz
+            except (OSError, AttributeError):
+                pass
+        return bool(cls.libz)
+
+    def __init__(self, path, checkpoints=None, checkpoint=None):
+        ctypes = self.ctypes
+        self.strm = self.ZStream()
+        # close() is called even if open() fails
+        self.fp = None
+        self.fp = open(path, "rb")
+        self.checkpoints = checkpoints
+        self.input = b""
+        # the offsets of self.input within the compressed logfile, and of
+        # the uncompressed data inflated so far
+        self.in_offset = 0
+        self.out_offset = 0
+        self.last_checkpoint = 0
+        # a raw deflate stream, i.e. a resumed gzip member, is followed by
+        # the 8 bytes of the gzip trailer
+        self.raw = checkpoint is not None
+        self.member_end = False
+        self.skip = 0
+
+        if self.raw:
+            self.out_offset, in_offset, bits, window = checkpoint
+            self.in_offset = self.fp.seek(in_offset - (1 if bits else 0))
+        self.check(self.libz.inflateInit2_(
+            ctypes.byref(self.strm), -15 if self.raw else 31,
+            self.libz.zlibVersion(), ctypes.sizeof(self.ZStream)))
+        if self.raw:
+            if bits:
+                byte = self.fp.read(1)
+                self.in_offset += 1
+                self.check(self.libz.inflatePrime(
+                    ctypes.byref(self.strm), bits, byte[0] >> (8 - bits)))
+            self.check(self.libz.inflateSetDictionary(
+                ctypes.byref(self.strm), window, len(window)))
+
+    def check(self, ret):
+        if ret != Z_OK:
+            raise zlib.error(f"Error {ret} while decompressing data")
+
+    def readable(self):
+        return True
+
+    def refill(self):
+        # returns whether further compressed data has been read
+        ctypes = self.ctypes
+        self.in_offset += len(self.input)
+        self.input = self.fp.read(DECOMPRESS_CHUNK_SIZE)
+        self.strm.next_in = ctypes.cast(ctypes.c_char_p(self.input),
+                                        ctypes.c_void_p).value
+        self.strm.avail_in = len(self.input)
+        return bool(self.input)
+
+    def drop(self, num_bytes):
+        self.strm.next_in += num_bytes
+        self.strm.avail_in -= num_bytes
+
+    def readinto(self, b):
+        ctypes = self.ctypes
+        strm = self.strm
+        if not len(b):
+            return 0
+        out = (ctypes.c_char * len(b)).from_buffer(b)
+        strm.next_out = ctypes.addressof(out)
+        strm.avail_out = len(b)
+
+        while strm.avail_out:
+            if not strm.avail_in and not self.refill():
+                if self.member_end and not self.skip:
+                    break
+                raise EOFError("Compressed file ended before the "
+                               "end-of-stream marker was reached")
+            if self.skip:
+                skip = min(self.skip, strm.avail_in)
+                self.drop(skip)
+                self.skip -= skip
+                continue
+            if self.member_end:
+                # the gzip member may be followed by zeroes, or by another
+                # gzip member
+                pos = len(self.input) - strm.avail_in
+                while strm.avail_in and self.input[pos] == 0:
+                    self.drop(1)
+                    pos += 1
+                if not strm.avail_in:
+                    continue
+                self.check(self.libz.inflateReset2(ctypes.byref(strm), 31))
+                self.member_end = False
+
+            avail_out = strm.avail_out
+            ret = self.libz.inflate(ctypes.byref(strm), Z_BLOCK)
+            self.out_offset += avail_out - strm.avail_out
+            if ret == Z_STREAM_END:
+                self.member_end = True
+                self.skip = 8 if self.raw else 0
+                self.raw = False
+            elif ret not in (Z_OK, Z_BUF_ERROR):
+                raise zlib.error(f"Error {ret} while decompressing data")
+            elif (self.checkpoints is not None and
+                  strm.data_type & 0xc0 == 0x80 and
+                  self.out_offset - self.last_checkpoint >= CHECKPOINT_SPAN):
+                # the end of a deflate block other than the last one
+                window = ctypes.create_string_buffer(32 * 1024)
+                window_len = ctypes.c_uint()
+                self.check(self.libz.inflateGetDictionary(
+                    ctypes.byref(strm), window, ctypes.byref(window_len)))
+                self.checkpoints.append(
+                    (self.out_offset,
+                     self.in_offset + len(self.input) - strm.avail_in,
+                     strm.data_type & 7, window.raw[:window_len.value]))
+                self.last_checkpoint = self.out_offset
+
+        return len(b) - strm.avail_out
+
+    def close(self):
+        ctypes = self.ctypes
+        if self.fp and not self.closed:
+            self.libz.inflateEnd(ctypes.byref(self.strm))
+            self.fp.close()
+        super().close()
+
+
+class XzReader(io.RawIOBase):
+    # decompresses the blocks of a xz compressed logfile from compressed
+    # offset start to end, see xz_checkpoints()
+    def __init__(self, path, start, end):
+        self.fp = open(path, "rb")
+        # the blocks are decompressed as if they followed the stream header
+        self.input = self.fp.read(XZ_HEADER_SIZE)
+        self.fp.seek(start)
+        self.remaining = end - start
+        self.decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while True:
+            if self.decompressor.needs_input:
+                data = self.fp.read(min(self.remaining,
+                                        DECOMPRESS_CHUNK_SIZE))
+                self.remaining -= len(data)
+                if not data and not self.input:
+                    return 0
+                self.input += data
+            out = self.decompressor.decompress(self.input, len(b))
+            self.input = b""
+            if out:
+                b[:len(out)] = out
+                return len(out)
+
+    def close(self):
+        if not self.closed:
+            self.fp.close()
+        super().close()
+
+
+class RegionReader(io.RawIOBase):
+    # reads length bytes from fp after skipping its first skip bytes
+    def __init__(self, fp, skip, length):
+        self.fp = fp
+        self.skip = skip
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.remaining:
+            return 0
+        while self.skip > 0:
+            skipped = len(self.fp.read(min(self.skip, DECOMPRESS_CHUNK_SIZE)))
+            if not skipped:
+                return 0
+            self.skip -= skipped
+        num_bytes = self.fp.readinto(
+            memoryview(b)[:min(len(b), self.remaining)])
+        self.remaining -= num_bytes
+        return num_bytes
+
+    def close(self):
+        if not self.closed:
+            self.fp.close()
+        super().close()
+
+
+class LogScan:
+    def __init__(self, charset, bytewise, limit_lines, limit_bytes, reverse,
+                 before, after, timed=False):
+        self.charset = charset
+        self.bytewise = bytewise
+        # whether the time spent decoding each line is measured
+        self.timed = timed
+        self.limit_lines = limit_lines
+        self.limit_bytes = limit_bytes
+        self.reverse = reverse
+        self.before = before
+        self.after = after
+        self.shown_lines = 0
+        self.shown_bytes = 0
+        self.matching_lines = 0
+        self.matching_bytes = 0
+        self.total_lines = 0
+        self.total_bytes = 0
+        self.partial = False
+        self.start_file()
+
+    def start_file(self):
+        self.b4buf = collections.deque(maxlen=self.before)
+        self.lines = collections.deque()
+        self.num_after = self.after
+        self.pending = collections.deque(maxlen=self.after)
+        self.num_before = 0
+        # shown lines and bytes prior to the last match which was shown, and
+        # whether any match was not shown or has been evicted due to the
+        # limits; see merge()
+        self.last_shown = (0, 0)
+        self.rejected = False
+        # number of the first match which was not shown due to the limits,
+        # where the next page continues in forward mode, see search_lines()
+        self.first_rejected = None
+        # offset and number of the lines in front of the line the logfile
+        # has been searched from, see scan_logfile()
+        self.file_start = (0, 0)
+        # inode and size of the logfile as far as it has been read entirely
+        self.file_end = None
+        # uncompressed size, number of lines, and timestamps of the first and
+        # last line of the logfile if it has been read completely, see
+        # Catalog
+        self.file_stats = None
+        # seconds spent searching the logfile, waiting for its content and
+        # decompressing it, and decoding its lines if timed, see Timings
+        self.file_times = {"scan": 0.0, "wait": 0.0, "decompress": 0.0,
+                           "decode": 0.0}
+
+    def limits_reached(self):
+        return (self.limit_lines <= self.shown_lines or
+                self.limit_bytes <= self.shown_bytes)
+
+    def copy(self):
+        # merge() takes over the lines of other, and may clear them
+        other = copy.copy(self)
+        other.lines = collections.deque(self.lines)
+        return other
+
+    def lines_to_json(self, lines):
+        # undecoded lines are kept as latin-1, which maps each byte to a
+        # single character
+        return [(line.decode("latin-1") if self.bytewise else line, *rest)
+                for line, *rest in lines]
+
+    def lines_from_json(self, lines):
+        return [(line.encode("latin-1") if self.bytewise else line, *rest)
+                for line, *rest in lines]
+
+    def to_json(self):
+        # returns the state as JSON compatible values, see from_json()
+        state = dict(vars(self))
+        for name in ("lines", "b4buf", "pending"):
+            state[name] = self.lines_to_json(state[name])
+        return state
+
+    @classmethod
+    def from_json(cls, state):
+        # returns the LogScan of a state returned by to_json()
+        scan = cls.__new__(cls)
+        vars(scan).update(state)
+        for name, maxlen in (("lines", None), ("b4buf", scan.before),
+                             ("pending", scan.after)):
+            setattr(scan, name, collections.deque(
+                scan.lines_from_json(state[name]), maxlen))
+        scan.last_shown = tuple(scan.last_shown)
+        scan.file_start = tuple(scan.file_start)
+        if scan.file_end is not None:
+            scan.file_end = tuple(scan.file_end)
+        return scan
+
+    def merge(self, other):
+        # takes over a logfile which other has searched on its own, i.e.
+        # without the lines shown for previous logfiles, and returns False if
+        # the logfile must be searched again as other has chosen other lines
+        # to show than this LogScan would have chosen
+        if self.limits_reached() and not self.reverse:
+            # no line of this logfile would have been shown at all
+            other.first_rejected = min(
+                (line[3] for line in other.lines if line[1]),
+                default=other.first_rejected)
+            other.lines.clear()
+            other.shown_lines = other.shown_bytes = 0
+        elif (self.shown_lines > 0 or self.shown_bytes > 0) and (
+                self.reverse or other.rejected or
+                self.shown_lines + other.last_shown[0] >= self.limit_lines or
+                self.shown_bytes + other.last_shown[1] >= self.limit_bytes):
+            return False
+
+        self.lines = other.lines
+        self.first_rejected = other.first_rejected
+        self.file_start = other.file_start
+        self.file_end = other.file_end
+        self.file_stats = other.file_stats
+        self.file_times = other.file_times
+        self.shown_lines += other.shown_lines
+        self.shown_bytes += other.shown_bytes
+        self.matching_lines += other.matching_lines
+        self.matching_bytes += other.matching_bytes
+        self.total_lines += other.total_lines
+        self.total_bytes += other.total_bytes
+        self.partial = self.partial or other.partial
+        return True
+
+    # lines are kept as read, i.e. undecoded if bytewise, along with whether
+    # they match; their matches are not located until they are rendered, see
+    # search_lines()
+
+    # add_nonmatching() and add_matching() return True as soon as the limits
+    # are reached and the after context of the last match is complete, i.e.
+    # any further line just adds to the totals
+
+    def add_nonmatching(self, line, len_line, line_number):
+        if self.num_after < self.after:
+            self.lines.append((line, False, len_line, line_number))
+            self.num_after += 1
+            return self.num_after >= self.after and self.limits_reached()
+
+        self.b4buf.append((line, False, len_line, line_number))
+        return False
+
+    def add_matching(self, line, len_line, line_number):
+        self.matching_lines += 1
+        self.matching_bytes += len_line
+
+        while (self.reverse and len(self.lines) > 0 and
+               (self.limit_lines <= self.shown_lines or
+                self.limit_bytes <= self.shown_bytes)):
+            self.shown_lines -= 1
+            tmpline = self.lines.popleft()
+            self.shown_bytes -= tmpline[2]
+            self.rejected = True
+
+        if (self.limit_lines > self.shown_lines and
+                self.limit_bytes > self.shown_bytes):
+            self.last_shown = (self.shown_lines, self.shown_bytes)
+            for tmpline in self.b4buf:
+                self.shown_lines += 1
+                self.shown_bytes += tmpline[2]
+            self.lines.extend(self.b4buf)
+            self.b4buf.clear()
+            self.num_after = 0
+            self.shown_lines += 1
+            self.shown_bytes += len_line
+            self.lines.append((line, True, len_line, line_number))
+        else:
+            # the after context of the last match shown ends in front of the
+            # first one not shown, where the next page continues
+            self.num_after = self.after
+            self.rejected = True
+            if self.first_rejected is None:
+                self.first_rejected = line_number
+
+        return self.num_after >= self.after and self.limits_reached()
+
+    # the *_backwards() methods are fed with the lines of a logfile starting
+    # with the last one, so lines seen earlier are after context and lines
+    # seen later are before context; they return True as soon as the limits
+    # are reached and the before context of the last match is complete
+
+    def add_nonmatching_backwards(self, line, len_line, line_number):
+        if self.num_before <= 0:
+            self.pending.append((line, False, len_line, line_number))
+            return False
+
+        self.num_before -= 1
+        self.shown_lines += 1
+        self.shown_bytes += len_line
+        self.lines.appendleft((line, False, len_line, line_number))
+        return self.num_before <= 0 and self.limits_reached()
+
+    def add_matching_backwards(self, line, len_line, line_number):
+        self.matching_lines += 1
+        self.matching_bytes += len_line
+
+        if self.limits_reached():
+            self.rejected = True
+            return self.add_nonmatching_backwards(line, len_line, line_number)
+
+        self.last_shown = (self.shown_lines, self.shown_bytes)
+        self.lines.extendleft(self.pending)
+        self.pending.clear()
+        self.num_before = self.before
+        self.shown_lines += 1
+        self.shown_bytes += len_line
+        self.lines.appendleft((line, True, len_line, line_number))
+        return self.num_before <= 0 and self.limits_reached()
+
+
 def bytes_pretty(filesize):
     if filesize < 1024:
         return f"{filesize}B"
@@ -50,149 +1330,2019 @@ def bytes_pretty(filesize):
     return f"{filesize:.2f}{suffix}"
 
 
-def logfile_number_sorter(entry):
-    m = re.search(r"(?i:\.(\d+)(\.(bz2|gz|xz))?)$", entry.name)
-    return int(m.group(1)) if m else -1
+def logfile_sort_key(name):
+    # sorts rotated logfiles by their number right after their current
+    # logfile, e.g. messages, messages.1, messages.2.gz, ..., messages.10.xz
+    m = LOGFILE_NUMBER_RE.match(name)
+    return (m.group(1), int(m.group(2))) if m else (name, -1)
 
 
-def logfile_prefix_sorter(entry):
-    m = re.match(r"(?i:(.*)\.(\d+)(\.(bz2|gz|xz))?)$", entry.name)
-    return m.group(1) if m else entry.name
+def is_readable(stat, uid, gids):
+    # tells from the owner and mode of a file whether it may be read, like
+    # os.access() does, but without a syscall; ACLs are not considered
+    if uid == 0:
+        return True
+    if stat.st_uid == uid:
+        return stat.st_mode & 0o400 != 0
+    if stat.st_gid in gids:
+        return stat.st_mode & 0o040 != 0
+    return stat.st_mode & 0o004 != 0
+
+
+# directory listings, search results, and metrics shared by all requests of
+# this process
+dir_cache = DirCache()
+result_cache = ResultCache()
+metrics = Metrics()
+# signs the tokens of the next pages of searches unless the config file
+# sets page_secret, see encode_page_token()
+page_key = secrets.token_bytes(32)
+
+
+def is_rotated(path, mtime):
+    # rotated logfiles are not written anymore, see ROTATED_MIN_AGE
+    if LOGFILE_NUMBER_RE.match(os.path.basename(path)):
+        return True
+    return (re.search(r"(?i:\.(bz2|gz|xz))$", path) is not None and
+            time.time() - mtime >= ROTATED_MIN_AGE)
 
 
 def traverse_logdir(logdir, cfgdirfilter_re, cfgfilefilter_re, filefilter_re,
                     logfiles, showdotfiles, showunreadables,
-                    subdir="", indent=0):
+                    subdir="", indent=0, use_inotify=False, expand=None):
+    # the filters are applied to the cached listings of the directories;
+    # returns whether any logfile is shown below subdir; if expand is given,
+    # only the subdirectories named therein are traversed, and any other is
+    # shown collapsed, see list_logdir()
+    entries = dir_cache.listing(os.path.join(logdir, subdir), use_inotify)
+    if entries is None:
+        return False
+
+    dir2files = logfiles.dir2files.setdefault(logdir, [])
+    num_shown = len(dir2files)
+
+    for entry in entries:
+        name = entry["name"]
+        if not showdotfiles and name.startswith("."):
+            continue
+
+        if entry["is_dir"]:
+            if not cfgdirfilter_re.search(name):
+                continue
+
+            logfiles.total_dirs += 1
+            if expand is not None and entry["path"] not in expand:
+                # its logfiles are unknown until the user expands it
+                dir2files.append({
+                    "name":   name + os.path.sep,
+                    "indent": indent,
+                    "ls":     entry["path"]
+                })
+                shown = True
+            else:
+                # a subdirectory precedes its logfiles, and is removed again
+                # if none of them is shown
+                dir2files.append({
+                    "name":   name + os.path.sep,
+                    "indent": indent
+                })
+                shown = traverse_logdir(logdir, cfgdirfilter_re,
+                                        cfgfilefilter_re, filefilter_re,
+                                        logfiles, showdotfiles,
+                                        showunreadables,
+                                        os.path.join(subdir, name),
+                                        indent + 1, use_inotify, expand)
+            if shown:
+                logfiles.shown_dirs += 1
+
+                candid_name_indent_len = len(name) + 1 + 2 * indent
+                if candid_name_indent_len > logfiles.max_name_indent_len:
+                    logfiles.max_name_indent_len = candid_name_indent_len
+            else:
+                dir2files.pop()
+
+        elif cfgfilefilter_re.search(name):
+            stat = entry["stat"]
+
+            logfiles.total_files += 1
+            logfiles.total_bytes += stat.st_size
+
+            readable = entry["readable"]
+
+            if (filefilter_re.search(name) and
+                (showunreadables or
+                 readable)):
+                logfiles.shown_files += 1
+                logfiles.shown_bytes += stat.st_size
+
+                dir2files.append({
+                    "name":     name,
+                    "readable": readable,
+                    "indent":   indent,
+                    "path":     entry["path"],
+                    "mtime":    stat.st_mtime,
+                    "size":     stat.st_size,
+                    "fingerprint": logfile_fingerprint(stat)
+                })
+
+                candid_name_indent_len = len(name) + 2 * indent
+                if candid_name_indent_len > logfiles.max_name_indent_len:
+                    logfiles.max_name_indent_len = candid_name_indent_len
+
+    return len(dir2files) > num_shown
+
+
+def list_logdir(path, logdirs, cfgdirfilter_re, cfgfilefilter_re,
+                filefilter_re, showdotfiles, showunreadables,
+                use_inotify=False):
+    # lists the subdirectories and logfiles of a single directory for ?ls=,
+    # which must be one of the logdirs, or a subdirectory thereof that
+    # traverse_logdir() would show; returns None otherwise
+    for logdir in logdirs:
+        logdir = logdir.removesuffix(os.path.sep)
+        if path != logdir and not path.startswith(logdir + os.path.sep):
+            continue
+
+        subdir = path[len(logdir) + 1:]
+        parent = logdir
+        for name in subdir.split(os.path.sep) if subdir else []:
+            entries = dir_cache.listing(parent, use_inotify)
+            if (entries is None or
+                    (not showdotfiles and name.startswith(".")) or
+                    not cfgdirfilter_re.search(name) or
+                    not any(entry["is_dir"] and entry["name"] == name
+                            for entry in entries)):
+                break
+            parent = os.path.join(parent, name)
+        else:
+            logfiles = LogFiles()
+            traverse_logdir(logdir, cfgdirfilter_re, cfgfilefilter_re,
+                            filefilter_re, logfiles, showdotfiles,
+                            showunreadables, subdir, 0, use_inotify, set())
+            listing = logfiles.dir2files.get(logdir, [])
+            for logfile in listing:
+                if "path" in logfile:
+                    del logfile["fingerprint"]
+                    logfile["size_human"] = bytes_pretty(logfile["size"])
+                    logfile["mtime_human"] = datetime.datetime.fromtimestamp(
+                        logfile["mtime"]).strftime(DATETIME_FMT)
+            return listing
+
+    return None
+
+
+def is_bytewise_charset(charset):
+    # matching undecoded lines is safe only for charsets which encode ASCII
+    # as itself and never put ASCII bytes into multibyte sequences, i.e.
+    # UTF-8 and single byte charsets, but not UTF-16, Shift JIS, and so on
     try:
-        entries = os.scandir(os.path.join(logdir, subdir))
-    except OSError:
+        codec = codecs.lookup(charset)
+        ascii_bytes = bytes(range(128))
+        if ascii_bytes.decode(codec.name) != ascii_bytes.decode("ascii"):
+            return False
+    except (LookupError, UnicodeDecodeError):
         return False
 
-    if not showdotfiles:
-        entries = filter(lambda entry: not entry.name.startswith("."),
-                         entries)
-    entries = sorted(entries, key=logfile_number_sorter)
-    entries = sorted(entries, key=logfile_prefix_sorter)
+    if codec.name == "utf-8":
+        return True
+
+    decoder = codec.incrementaldecoder(errors="replace")
+    return all(len(decoder.decode(bytes((b,)))) == 1 for b in range(128, 256))
+
+
+def is_bytewise_query(query, charset, ignorecase, regex):
+    # tells whether query may be matched against undecoded lines
+    bytewise = is_bytewise_charset(charset)
+
+    if bytewise and query:
+        # bytes.lower() and bytes regexes fold ASCII letters only
+        bytewise = query.isascii() or not ignorecase
+
+    if bytewise and regex and query:
+        # \w, \d, \s, and \b are ASCII only for bytes regexes, which lack
+        # \N, \u, and \U; whereas ., character classes, and quantifiers
+        # apply to single bytes of a multibyte character
+        bytewise = not re.search(r"\\[wWdDsSbBNuU]", query)
+        if bytewise and codecs.lookup(charset).name == "utf-8":
+            bytewise = query.isascii() and not re.search(r"[.[]", query)
+
+    if bytewise and query:
+        try:
+            query.encode(charset)
+        except UnicodeEncodeError:
+            bytewise = False
+
+    return bytewise
+
+
+def compile_matcher(query, charset, ignorecase, regex, boolean=False):
+    # returns an error message, a function which tells whether a line
+    # matches, a generator function which yields the spans of all matches
+    # within a line, a function which returns the offset of the next match
+    # within a whole buffer (or None if the query cannot be searched for in a
+    # whole buffer), and whether these functions expect undecoded lines
+    if boolean:
+        query = query.strip()
+    if boolean and query:
+        return compile_boolean(query, charset, ignorecase, regex)
+    return compile_term(query, charset, ignorecase, regex,
+                        is_bytewise_query(query, charset, ignorecase, regex))
+
+
+def compile_term(query, charset, ignorecase, regex, bytewise):
+    # compiles a single search expression, see compile_matcher()
+    if bytewise and query:
+        query = query.encode(charset)
+
+    if regex and query:
+        # any match must contain the longest literal of the query, which is
+        # looked for far quicker than the regex; bytes.lower() folds just
+        # like a bytes regex, whereas str.lower() differs from a regex in
+        # folding some Unicode letters
+        literal = max(required_literals(query), key=len, default=None)
+        folded = ignorecase or re.search(
+            rb"\(\?[a-zA-Z]*i" if bytewise else r"\(\?[a-zA-Z]*i", query)
+        if folded and not bytewise:
+            literal = None
+        elif folded and literal:
+            literal = literal.lower()
+
+        if ignorecase:
+            query = b"(?i:%s)" % (query,) if bytewise else f"(?i:{query})"
+        try:
+            query_re = re.compile(query)
+        except Exception as e:
+            return str(e), None, None, None, bytewise
+
+        if not literal:
+            tester = query_re.search
+        elif folded:
+            def tester(line):
+                return literal in line.lower() and query_re.search(line)
+        else:
+            def tester(line):
+                return literal in line and query_re.search(line)
+
+        def matcher(line):
+            matchee = query_re.search(line, 0)
+            while matchee:
+                yield matchee.span()
+                matchee = query_re.search(
+                    line,
+                    matchee.end() + int(matchee.end() == matchee.start())
+                )
+
+        # within a whole buffer, the literal just leads to the lines which
+        # the tester verifies; otherwise ^ and $ must match at each line,
+        # whereas \A, \Z, and lookarounds would see the neighbouring lines
+        if bytewise and literal and not folded:
+            def finder(buf, pos):
+                return buf.find(literal, pos)
+        elif bytewise and literal:
+            literal_re = re.compile(b"(?i)" + re.escape(literal))
+
+            def finder(buf, pos):
+                matchee = literal_re.search(buf, pos)
+                return matchee.start() if matchee else -1
+        elif bytewise and not re.search(rb"\\[AZz]|\(\?<?[=!]", query):
+            buffer_re = re.compile(b"(?m)" + query)
+
+            def finder(buf, pos):
+                matchee = buffer_re.search(buf, pos)
+                return matchee.start() if matchee else -1
+        else:
+            finder = None
+    elif query:
+        if not ignorecase:
+            fold_string = bytes if bytewise else str
+        else:
+            fold_string = bytes.lower if bytewise else str.lower
+        query_folded = fold_string(query)
+
+        if not ignorecase:
+            def tester(line):
+                return query_folded in line
+        else:
+            def tester(line):
+                return query_folded in fold_string(line)
+
+        def matcher(line):
+            line_folded = fold_string(line)
+            start = line_folded.find(query_folded)
+            while start >= 0:
+                end = start + len(query_folded)
+                yield start, end
+                start = line_folded.find(query_folded, end)
+
+        if not bytewise:
+            finder = None
+        elif ignorecase:
+            buffer_re = re.compile(b"(?i)" + re.escape(query))
+
+            def finder(buf, pos):
+                matchee = buffer_re.search(buf, pos)
+                return matchee.start() if matchee else -1
+        else:
+            def finder(buf, pos):
+                return buf.find(query, pos)
+    else:
+        def tester(_):
+            return True
+
+        def matcher(_):
+            yield 0, 0
+
+        finder = None
+
+    return None, tester, matcher, finder, bytewise
+
+
+def parse_boolean_query(query, regex):
+    # parses terms combined by AND (or just by juxtaposition), OR, NOT (or a
+    # leading -), and parentheses, where NOT binds tightest and OR loosest;
+    # a term is a word or a "quoted phrase", either of which is a regex if
+    # regex is set, or a /regex/
+    # returns a tree of ("and", [nodes]), ("or", [nodes]), ("not", node),
+    # and ("term", text, is_regex) tuples, or raises ValueError
+    tokens = []
+    for m in re.finditer(r'\s*(?:([()])|(-?)(?:"((?:[^"\\]|\\.)*)"|'
+                         r'/((?:[^/\\]|\\.)+)/)?([^\s()]*))', query):
+        paren, negated, phrase, pattern, word = m.groups()
+        text = m.group(0).lstrip()
+        if paren:
+            tokens.append(paren)
+        elif word or (phrase is None and pattern is None):
+            # e.g. "quoted"word or /var/log is just a word
+            if text in ("AND", "OR", "NOT"):
+                tokens.append(text)
+            elif text.startswith("-") and len(text) > 1:
+                tokens += ["NOT", ("term", text[1:], regex)]
+            elif text == "-" and query.startswith("(", m.end()):
+                # e.g. -(a OR b)
+                tokens.append("NOT")
+            elif text:
+                tokens.append(("term", text, regex))
+        else:
+            if negated:
+                tokens.append("NOT")
+            if pattern is None:
+                tokens.append(("term", re.sub(r"\\(.)",
+                                              lambda m: m.group(1), phrase),
+                               regex))
+            else:
+                tokens.append(("term", pattern, True))
+
+    pos = 0
+
+    def parse_or():
+        nonlocal pos
+        nodes = [parse_and()]
+        while pos < len(tokens) and tokens[pos] == "OR":
+            pos += 1
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nonlocal pos
+        nodes = [parse_not()]
+        while pos < len(tokens) and tokens[pos] not in (")", "OR"):
+            if tokens[pos] == "AND":
+                pos += 1
+            nodes.append(parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise ValueError("missing term at end of query")
+        token = tokens[pos]
+        pos += 1
+        if token == "NOT":
+            return ("not", parse_not())
+        if token == "(":
+            node = parse_or()
+            if pos >= len(tokens):
+                raise ValueError("missing ), unterminated parenthesis")
+            pos += 1
+            return node
+        if isinstance(token, tuple):
+            return token
+        raise ValueError(f"unexpected {token} at term {pos}")
+
+    tree = parse_or()
+    if pos < len(tokens):
+        raise ValueError(f"unbalanced parenthesis at term {pos + 1}")
+    return tree
+
+
+def boolean_terms(node):
+    # yields all terms of a tree returned by parse_boolean_query()
+    if node[0] == "term":
+        yield node
+    elif node[0] == "not":
+        yield from boolean_terms(node[1])
+    else:
+        for child in node[1]:
+            yield from boolean_terms(child)
+
+
+def compile_boolean(query, charset, ignorecase, regex):
+    # compiles a query parsed by parse_boolean_query(), see compile_matcher()
+    # each line is tested term by term until its result is known, literals
+    # first; a whole buffer is searched for any of the terms of which each
+    # matching line contains at least one by a single alternation, and just
+    # the terms not negated are highlighted
+    try:
+        tree = parse_boolean_query(query, regex)
+    except ValueError as e:
+        return str(e), None, None, None, False
+
+    bytewise = all(is_bytewise_query(text, charset, ignorecase, term_regex)
+                   for _, text, term_regex in boolean_terms(tree))
+    matchers = []
+
+    def build(node, negated):
+        # returns the tester of node, and the terms along with their finders
+        # one of which any line matching node contains, or None
+        if node[0] == "term":
+            error, tester, matcher, finder, _ = compile_term(
+                node[1], charset, ignorecase, node[2], bytewise)
+            if error:
+                raise ValueError(error)
+            if not negated:
+                matchers.append(matcher)
+            return tester, [(node, finder)]
+
+        if node[0] == "not":
+            child_tester, _ = build(node[1], not negated)
+
+            def tester(line):
+                return not child_tester(line)
+            return tester, None
+
+        built = [build(child, negated) for child in sorted(
+            node[1], key=lambda child: 2 if child[0] != "term" else
+            int(child[2]))]
+        testers = [child_tester for child_tester, _ in built]
+        covers = [cover for _, cover in built]
+
+        if node[0] == "and":
+            def tester(line):
+                for child_tester in testers:
+                    if not child_tester(line):
+                        return False
+                return True
+            return tester, min(filter(None, covers), key=len, default=None)
+
+        def tester(line):
+            for child_tester in testers:
+                if child_tester(line):
+                    return True
+            return False
+        return tester, (None if None in covers else
+                        [term for cover in covers for term in cover])
+
+    try:
+        tester, cover = build(tree, False)
+    except ValueError as e:
+        return str(e), None, None, None, bytewise
+
+    def matcher(line):
+        # merges the overlapping spans of different terms
+        spans = sorted(span for term_matcher in matchers
+                       for span in term_matcher(line))
+        start = end = None
+        for span in spans:
+            if end is not None and span[0] <= end:
+                end = max(end, span[1])
+                continue
+            if end is not None:
+                yield start, end
+            start, end = span
+        if end is not None:
+            yield start, end
+
+    finder = None
+    if bytewise and cover and len(cover) == 1:
+        finder = cover[0][1]
+    elif bytewise and cover:
+        alternatives = []
+        for (_, text, term_regex), _ in cover:
+            text = text.encode(charset)
+            if term_regex and re.search(rb"\\[AZz]|\(\?<?[=!]", text):
+                alternatives = None
+                break
+            alternatives.append(text if term_regex else re.escape(text))
+        try:
+            cover_re = alternatives and re.compile(
+                (b"(?mi)" if ignorecase else b"(?m)") +
+                b"|".join(b"(?:%s)" % (alternative,)
+                          for alternative in alternatives))
+        except Exception:
+            cover_re = None
+
+        if cover_re:
+            def finder(buf, pos):
+                matchee = cover_re.search(buf, pos)
+                return matchee.start() if matchee else -1
+
+    return None, tester, matcher, finder, bytewise
+
+
+def trigram_bit(trigram):
+    return (((trigram[0] << 16 | trigram[1] << 8 | trigram[2]) * 2654435761)
+            & 0xffffffff) >> (32 - INDEX_BITS)
+
+
+def index_filename(index_dir, path):
+    return os.path.join(index_dir,
+                        hashlib.sha1(path.encode(errors="surrogateescape"))
+                        .hexdigest() + ".idx")
+
+
+def logfile_fingerprint(stat):
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def required_literals(pattern):
+    # returns strings, or bytes for a bytes pattern, which any match of the
+    # regex pattern must contain
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+
+    if isinstance(pattern, bytes):
+        join = bytes
+    else:
+        def join(literal):
+            return "".join(map(chr, literal))
+    literals = []
+
+    def walk(items):
+        literal = []
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                literal.append(av)
+                continue
+            if literal:
+                literals.append(join(literal))
+                literal = []
+            if op is sre_parse.SUBPATTERN:
+                walk(av[-1])
+            elif (op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and
+                  av[0] >= 1):
+                walk(av[2])
+        if literal:
+            literals.append(join(literal))
+
+    walk(parsed)
+    return literals
+
+
+def required_terms(node):
+    # returns the terms of a tree returned by parse_boolean_query() which
+    # any matching line contains
+    if node[0] == "term":
+        return [node[1:]]
+    if node[0] == "and":
+        return [term for child in node[1] for term in required_terms(child)]
+    return []
+
+
+def query_trigrams(query, charset, ignorecase, regex, boolean, invert,
+                   bytewise):
+    # returns the hashed trigrams which a line must contain to match query,
+    # or None if no line can be ruled out by a trigram index
+    # the index folds ASCII letters only, whereas decoded lines may match
+    # case insensitively by any Unicode letter
+    if (invert or not query or not is_bytewise_charset(charset) or
+            (ignorecase and not bytewise)):
+        return None
+
+    if boolean:
+        try:
+            terms = required_terms(parse_boolean_query(query, regex))
+        except ValueError:
+            return None
+    else:
+        terms = [(query, regex)]
+
+    bits = set()
+    for literal in (literal for term, term_regex in terms
+                    for literal in (required_literals(term) if term_regex
+                                    else (term,))):
+        if "\ufffd" in literal:
+            # may match an undecodable byte sequence
+            continue
+        try:
+            literal = literal.encode(charset).lower()
+        except UnicodeEncodeError:
+            continue
+        for part in literal.split(b"\n"):
+            bits.update(map(trigram_bit, zip(part, part[1:], part[2:])))
+
+    return bits or None
+
+
+def open_logfile(path, checkpoints=None):
+    # returns a file object of the uncompressed content, and the size of an
+    # uncompressed logfile or None; if checkpoints is a list, the checkpoints
+    # of a gzip or xz compressed logfile are appended to it, see open_region()
+    if path.lower().endswith(".gz"):
+        if checkpoints is not None and GzipReader.load_libz():
+            return GzipReader(path, checkpoints), None
+        return gzip.open(path, "rb"), None
+    elif path.lower().endswith(".bz2"):
+        return bz2.open(path, "rb"), None
+    elif path.lower().endswith(".xz"):
+        if checkpoints is not None:
+            checkpoints.extend(xz_checkpoints(path))
+        return lzma.open(path, "rb"), None
+
+    fp = open(path, "rb")
+    return fp, os.fstat(fp.fileno()).st_size
+
+
+def xz_checkpoints(path):
+    # returns a checkpoint at the start of each block of a xz compressed
+    # logfile, and one at the end of its last block, as listed by its index,
+    # if it consists of a single stream of several blocks, as written e.g.
+    # by multithreaded xz
+    def number(buf, pos):
+        # decodes a variable length integer
+        value = shift = 0
+        while buf[pos] & 0x80:
+            value |= (buf[pos] & 0x7f) << shift
+            shift += 7
+            pos += 1
+        return value | buf[pos] << shift, pos + 1
+
+    try:
+        with open(path, "rb") as fp:
+            header = fp.read(XZ_HEADER_SIZE)
+            size = fp.seek(0, os.SEEK_END)
+            fp.seek(size - XZ_FOOTER_SIZE)
+            footer = fp.read(XZ_FOOTER_SIZE)
+            index_size = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+            index_start = fp.seek(size - XZ_FOOTER_SIZE - index_size)
+            index = fp.read(index_size)
+        if (header[:6] != b"\xfd7zXZ\0" or footer[10:] != b"YZ" or
+                index[0] != 0):
+            return []
+
+        checkpoints = []
+        in_offset, out_offset = XZ_HEADER_SIZE, 0
+        num_blocks, pos = number(index, 1)
+        for _ in range(num_blocks):
+            unpadded_size, pos = number(index, pos)
+            uncompressed_size, pos = number(index, pos)
+            checkpoints.append((out_offset, in_offset, 0, b""))
+            in_offset += (unpadded_size + 3) & ~3
+            out_offset += uncompressed_size
+    except (OSError, ValueError, IndexError, struct.error):
+        return []
+
+    if num_blocks < 2 or in_offset != index_start:
+        return []
+    checkpoints.append((out_offset, in_offset, 0, b""))
+    return checkpoints
+
+
+def open_region(path, checkpoints, start, end):
+    # returns a file object of the uncompressed content of a compressed
+    # logfile from offset start to end, which is decompressed from the last
+    # of its checkpoints in front of start; a checkpoint consists of an
+    # uncompressed and compressed offset, and, for gzip, of the number of
+    # bits of the preceding compressed byte, and the preceding 32 KiB of
+    # uncompressed data
+    pos = bisect.bisect_right(checkpoints, (start, sys.maxsize)) - 1
+    if path.lower().endswith(".xz"):
+        out_offset, in_offset = checkpoints[pos][:2]
+        in_end = next(checkpoint[1] for checkpoint in checkpoints
+                      if checkpoint[0] >= end)
+        fp = XzReader(path, in_offset, in_end)
+    elif pos >= 0:
+        out_offset = checkpoints[pos][0]
+        fp = GzipReader(path, checkpoint=checkpoints[pos])
+    else:
+        out_offset = 0
+        fp = GzipReader(path)
+    return RegionReader(fp, start - out_offset, end - start)
+
+
+def region_checkpoints(path, index):
+    # returns the checkpoints from which a compressed logfile may be
+    # decompressed according to index, or None
+    if (not index or not index.checkpoints or
+            not (path.lower().endswith(".xz") or GzipReader.load_libz())):
+        return None
+    return index.checkpoints
+
+
+def build_index(index_dir, path):
+    # (re)builds the trigram index of a rotated logfile unless it is current
+    fingerprint = logfile_fingerprint(os.stat(path))
+    if LogIndex.load(index_dir, path, fingerprint):
+        return False
+
+    index = LogIndex(path, fingerprint)
+    fp, _ = open_logfile(path, index.checkpoints)
+    with fp:
+        for buf in read_chunks(fp):
+            index.feed(buf)
+    index.finish()
+    index.save(index_dir)
+    return True
+
+
+def timestamp_parser(timestamp_re, mtime):
+    # returns a function, which returns the timestamp of the line starting at
+    # buf[bol] in seconds since the epoch, or None
+    # syslog omits the year, which thus is guessed by the modification time
+    # of the logfile, as no line can be younger than the logfile itself
+    mtime_year = time.localtime(mtime).tm_year
+
+    def timestamp(buf, bol, eol):
+        m = timestamp_re.match(buf[bol:min(eol, bol + TIMESTAMP_MAX_LEN)])
+        if not m:
+            return None
+        fields = m.groupdict()
+        try:
+            year = int(fields["Y"]) if fields.get("Y") else mtime_year
+            month = (MONTHS[fields["b"]] if fields.get("b") else
+                     int(fields["m"]))
+            day, hour, minute, second = (int(fields[k]) for k in "dHMS")
+            zone = fields.get("z")
+            if zone:
+                zone = zone.replace(b":", b"")
+                offset = (0 if zone == b"Z" else
+                          (int(zone[1:3]) * 3600 + int(zone[3:5]) * 60) *
+                          (-1 if zone[:1] == b"-" else 1))
+                return calendar.timegm(
+                    (year, month, day, hour, minute, second)) - offset
+            secs = time.mktime((year, month, day, hour, minute, second,
+                                0, 0, -1))
+            if not fields.get("Y") and secs > mtime + 24*60*60:
+                secs = time.mktime((year - 1, month, day, hour, minute,
+                                    second, 0, 0, -1))
+            return secs
+        except (KeyError, ValueError, OverflowError):
+            return None
+
+    return timestamp
+
+
+def next_timestamp(buf, pos, end, timestamp, max_lines=sys.maxsize):
+    # returns the offset of the first line at or after pos within buf[:end],
+    # which carries a timestamp, and that timestamp
+    while pos < end and max_lines > 0:
+        eol = buf.find(b"\n", pos, end) + 1 or end
+        secs = timestamp(buf, pos, eol)
+        if secs is not None:
+            return pos, secs
+        pos = eol
+        max_lines -= 1
+    return end, None
+
+
+def seek_timestamp(buf, start, end, timestamp, reached):
+    # binary searches buf[start:end] for the first line whose timestamp is
+    # reached(), assuming that the timestamps of a logfile never decrease,
+    # and returns its offset; lines without timestamp belong to the last
+    # line with timestamp before them
+    def line_start(pos):
+        return pos if pos <= start else buf.find(b"\n", pos - 1, end) + 1 or end
+
+    lo, hi = start, end
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _, secs = next_timestamp(buf, line_start(mid), end, timestamp)
+        if secs is None or reached(secs):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return next_timestamp(buf, line_start(lo), end, timestamp)[0]
+
+
+def time_range_offsets(buf, start, end, timestamp, time_from, time_to):
+    # returns the offsets of the first line within buf[start:end] not before
+    # time_from, and of the first line after time_to
+    if time_from is not None:
+        start = seek_timestamp(buf, start, end, timestamp,
+                               lambda secs: secs >= time_from)
+    if time_to is not None:
+        end = seek_timestamp(buf, start, end, timestamp,
+                             lambda secs: secs > time_to)
+    return start, end
+
+
+def compile_time_range(timestamp, timefrom, timeto):
+    # returns the bytes regex matching timestamps, and the start and end of
+    # the time range in seconds since the epoch, or None for no time range
+    if not timestamp or not (timefrom or timeto):
+        return None
+    return (re.compile(timestamp.encode()),
+            (datetime.datetime.fromisoformat(timefrom).timestamp()
+             if timefrom else None),
+            (datetime.datetime.fromisoformat(timeto).timestamp()
+             if timeto else None))
+
+
+def has_timestamps(buf, timestamp):
+    return next_timestamp(buf, 0, len(buf), timestamp,
+                          TIMESTAMP_PROBE_LINES)[1] is not None
+
+
+def time_range_chunks(chunks, timestamp, time_from, time_to):
+    # yields the number of lines skipped in front of each line aligned piece
+    # of chunks within the time range, and that piece
+    started = False
+    # chunks which lie in front of the time range entirely yield nothing,
+    # but their lines are skipped, too
+    skipped = 0
+    for num_chunk, buf in enumerate(chunks):
+        size = len(buf)
+        if num_chunk == 0 and not has_timestamps(buf, timestamp):
+            # the logfile is searched entirely
+            time_from = time_to = None
+        start, end = time_range_offsets(buf, 0, size, timestamp,
+                                        None if started else time_from,
+                                        time_to)
+        started = started or start < size
+        skipped += count_lines(buf, 0, start)
+
+        while start < end:
+            stop = min(start + MMAP_CHUNK_SIZE, end)
+            stop = buf.find(b"\n", stop - 1, end) + 1 or end
+            yield skipped, buf[start:stop]
+            skipped = 0
+            start = stop
+        if end < size:
+            return
+
+
+def record_chunks(chunks, ends):
+    # yields chunks, and keeps the first and the last of them, and their
+    # total size, within ends
+    for buf in chunks:
+        if not ends[2]:
+            ends[0] = buf
+        ends[1] = buf
+        ends[2] += len(buf)
+        yield buf
+
+
+def resume_chunks(chunks, num_lines, offset):
+    # yields the number of lines skipped in front of each line aligned piece
+    # of chunks behind their first num_lines lines, and that piece; the
+    # number of bytes skipped is added to offset[0]
+    skipped = 0
+    for buf in chunks:
+        if num_lines > 0:
+            count = buf.count(b"\n")
+            if count < num_lines:
+                num_lines -= count
+                skipped += count
+                offset[0] += len(buf)
+                continue
+            start = 0
+            for _ in range(num_lines):
+                start = buf.index(b"\n", start) + 1
+            skipped += num_lines
+            num_lines = 0
+            offset[0] += start
+            buf = buf[start:]
+        yield skipped, buf
+        skipped = 0
+    if skipped:
+        yield skipped, b""
+
+
+def read_lines_backwards(fp, size, start=0):
+    # yields the lines of a seekable file in front of offset size and behind
+    # offset start, starting with the last one
+    pos = size
+    buf = b""
+
+    while True:
+        eol = len(buf)
+        bol = buf.rfind(b"\n", 0, eol - 1)
+        while bol >= 0:
+            yield buf[bol + 1:eol]
+            eol = bol + 1
+            bol = buf.rfind(b"\n", 0, eol - 1)
+        # the first line within buf may continue in front of it
+        buf = buf[:eol]
+
+        if pos <= start:
+            if buf:
+                yield buf
+            return
+
+        bol = max(start, pos - BACKWARD_BLOCK_SIZE)
+        fp.seek(bol)
+        buf = fp.read(pos - bol) + buf
+        pos = bol
+
+
+class FileBuffer:
+    # the first size bytes of a logfile, read by os.pread() on demand; a
+    # logfile which is still written may be truncated, e.g. by logrotate's
+    # copytruncate, and accessing its mmap beyond the new end would raise
+    # SIGBUS, whereas reading it just ends early; provides what
+    # time_range_chunks() and count_lines() need of an mmap object
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.size = size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self.size)
+        return os.pread(self.fd, max(stop - start, 0), start)
+
+    def find(self, sub, start, end):
+        pos = start
+        while pos < end:
+            block = self[pos:min(pos + BACKWARD_BLOCK_SIZE, end)]
+            if len(block) < len(sub):
+                break
+            found = block.find(sub)
+            if found >= 0:
+                return pos + found
+            pos += len(block) - len(sub) + 1
+        return -1
+
+
+def open_buffer(fp, size, rotated):
+    # returns the first size bytes of fp as buffer, which is mapped just if
+    # the logfile is rotated, i.e. cannot be truncated anymore
+    if rotated:
+        return mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ)
+    return FileBuffer(fp.fileno(), size)
+
+
+def count_lines(buf, start, end):
+    # mmap objects lack count(), so copy at most MMAP_CHUNK_SIZE at a time
+    num_lines = 0
+    for pos in range(start, end, MMAP_CHUNK_SIZE):
+        num_lines += buf[pos:min(pos + MMAP_CHUNK_SIZE, end)].count(b"\n")
+    if end > start and buf[end - 1:end] != b"\n":
+        num_lines += 1
+    return num_lines
+
+
+def scan_nonmatching(scan, buf, start, end, line_number, num_lines=None):
+    # feeds the lines within buf[start:end], none of which matches, to scan
+    # without splitting all of them, and returns the number of lines
+    if num_lines is None:
+        num_lines = count_lines(buf, start, end)
+
+    # the first lines may be needed as after context...
+    num_head = min(scan.after - scan.num_after, num_lines)
+    for _ in range(num_head):
+        eol = buf.find(b"\n", start, end) + 1 or end
+        line_number += 1
+        scan.add_nonmatching(buf[start:eol], eol - start, line_number)
+        start = eol
+
+    # ...whereas only the last lines may be needed as before context
+    num_tail = min(scan.before, num_lines - num_head)
+    bols = [end]
+    for _ in range(num_tail):
+        bols.append(max(buf.rfind(b"\n", start, bols[-1] - 1) + 1, start))
+    bols.reverse()
+    line_number += num_lines - num_head - num_tail
+    for bol, eol in zip(bols, bols[1:]):
+        line_number += 1
+        scan.add_nonmatching(buf[bol:eol], eol - bol, line_number)
+
+    return num_lines
+
+
+def line_chunks(fp, times=None):
+    # reads fp in chunks, and yields buffers which end at a line boundary;
+    # the seconds spent reading are added to times["decompress"]
+    rest = b""
+    while True:
+        start = time.perf_counter()
+        chunk = fp.read(DECOMPRESS_CHUNK_SIZE)
+        if times is not None:
+            times["decompress"] += time.perf_counter() - start
+        if not chunk:
+            break
+        chunk = rest + chunk
+        eol = chunk.rfind(b"\n") + 1
+        if eol > 0:
+            yield chunk[:eol]
+        rest = chunk[eol:]
+    if rest:
+        yield rest
+
+
+def read_chunks(fp, times=None):
+    # decompresses fp within a background thread, as zlib, bz2, and lzma
+    # release the GIL, and yields buffers which end at a line boundary; the
+    # seconds spent decompressing, and waiting for it, are added to times
+    if DECOMPRESS_QUEUE_DEPTH <= 0:
+        start = time.perf_counter()
+        for chunk in line_chunks(fp, times):
+            if times is not None:
+                times["wait"] += time.perf_counter() - start
+            yield chunk
+            start = time.perf_counter()
+        return
+
+    chunks = queue.Queue(DECOMPRESS_QUEUE_DEPTH)
+    stop = threading.Event()
+
+    def put(chunk):
+        while not stop.is_set():
+            try:
+                chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def decompress():
+        try:
+            for chunk in line_chunks(fp, times):
+                if stop.is_set():
+                    return
+                put(chunk)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=decompress, daemon=True)
+    thread.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = chunks.get()
+            if times is not None:
+                times["wait"] += time.perf_counter() - start
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+        thread.join()
+
+
+def scan_lines(scan, lines, tester, invert, fast, line_number=0):
+    # searches line by line, and returns the number of the last line, and
+    # whether scan does not need any further line in fast mode
+    add_nonmatching = scan.add_nonmatching
+    add_matching = scan.add_matching
+    file_bytes = 0
+    satisfied = False
+    decode_time = 0.0 if scan.timed and not scan.bytewise else None
+
+    for line_number, raw_line in enumerate(lines, line_number + 1):
+        len_raw_line = len(raw_line)
+        if decode_time is None:
+            line = (raw_line if scan.bytewise else
+                    raw_line.decode(scan.charset, errors="replace"))
+        else:
+            decode_start = time.perf_counter()
+            line = raw_line.decode(scan.charset, errors="replace")
+            decode_time += time.perf_counter() - decode_start
+
+        file_bytes += len_raw_line
+
+        if (not tester(line)) if invert else tester(line):
+            satisfied = add_matching(line, len_raw_line, line_number)
+        else:
+            satisfied = add_nonmatching(line, len_raw_line, line_number)
+        if satisfied and fast:
+            break
+
+    scan.total_bytes += file_bytes
+    if decode_time:
+        scan.file_times["decode"] += decode_time
+    return line_number, satisfied and fast
+
+
+def scan_buffer(scan, buf, tester, finder, fast, line_number=0):
+    # searches a whole buffer for matches, and returns the number of the last
+    # line, and whether scan does not need any further line in fast mode
+    size = len(buf)
+    run_start = search_pos = 0
+    # the limits may have been reached within a previous buffer already
+    stopped = fast and scan.limits_reached()
+    satisfied = stopped and scan.num_after >= scan.after
+
+    while search_pos < size and not stopped:
+        hit = finder(buf, search_pos)
+        if hit < 0:
+            break
+        bol = max(buf.rfind(b"\n", search_pos, hit) + 1, search_pos)
+        if bol >= size:
+            break
+        eol = buf.find(b"\n", hit) + 1 or size
+
+        # a regex may have matched across lines, thus verify the hit
+        line = buf[bol:eol]
+        if tester(line):
+            line_number += scan_nonmatching(scan, buf, run_start, bol,
+                                            line_number) + 1
+            satisfied = scan.add_matching(line, eol - bol, line_number)
+            run_start = eol
+            stopped = fast and scan.limits_reached()
+        search_pos = eol
+
+    if not stopped:
+        scan.total_bytes += size
+        return line_number + scan_nonmatching(scan, buf, run_start, size,
+                                              line_number), False
+
+    # just the after context of the last match is missing, which may contain
+    # further matches, so split line by line
+    while not satisfied and run_start < size:
+        eol = buf.find(b"\n", run_start) + 1 or size
+        line = buf[run_start:eol]
+        line_number += 1
+        if tester(line):
+            satisfied = scan.add_matching(line, eol - run_start, line_number)
+        else:
+            satisfied = scan.add_nonmatching(line, eol - run_start,
+                                             line_number)
+        run_start = eol
+
+    scan.total_bytes += run_start
+    return line_number, satisfied
+
+
+def scan_blocks(scan, buf, index, candidates, tester, finder, fast):
+    # searches only those blocks of buf which may contain matches according
+    # to index, and returns the number of the last line, and whether scan
+    # does not need any further line in fast mode
+    runs = []
+    for candidate, (offset, length, num_lines, _) in zip(candidates,
+                                                         index.blocks):
+        if candidate or not runs or runs[-1][0]:
+            runs.append([candidate, offset, offset + length, num_lines])
+        else:
+            runs[-1][2] += length
+            runs[-1][3] += num_lines
+
+    line_number = 0
+    satisfied = False
+    for candidate, start, end, num_lines in runs:
+        if candidate:
+            line_number, satisfied = scan_buffer(scan, buf[start:end],
+                                                 tester, finder, fast,
+                                                 line_number)
+        else:
+            # neither count nor split lines which just may be context
+            line_number += scan_nonmatching(scan, buf, start, end,
+                                            line_number, num_lines)
+            scan.total_bytes += end - start
+            satisfied = (fast and scan.limits_reached() and
+                         scan.num_after >= scan.after)
+        if satisfied:
+            break
+
+    return line_number, satisfied
+
+
+def scan_chunks(scan, chunks, tester, finder, invert, fast, new_index=None,
+                line_number=0):
+    # searches line aligned buffers one after another, each preceded by the
+    # number of lines skipped in front of it, and returns the number of the
+    # last line, the number of lines skipped, and whether scan does not need
+    # any further line in fast mode
+    skipped = 0
+    satisfied = False
+
+    for num_skipped, buf in chunks:
+        line_number += num_skipped
+        skipped += num_skipped
+        if finder and not invert:
+            line_number, satisfied = scan_buffer(scan, buf, tester, finder,
+                                                 fast, line_number)
+        else:
+            line_number, satisfied = scan_lines(scan, io.BytesIO(buf),
+                                                tester, invert, fast,
+                                                line_number)
+        if satisfied:
+            break
+        if new_index:
+            new_index.feed(buf)
+
+    return line_number, skipped, satisfied
+
+
+def scan_regions(scan, path, index, candidates, tester, finder, invert,
+                 fast):
+    # like scan_blocks(), but for a compressed logfile, of which just those
+    # blocks are decompressed that may contain matches or context lines,
+    # each from the nearest checkpoint in front of it, see open_region()
+    runs = []
+    for num_block, candidate in enumerate(candidates):
+        if not runs or runs[-1][0] != candidate:
+            runs.append([candidate, num_block, num_block])
+        else:
+            runs[-1][2] = num_block
+
+    def read(first, last):
+        # returns a file object of the blocks first to last
+        return open_region(path, index.checkpoints, index.blocks[first][0],
+                           index.blocks[last][0] + index.blocks[last][1])
+
+    line_number = 0
+    satisfied = False
+    for candidate, first, last in runs:
+        if candidate:
+            with read(first, last) as fp:
+                line_number, _, satisfied = scan_chunks(
+                    scan,
+                    ((0, buf) for buf in read_chunks(fp, scan.file_times)),
+                    tester, finder, invert, fast, line_number=line_number)
+        else:
+            blocks = index.blocks[first:last + 1]
+            num_lines = sum(block[2] for block in blocks)
+            num_head = min(scan.after - scan.num_after, num_lines)
+            num_tail = min(scan.before, num_lines - num_head)
+            # the first lines may be needed as after context, and the last
+            # lines as before context, which usually lie within the first
+            # and last block
+            if not num_head and not num_tail:
+                parts = ()
+            elif (len(blocks) > 2 and num_head <= blocks[0][2] and
+                  num_tail <= blocks[-1][2]):
+                parts = ((first, first) if num_head else None,
+                         (last, last) if num_tail else None)
+            else:
+                parts = ((first, last),)
+            buf = b""
+            for part in filter(None, parts):
+                with read(*part) as fp:
+                    buf += b"".join(line_chunks(fp))
+            line_number += scan_nonmatching(scan, buf, 0, len(buf),
+                                            line_number, num_lines)
+            scan.total_bytes += sum(block[1] for block in blocks)
+            satisfied = (fast and scan.limits_reached() and
+                         scan.num_after >= scan.after)
+        if satisfied:
+            break
+
+    return line_number, satisfied
+
+
+def seek_region(path, index, timestamp, time_from):
+    # returns the last block of a compressed logfile whose first line with
+    # a timestamp has been logged before time_from, by decompressing just
+    # the first lines of some blocks, see open_region()
+    lo, hi = 0, len(index.blocks) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        offset, length = index.blocks[mid][:2]
+        with open_region(path, index.checkpoints, offset,
+                         offset + min(length, TIMESTAMP_PROBE_LINES *
+                                      TIMESTAMP_MAX_LEN)) as fp:
+            buf = b"".join(line_chunks(fp))
+        secs = next_timestamp(buf, 0, len(buf), timestamp,
+                              TIMESTAMP_PROBE_LINES)[1]
+        if secs is not None and secs < time_from:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def scan_backwards(scan, fp, size, rotated, tester, invert, timestamp,
+                   time_from, time_to):
+    # searches a logfile in reverse mode, i.e. from its end, and returns the
+    # number of lines read and skipped, and whether it has been read
+    # completely; with timestamp, just the lines within the time range are
+    # read
+    start, end = 0, size
+    line_number = skipped = skipped_before = 0
+    if timestamp:
+        with open_buffer(fp, size, rotated) as buf:
+            if has_timestamps(buf, timestamp):
+                start, end = time_range_offsets(buf, 0, size, timestamp,
+                                                time_from, time_to)
+            skipped_before = count_lines(buf, 0, start)
+            skipped = line_number = count_lines(buf, end, size)
+
+    add_nonmatching = scan.add_nonmatching_backwards
+    add_matching = scan.add_matching_backwards
+    file_bytes = 0
+    complete = True
+    decode_time = 0.0 if scan.timed and not scan.bytewise else None
+
+    # line numbers are counted backwards from the end of file
+    for line_number, raw_line in enumerate(
+            read_lines_backwards(fp, end, start), skipped + 1):
+        len_raw_line = len(raw_line)
+        if decode_time is None:
+            line = (raw_line if scan.bytewise else
+                    raw_line.decode(scan.charset, errors="replace"))
+        else:
+            decode_start = time.perf_counter()
+            line = raw_line.decode(scan.charset, errors="replace")
+            decode_time += time.perf_counter() - decode_start
+
+        file_bytes += len_raw_line
+
+        if (not tester(line)) if invert else tester(line):
+            limits_reached = add_matching(line, len_raw_line, -line_number)
+        else:
+            limits_reached = add_nonmatching(line, len_raw_line,
+                                             -line_number)
+        if limits_reached:
+            scan.partial = True
+            complete = False
+            break
+    else:
+        # the whole logfile has been read, so line numbers may be counted
+        # from the start of file again
+        line_number += skipped_before
+        skipped += skipped_before
+        scan.lines = collections.deque(
+            (*tmpline[:3], line_number + 1 + tmpline[3])
+            for tmpline in scan.lines)
+
+    scan.total_bytes += file_bytes
+    if decode_time:
+        scan.file_times["decode"] += decode_time
+    return line_number, skipped, complete
+
+
+def scan_resumed(scan, path, fp, compressed, index, checkpoints, tester,
+                 finder, invert, fast, resume):
+    # continues a search in forward mode behind a line, see search_lines(),
+    # and returns the number of lines read and skipped, and whether the
+    # search has been satisfied; the lines up to there are just counted,
+    # starting at the nearest offset known in front of it, i.e. where the
+    # previous page began to search the logfile, or a block of its index
+    _, offset, skipped, resume_line = resume
+    if index:
+        num_lines = 0
+        for block_offset, _, block_lines, _ in index.blocks:
+            if num_lines > resume_line:
+                break
+            if num_lines > skipped:
+                offset, skipped = block_offset, num_lines
+            num_lines += block_lines
+    region = None
+    if not compressed:
+        fp.seek(offset)
+    elif checkpoints and offset:
+        region = open_region(path, checkpoints, offset, index.total_bytes)
+    else:
+        offset = skipped = 0
+    chunks = (read_chunks(region or fp, scan.file_times) if compressed
+              else line_chunks(fp))
+    start = [offset]
+    try:
+        line_number, skipped_chunks, satisfied = scan_chunks(
+            scan, resume_chunks(chunks, resume_line - skipped, start),
+            tester, finder, invert, fast, line_number=skipped)
+    finally:
+        # stop decompressing before the region is closed
+        chunks.close()
+        if region:
+            region.close()
+    scan.file_start = (start[0], resume_line)
+    return line_number, skipped + skipped_chunks, satisfied
+
+
+def scan_time_range(scan, fp, size, rotated, tester, finder, invert, fast,
+                    timestamp, time_from, time_to):
+    # searches the lines of an uncompressed logfile within the time range,
+    # which is found by binary search, and returns the number of lines read
+    # and skipped, and whether the search has been satisfied
+    if size == 0:
+        return 0, 0, False
+    with open_buffer(fp, size, rotated) as buf:
+        return scan_chunks(scan, time_range_chunks((buf,), timestamp,
+                                                   time_from, time_to),
+                           tester, finder, invert, fast)
+
+
+def scan_mapped(scan, fp, size, index, candidates, new_index, tester, finder,
+                fast):
+    # searches a rotated logfile mapped into memory by finder, skipping the
+    # blocks of its index which cannot match, and returns the number of
+    # lines read, and whether the search has been satisfied; new_index, if
+    # given, is built from the logfile read completely
+    with mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ) as buf:
+        if candidates and not all(candidates):
+            line_number, satisfied = scan_blocks(scan, buf, index,
+                                                 candidates, tester, finder,
+                                                 fast)
+        else:
+            line_number, satisfied = scan_buffer(scan, buf, tester, finder,
+                                                 fast)
+        if new_index and not satisfied:
+            new_index.feed(buf)
+    return line_number, satisfied
+
+
+def scan_stream(scan, path, fp, index, checkpoints, new_index, tester,
+                finder, invert, fast, timestamp, time_from, time_to,
+                chunk_ends):
+    # searches a compressed logfile, or one whose index is being built, as
+    # a stream of chunks, and returns the number of lines read and skipped,
+    # and whether the search has been satisfied; with timestamp, it is
+    # decompressed from the block of its index in front of the time range,
+    # otherwise its first and last chunk, and its size, are recorded in
+    # chunk_ends
+    line_number = 0
+    region = None
+    if checkpoints and timestamp and time_from is not None:
+        # decompress from the block in front of the time range
+        first_block = seek_region(path, index, timestamp, time_from)
+        if first_block > 0:
+            line_number = sum(block[2]
+                              for block in index.blocks[:first_block])
+            region = open_region(path, checkpoints,
+                                 index.blocks[first_block][0],
+                                 index.total_bytes)
+    if timestamp:
+        chunks = time_range_chunks(read_chunks(region or fp, scan.file_times),
+                                   timestamp, time_from, time_to)
+    else:
+        chunks = ((0, buf) for buf in
+                  record_chunks(read_chunks(fp, scan.file_times), chunk_ends))
+    skipped = line_number
+    try:
+        line_number, skipped_chunks, satisfied = scan_chunks(
+            scan, chunks, tester, finder, invert, fast, new_index,
+            line_number)
+    finally:
+        # stop decompressing before the region is closed
+        chunks.close()
+        if region:
+            region.close()
+    return line_number, skipped + skipped_chunks, satisfied
+
+
+def scan_logfile(scan, path, tester, finder, invert, fast, index_dir=None,
+                 trigrams=None, time_range=None, timestamp_re=None,
+                 resume=None):
+    # searches a single logfile, and returns an error message and the number
+    # of lines read; timestamp_re, if given, finds the timestamps of the
+    # first and last line of a logfile read completely, see Catalog; resume,
+    # if given, continues a search in forward mode behind a line, see
+    # search_lines()
+    index = candidates = new_index = timestamp = checkpoints = None
+    time_from = time_to = None
+    try:
+        stat = os.stat(path)
+        rotated = is_rotated(path, stat.st_mtime)
+        scan.start_file()
+
+        if resume and resume[0] != stat.st_ino:
+            return "Logfile has been rotated since the previous page", 0
+
+        if time_range:
+            timestamp_re, time_from, time_to = time_range
+            if time_from is not None and stat.st_mtime < time_from:
+                # the logfile has not been written since the time range began
+                return None, 0
+            timestamp = timestamp_parser(timestamp_re, stat.st_mtime)
+
+        if index_dir and rotated:
+            fingerprint = logfile_fingerprint(stat)
+            index = LogIndex.load(index_dir, path, fingerprint)
+            if not index and not timestamp and not resume:
+                new_index = LogIndex(path, fingerprint)
+            elif index and trigrams:
+                candidates = index.candidates(trigrams)
+            checkpoints = region_checkpoints(path, index)
+
+        if candidates is not None and not any(candidates):
+            # no block of this logfile contains all trigrams of the query
+            scan.total_lines += index.total_lines
+            scan.total_bytes += index.total_bytes
+            return None, index.total_lines
+
+        fp, size = open_logfile(path, new_index and new_index.checkpoints)
+    except Exception as e:
+        return str(e), 0
+
+    compressed = size is None
+    size = size or 0
+    line_number = skipped = 0
+    # in reverse mode, the latest matches are kept, so the whole logfile
+    # must be read
+    fast = fast and not scan.reverse
+    satisfied = False
+    complete = True
+    end_offset = None
+    # the first and last chunk of a compressed logfile, and its size
+    chunk_ends = [b"", b"", 0]
+
+    # each way of reading a logfile is a function of its own, chosen by
+    # the mode of the search and the kind of logfile
+    with fp:
+        if scan.reverse and size > 0:
+            new_index = None
+            line_number, skipped, complete = scan_backwards(
+                scan, fp, size, rotated, tester, invert, timestamp,
+                time_from, time_to)
+            end_offset = size if not timestamp or time_to is None else None
+        elif resume:
+            complete = False
+            line_number, skipped, satisfied = scan_resumed(
+                scan, path, fp, compressed, index, checkpoints, tester,
+                finder, invert, fast, resume)
+        elif timestamp and not compressed:
+            line_number, skipped, satisfied = scan_time_range(
+                scan, fp, size, rotated, tester, finder, invert, fast,
+                timestamp, time_from, time_to)
+            end_offset = size if time_to is None else None
+        elif finder and not invert and size >= MMAP_MIN_SIZE and rotated:
+            line_number, satisfied = scan_mapped(scan, fp, size, index,
+                                                 candidates, new_index,
+                                                 tester, finder, fast)
+            end_offset = size
+        elif finder and not invert and size >= MMAP_MIN_SIZE:
+            # a logfile which is still written is read in chunks rather
+            # than mapped, see FileBuffer
+            line_number, _, satisfied = scan_chunks(
+                scan, ((0, buf) for buf in line_chunks(fp)), tester, finder,
+                invert, fast)
+            end_offset = fp.tell()
+        elif (checkpoints and candidates and not all(candidates) and
+              not timestamp):
+            complete = False
+            line_number, satisfied = scan_regions(
+                scan, path, index, candidates, tester, finder, invert, fast)
+        elif compressed or new_index:
+            line_number, skipped, satisfied = scan_stream(
+                scan, path, fp, index, checkpoints, new_index, tester,
+                finder, invert, fast, timestamp, time_from, time_to,
+                chunk_ends)
+            end_offset = None if compressed else fp.tell()
+        else:
+            line_number, satisfied = scan_lines(scan, fp, tester, invert,
+                                                fast)
+            end_offset = fp.tell()
+
+        if end_offset is not None and not satisfied:
+            scan.file_end = (os.fstat(fp.fileno()).st_ino, end_offset)
+
+        if complete and not satisfied and not timestamp:
+            scan.file_stats = {"bytes": chunk_ends[2] if compressed else size,
+                               "lines": line_number, "first": None,
+                               "last": None}
+            if timestamp_re:
+                parser = timestamp_parser(timestamp_re, stat.st_mtime)
+                if compressed:
+                    head = chunk_ends[0]
+                    tail = read_lines_backwards(io.BytesIO(chunk_ends[1]),
+                                                len(chunk_ends[1]))
+                else:
+                    head = os.pread(fp.fileno(), BACKWARD_BLOCK_SIZE, 0)
+                    tail = read_lines_backwards(fp, size)
+                scan.file_stats["first"] = next_timestamp(
+                    head, 0, len(head), parser, TIMESTAMP_PROBE_LINES)[1]
+                for line in itertools.islice(tail, TIMESTAMP_PROBE_LINES):
+                    scan.file_stats["last"] = parser(line, 0, len(line))
+                    if scan.file_stats["last"] is not None:
+                        break
+
+    # the index of a logfile may be built only if it has been read completely
+    if new_index and not satisfied:
+        new_index.finish()
+        try:
+            new_index.save(index_dir)
+        except OSError:
+            pass
+
+    scan.partial = scan.partial or satisfied
+    scan.total_lines += line_number - skipped
+    return None, line_number
+
+
+def context_lines(scan, path, tester, finder, invert):
+    # yields the number, byte offset, and content of each line of a logfile
+    # which matches, or is context of a match, along with whether it
+    # matches, in file order, and adds them to the totals of scan; the
+    # content is undecoded if scan is bytewise, and nothing but the before
+    # context is kept, so that a logfile of any size is searched in constant
+    # memory
+    bytewise = scan.bytewise
+    b4buf = collections.deque(maxlen=scan.before)
+    num_after = scan.after
+    line_number = 0
+    offset = pos = 0
+
+    fp, size = open_logfile(path)
+    try:
+        with fp:
+            for buf in (line_chunks(fp) if size is not None else
+                        read_chunks(fp)):
+                pos = 0
+                end = len(buf)
+                while pos < end:
+                    if (finder and bytewise and not invert and
+                            num_after >= scan.after):
+                        # the lines up to the next hit do not match, and just
+                        # the last of them may be needed as before context
+                        hit = finder(buf, pos)
+                        bol = (end if hit < 0 else
+                               max(buf.rfind(b"\n", pos, hit) + 1, pos))
+                        if bol > pos:
+                            num_lines = count_lines(buf, pos, bol)
+                            bols = [bol]
+                            for _ in range(min(scan.before, num_lines)):
+                                bols.append(max(buf.rfind(b"\n", pos,
+                                                          bols[-1] - 1) + 1,
+                                                pos))
+                            bols.reverse()
+                            line_number += num_lines - len(bols) + 1
+                            for start, stop in zip(bols, bols[1:]):
+                                line_number += 1
+                                b4buf.append((line_number, offset + start,
+                                              buf[start:stop], stop - start))
+                            pos = bol
+                            continue
+
+                    # pos is advanced before any line is yielded, as the
+                    # search may stop there
+                    bol = pos
+                    pos = buf.find(b"\n", bol) + 1 or end
+                    raw_line = buf[bol:pos]
+                    line = (raw_line if bytewise else
+                            raw_line.decode(scan.charset, errors="replace"))
+                    line_number += 1
+                    if (not tester(line)) if invert else tester(line):
+                        scan.matching_lines += 1
+                        scan.matching_bytes += pos - bol
+                        for number, start, context, len_context in b4buf:
+                            scan.shown_lines += 1
+                            scan.shown_bytes += len_context
+                            yield number, start, context, False
+                        b4buf.clear()
+                        scan.shown_lines += 1
+                        scan.shown_bytes += pos - bol
+                        num_after = 0
+                        yield line_number, offset + bol, line, True
+                    elif num_after < scan.after:
+                        scan.shown_lines += 1
+                        scan.shown_bytes += pos - bol
+                        num_after += 1
+                        yield line_number, offset + bol, line, False
+                    else:
+                        b4buf.append((line_number, offset + bol, line,
+                                      pos - bol))
+                offset += end
+                pos = 0
+    finally:
+        # the totals cover the lines read up to where the search has
+        # stopped, even within a chunk
+        scan.total_lines += line_number
+        scan.total_bytes += offset + pos
+
+
+# the options of a search, as submitted by the form, or set in the config
+# file, see search_lines()
+SearchOptions = collections.namedtuple("SearchOptions", (
+    "charset", "query", "reverse", "ignorecase", "invert", "regex", "boolean",
+    "before", "after", "limitlines", "limitmemory", "fast", "workers",
+    "index_dir", "timestamp", "timefrom", "timeto"))
+
+
+def search_limits(options):
+    # returns the limits of lines and bytes shown, and the number of lines of
+    # before and after context, of a search
+    return (int(options.limitlines) if options.limitlines else sys.maxsize,
+            int(options.limitmemory) * 1024**2 if options.limitmemory
+            else sys.maxsize,
+            int(options.before) if options.before else 0,
+            int(options.after) if options.after else 0)
+
+
+def scan_logfile_worker(path, options, catalog, timed):
+    # runs within a process pool, thus compiles the query on its own, and
+    # returns the LogScan without its unpicklable or unneeded parts
+    charset, invert, timestamp = (options.charset, options.invert,
+                                  options.timestamp)
+    _, tester, _, finder, bytewise = compile_matcher(
+        options.query, charset, options.ignorecase, options.regex,
+        options.boolean)
+    trigrams = (query_trigrams(options.query, charset, options.ignorecase,
+                               options.regex, options.boolean, invert,
+                               bytewise) if options.index_dir else None)
+    limit_lines, limit_bytes, before, after = search_limits(options)
+    scan = LogScan(charset, bytewise, limit_lines, limit_bytes,
+                   options.reverse, before, after, timed)
+    time_range = compile_time_range(timestamp, options.timefrom,
+                                    options.timeto)
+    timestamp_re = (re.compile(timestamp.encode()) if catalog and timestamp
+                    else None)
+    start = time.perf_counter()
+    error, line_number = scan_logfile(scan, path, tester, finder, invert,
+                                      options.fast, options.index_dir,
+                                      trigrams, time_range, timestamp_re)
+    scan.file_times["scan"] = time.perf_counter() - start
+    scan.b4buf.clear()
+    scan.pending.clear()
+    return error, line_number, scan
+
+
+def logfile_cursor(scan, path, num_lines):
+    # returns the lines of a logfile just shown by scan, and where to
+    # continue searching once it has grown, see tail_logfiles()
+    cursor = {"path":        path,
+              "lines":       list(scan.lines),
+              "num_lines":   num_lines,
+              "ino":         None,
+              "offset":      0,
+              "line_number": None,
+              "last_line":   b"",
+              "b4buf":       [],
+              "num_after":   scan.after}
+
+    if not scan.file_end:
+        # the logfile cannot be continued, but may be left unchanged
+        try:
+            stat = os.stat(path)
+            cursor["ino"], cursor["offset"] = stat.st_ino, stat.st_size
+        except OSError:
+            pass
+        return cursor
+
+    cursor["ino"], cursor["offset"] = scan.file_end
+    # in reverse mode, lines may be numbered backwards from the end of file
+    last = -1 if num_lines < 0 else num_lines
+    last_shown = cursor["lines"][-1][3] if cursor["lines"] else None
+    last_match = next((line[3] for line in reversed(cursor["lines"])
+                       if line[1]), None)
+    if last_match is not None:
+        # any match after the last one shown has been rejected due to the
+        # limits, and adds no after context
+        cursor["num_after"] = sum(1 for line in cursor["lines"]
+                                  if line[3] > last_match)
+
+    try:
+        with open(path, "rb") as fp:
+            tail = list(itertools.islice(
+                read_lines_backwards(fp, cursor["offset"]),
+                max(scan.before, 1)))
+    except OSError:
+        return cursor
+
+    if tail and not tail[0].endswith(b"\n"):
+        # the last line may be still incomplete
+        return cursor
+
+    for line_number, raw_line in enumerate(tail[:scan.before]):
+        line_number = last - line_number
+        if last_shown is not None and line_number <= last_shown:
+            break
+        line = (raw_line if scan.bytewise else
+                raw_line.decode(scan.charset, errors="replace"))
+        cursor["b4buf"].insert(0, (line, False, len(raw_line), line_number))
+
+    cursor["line_number"] = last
+    cursor["last_line"] = tail[0] if tail else b""
+    return cursor
+
+
+def context_shown(lines, before):
+    # returns the number of lines and bytes a backwards scan would have
+    # counted as shown for the lines of a logfile
+    shown_lines = shown_bytes = 0
+    last_match = None
+    for line in reversed(lines):
+        if line[1]:
+            last_match = line[3]
+        elif last_match is None or last_match - line[3] > before:
+            continue
+        shown_lines += 1
+        shown_bytes += line[2]
+    return shown_lines, shown_bytes
+
+
+def tail_logfiles(scan, cursors, tester, invert):
+    # searches just the lines appended to the logfiles since their cursors
+    # have been taken, and returns False if the logfiles must be searched
+    # entirely again, as any of them has been rotated or truncated, or the
+    # appended lines would change the lines shown for following logfiles
+    for num_cursor, cursor in enumerate(cursors):
+        if cursor["lines"] is None:
+            # the limits had been reached before this logfile
+            continue
+        try:
+            stat = os.stat(cursor["path"])
+        except OSError:
+            return False
+        if (stat.st_ino != cursor["ino"] or
+                stat.st_size < cursor["offset"]):
+            return False
+        if cursor["line_number"] is None:
+            if stat.st_size == cursor["offset"]:
+                continue
+            return False
+
+        # the inode of a logfile removed may be reused by a new one, so the
+        # last line read before must be still in place
+        start = cursor["offset"] - len(cursor["last_line"])
+        try:
+            with open(cursor["path"], "rb") as fp:
+                fp.seek(start)
+                buf = fp.read(stat.st_size - start)
+        except OSError:
+            return False
+        if not buf.startswith(cursor["last_line"]):
+            return False
+        buf = buf[len(cursor["last_line"]):]
+        if not buf:
+            continue
+        if not buf.endswith(b"\n"):
+            # the last line is still incomplete
+            return False
+
+        scan.start_file()
+        scan.lines.extend(cursor["lines"])
+        scan.b4buf.extend(cursor["b4buf"])
+        scan.num_after = cursor["num_after"]
+        shown = (scan.shown_lines, scan.shown_bytes)
+        line_number, _ = scan_lines(scan, io.BytesIO(buf), tester, invert,
+                                    False, cursor["line_number"])
+
+        if scan.reverse:
+            # the lines have been fed forwards, but in reverse mode, any
+            # before context is shown lines, even if it is after context of
+            # a previous match, too; see add_nonmatching_backwards()
+            old_lines, old_bytes = context_shown(cursor["lines"], scan.before)
+            new_lines, new_bytes = context_shown(scan.lines, scan.before)
+            scan.shown_lines = shown[0] + new_lines - old_lines
+            scan.shown_bytes = shown[1] + new_bytes - old_bytes
+
+        following = any(other["lines"] for other in cursors[num_cursor + 1:])
+        if scan.rejected and (scan.reverse or following):
+            return False
+        if ((scan.reverse or following) and scan.limits_reached() and
+                (scan.shown_lines, scan.shown_bytes) != shown):
+            return False
+
+        num_lines = line_number - cursor["line_number"]
+        scan.total_lines += num_lines
+        if cursor["line_number"] < 0:
+            # keep numbering lines backwards from the end of file
+            scan.lines = collections.deque(
+                (*line[:3], line[3] - num_lines) for line in scan.lines)
+            scan.b4buf = collections.deque(
+                ((*line[:3], line[3] - num_lines) for line in scan.b4buf),
+                maxlen=scan.before)
+            cursor["num_lines"] -= num_lines
+        else:
+            cursor["line_number"] = cursor["num_lines"] = line_number
 
-    dir2files = logfiles.dir2files.setdefault(logdir, [])
-    found_files = False
+        cursor["offset"] += len(buf)
+        cursor["last_line"] = buf[buf.rfind(b"\n", 0, -1) + 1:]
+        cursor["lines"] = list(scan.lines)
+        cursor["b4buf"] = list(scan.b4buf)
+        cursor["num_after"] = scan.num_after
 
-    for entry in entries:
-        relname = os.path.join(subdir, entry.name)
+    return True
 
-        if (entry.is_dir(follow_symlinks=False) and
-                cfgdirfilter_re.search(entry.name)):
-            logfiles.total_dirs += 1
-            cnt = len(dir2files)
-            found_files = traverse_logdir(logdir, cfgdirfilter_re,
-                                          cfgfilefilter_re, filefilter_re,
-                                          logfiles, showdotfiles,
-                                          showunreadables, relname,
-                                          indent + 1)
-            if found_files:
-                logfiles.shown_dirs += 1
-                dir2files.insert(cnt, {
-                    "name":   entry.name + os.path.sep,
-                    "indent": indent
-                })
 
-                candid_name_indent_len = len(entry.name) + 1 + 2 * indent
-                if candid_name_indent_len > logfiles.max_name_indent_len:
-                    logfiles.max_name_indent_len = candid_name_indent_len
+def tail_filename(session_dir, session, csuffix):
+    return os.path.join(session_dir,
+                        hashlib.sha1((session + csuffix).encode())
+                        .hexdigest() + ".tail")
 
-        elif (entry.is_file(follow_symlinks=False) and
-              cfgfilefilter_re.search(entry.name)):
-            try:
-                stat = entry.stat(follow_symlinks=False)
-            except OSError:
-                continue
 
-            logfiles.total_files += 1
-            logfiles.total_bytes += stat.st_size
+def load_tail(filename):
+    # the state is kept as JSON, as unpickling a file planted into
+    # session_dir could run any code; see save_tail()
+    try:
+        with open(filename, "r", encoding="utf-8") as fp:
+            state = json.load(fp)
+        scan = LogScan.from_json(state["scan"])
+        for cursor in state["cursors"]:
+            if cursor["lines"] is not None:
+                cursor["lines"] = scan.lines_from_json(cursor["lines"])
+                cursor["b4buf"] = scan.lines_from_json(cursor["b4buf"])
+                cursor["last_line"] = cursor["last_line"].encode("latin-1")
+        return {"params": tuple(state["params"]), "scan": scan,
+                "cursors": state["cursors"]}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
 
-            readable = os.access(entry.path, os.R_OK)
 
-            if (filefilter_re.search(entry.name) and
-                (showunreadables or
-                 readable)):
-                found_files = True
-                logfiles.shown_files += 1
-                logfiles.shown_bytes += stat.st_size
-                size_human = bytes_pretty(stat.st_size)
+def save_tail(session_dir, filename, tail):
+    # also removes the state of sessions which have not refreshed for long
+    scan = tail["scan"]
+    cursors = []
+    for cursor in tail["cursors"]:
+        if cursor["lines"] is not None:
+            cursor = dict(cursor,
+                          lines=scan.lines_to_json(cursor["lines"]),
+                          b4buf=scan.lines_to_json(cursor["b4buf"]),
+                          last_line=cursor["last_line"].decode("latin-1"))
+        cursors.append(cursor)
 
-                mtime_human = datetime.datetime.fromtimestamp(
-                                  stat.st_mtime).strftime(DATETIME_FMT)
+    fd, tmpname = tempfile.mkstemp(dir=session_dir, prefix=".logblitz")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            json.dump({"params": tail["params"], "scan": scan.to_json(),
+                       "cursors": cursors}, fp)
+        os.replace(tmpname, filename)
+    except OSError:
+        os.unlink(tmpname)
+        raise
 
-                dir2files.append({
-                    "name":        entry.name,
-                    "readable":    readable,
-                    "indent":      indent,
-                    "path":        entry.path,
-                    "mtime":       stat.st_mtime,
-                    "mtime_human": mtime_human,
-                    "size":        stat.st_size,
-                    "size_human":  size_human
-                })
+    # another process may expire the same sessions at the same time
+    expired = time.time() - SESSION_MAX_AGE
+    for entry in os.scandir(session_dir):
+        try:
+            if (entry.name.endswith(".tail") and
+                    entry.stat().st_mtime < expired):
+                os.unlink(entry.path)
+        except OSError:
+            pass
 
-                candid_name_indent_len = len(entry.name) + 2 * indent
-                if candid_name_indent_len > logfiles.max_name_indent_len:
-                    logfiles.max_name_indent_len = candid_name_indent_len
 
-    return found_files
+def encode_page_token(key, data):
+    # returns where the next page of a search starts as an opaque token,
+    # which is signed with key, as it tells which file and offset to read
+    payload = base64.urlsafe_b64encode(
+        json.dumps(data, separators=(",", ":")).encode())
+    signature = hmac.new(key, payload, hashlib.sha256).hexdigest()
+    return f"{payload.decode()}.{signature}"
 
 
-def search(charset, logdirs, logfiles, fileselect, query, reverse, ignorecase,
-           invert, regex, before, after, limitlines, limitmemory):
-    html_lines = []
-    shown_lines = 0
-    shown_bytes = 0
-    matching_lines = 0
-    matching_bytes = 0
-    total_lines = 0
-    total_bytes = 0
-    num_logfiles = 0
+def decode_page_token(key, token):
+    # returns the data of a token signed with key, or None
+    payload, _, signature = token.encode(errors="replace").partition(b".")
+    if not hmac.compare_digest(
+            hmac.new(key, payload, hashlib.sha256).hexdigest().encode(),
+            signature):
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return None
 
-    limit_lines = int(limitlines) if limitlines else sys.maxsize
-    limit_bytes = int(limitmemory) * 1024**2 if limitmemory else sys.maxsize
-    before = int(before) if before else 0
-    after = int(after) if after else 0
 
-    if invert:
-        def eval_matches(matches, line):
-            return len(matches) <= 0, ((0, len(line)),)
-    else:
-        def eval_matches(matches, _):
-            return len(matches) > 0, matches
+def decode_matches(line, matched, matcher, invert, charset, bytewise):
+    # returns a line as shown, and the character offsets of the spans of its
+    # matches; just the lines shown are searched for the spans of matches
+    matches = list(matcher(line)) if matched and not invert else []
+    if bytewise:
+        raw_line = line
+        line = raw_line.decode(charset, errors="replace")
+        # convert byte offsets to character offsets
+        matches = [(len(raw_line[:start].decode(charset, errors="replace")),
+                    len(raw_line[:end].decode(charset, errors="replace")))
+                   for start, end in matches]
+    if matched and invert:
+        matches = ((0, len(line)),)
+    return line, matches
 
-    if regex and query:
-        try:
-            query_re = (re.compile(f"(?i:{query})") if ignorecase else
-                        re.compile(query))
-        except Exception as e:
-            return "", (f"Error: Invalid regex: {html.escape(str(e))}",)
 
-        def matcher(line):
-            matchee = query_re.search(line, 0)
-            while matchee:
-                yield matchee.span()
-                matchee = query_re.search(
-                    line,
-                    matchee.end() + int(matchee.end() == matchee.start())
-                )
-    elif query:
-        fold_string = str.lower if ignorecase else str
-        query_folded = fold_string(query)
+def search_lines(logdirs, logfiles, fileselect, options, tail=None,
+                 cache_size=0, cache_dir="", catalog_file="", timings=None,
+                 paging=None):
+    # yields the HTML lines of each logfile as soon as it has been searched,
+    # and returns the HTML status line, and the HTML lines of an error, if
+    # any, which ends the search; the time spent searching is added to
+    # timings, if given, and how long each logfile took, and rendering all
+    # lines, if timings are detailed; paging, if given, may hold where the
+    # previous page has stopped, and receives where the next page starts
+    num_logfiles = 0
+    timed = timings is not None and timings.detailed
 
-        def matcher(line):
-            line_folded = fold_string(line)
-            start = line_folded.find(query_folded)
-            while start >= 0:
-                end = start + len(query_folded)
-                yield start, end
-                start = line_folded.find(query_folded, end)
-    else:
-        def matcher(_):
-            yield 0, 0
+    charset, query, reverse, invert = (options.charset, options.query,
+                                       options.reverse, options.invert)
+    fast, index_dir, timestamp = (options.fast, options.index_dir,
+                                  options.timestamp)
+    limit_lines, limit_bytes, before, after = search_limits(options)
+
+    error, tester, matcher, finder, bytewise = compile_matcher(
+        query, charset, options.ignorecase, options.regex, options.boolean)
+    if error:
+        return "", (f"Error: Invalid "
+                    f"{'query' if options.boolean else 'regex'}: "
+                    f"{html.escape(error)}",)
+
+    trigrams = (query_trigrams(query, charset, options.ignorecase,
+                               options.regex, options.boolean, invert,
+                               bytewise) if index_dir else None)
+    time_range = compile_time_range(timestamp, options.timefrom,
+                                    options.timeto)
 
     # logfiles.dir2files is a dictionary whose keys reflect any logdir given
     # in the config file
@@ -201,79 +3351,37 @@ def search(charset, logdirs, logfiles, fileselect, query, reverse, ignorecase,
     # or not, respectively
     # the inner filter() emits only those logdirs that contain logfiles
     # the outer filter() emits only those logfiles that the user asked for
-    for num_logfiles, logfile in enumerate(filter(
+    selected_logfiles = list(filter(
         lambda logfile: "path" in logfile and logfile["path"] in fileselect,
         [logfile for logdir in filter(
             lambda logdir: logdir in logfiles.dir2files, logdirs)
-         for logfile in logfiles.dir2files[logdir]]), 1):
-
-        try:
-            if logfile["path"].lower().endswith(".gz"):
-                fp = gzip.open(logfile["path"], "rb")
-            elif logfile["path"].lower().endswith(".bz2"):
-                fp = bz2.open(logfile["path"], "rb")
-            elif logfile["path"].lower().endswith(".xz"):
-                fp = lzma.open(logfile["path"], "rb")
-            else:
-                fp = open(logfile["path"], "rb")
-        except Exception as e:
-            return "", (f"Error: {html.escape(str(e))}",)
-
-        b4buf = collections.deque()
-        lines = collections.deque()
-        num_after = after
-        line_number = 0
-
-        for line_number, raw_line in enumerate(fp, 1):
-            len_raw_line = len(raw_line)
-            line = raw_line.decode(charset, errors="replace")
-
-            total_bytes += len_raw_line
-            found, matches = eval_matches(list(matcher(line)), line)
-
-            if not found:
-                if num_after < after:
-                    lines.append((line, [], len_raw_line, line_number))
-                    num_after += 1
-                else:
-                    b4buf.append((line, [], len_raw_line, line_number))
-                    while len(b4buf) > before:
-                        b4buf.popleft()
-                continue
-
-            matching_lines += 1
-            matching_bytes += len_raw_line
-
-            while (reverse and len(lines) > 0 and 
-                   (limit_lines <= shown_lines or
-                    limit_bytes <= shown_bytes)):
-                shown_lines -= 1
-                tmpline = lines.popleft()
-                shown_bytes -= tmpline[2]
-
-            if (limit_lines > shown_lines and
-                    limit_bytes > shown_bytes):
-                for tmpline in b4buf:
-                    shown_lines += 1
-                    shown_bytes += tmpline[2]
-                    lines.append(tmpline)
-                b4buf.clear()
-                num_after = 0
-                shown_lines += 1
-                shown_bytes += len_raw_line
-                lines.append((line, matches, len_raw_line, line_number))
+         for logfile in logfiles.dir2files[logdir]]))
 
+    def render_logfile(path, lines, line_number, num_lines=None):
+        # lines are given in file order; the lines of a logfile read partly
+        # in reverse mode are numbered backwards from its end, i.e. -1 is the
+        # last line, unless its number of lines is known
         if reverse:
-            lines.reverse()
+            lines = reversed(lines)
 
-        total_lines += line_number
+        first_line = 0
+        if line_number < 0 and num_lines is not None:
+            first_line = num_lines + 1
+            line_number = num_lines
         len_max_line_number = len(str(line_number))
 
-        html_lines += ['<div class="lf">',
-                       logfile["path"],
-                       "</div>"]
-        for line in lines:
-            line, matches, line_number = line[0], line[1], line[3]
+        yield '<div class="lf">'
+        yield path
+        if line_number < 0:
+            yield ' <span class="ln">(lines numbered from the end)</span>'
+        yield "</div>"
+        for line, matched, _, line_number in lines:
+            start = time.perf_counter()
+            line, matches = decode_matches(line, matched, matcher, invert,
+                                           charset, bytewise)
+
+            if line_number < 0:
+                line_number += first_line
             html_line = ['<div class="sl"><span class="ln">',
                          str(line_number).rjust(len_max_line_number),
                          "</span>"]
@@ -286,19 +3394,508 @@ def search(charset, logdirs, logfiles, fileselect, query, reverse, ignorecase,
                 oldend = m[1]
             html_line += [html.escape(line[oldend:]),
                           "</div>"]
-            html_lines += ["".join(html_line)]
+            html_line = "".join(html_line)
+            if timed:
+                timings.measure("render", start)
+            yield html_line
+
+    # on autorefresh, tail holds the state of the previous search of the
+    # same session, so that just the lines appended since then need to be
+    # searched; fast mode does not read logfiles up to their ends
+    params = (charset, query, reverse, options.ignorecase, invert,
+              options.regex, options.boolean, before, after, limit_lines,
+              limit_bytes, fast, timestamp, options.timefrom, options.timeto,
+              [logfile["path"] for logfile in selected_logfiles])
+
+    # a search stopped by the limits in forward mode may be continued on
+    # the next page, which starts behind the lines shown so far and in front
+    # of the first match not shown, rather than searching all lines up to
+    # there again; a search is paged in fast mode, as its totals would just
+    # cover the lines behind the previous page otherwise
+    pageable = (paging is not None and not reverse and not time_range and
+                tail is None)
+    search_id = hashlib.sha256(
+        repr(params[:11] + params[12:]).encode(errors="surrogateescape")
+    ).hexdigest()
+    resume = paging.get("resume") if pageable else None
+    if (not resume or resume["search"] != search_id or
+            resume["file"] >= len(selected_logfiles)):
+        resume = None
+    else:
+        fast = True
+        options = options._replace(fast=fast)
+        params = params[:11] + (fast,) + params[12:]
+    first = resume["file"] if resume else -1
+    next_page = None
+
+    refreshed = (tail and tail.get("params") == params and
+                 (reverse or not fast) and
+                 tail_logfiles(tail["scan"], tail["cursors"], tester, invert))
+    if refreshed:
+        scan = tail["scan"]
+        cursors = tail["cursors"]
+        for cursor in cursors:
+            if cursor["lines"] is not None:
+                yield from render_logfile(cursor["path"], cursor["lines"],
+                                          cursor["num_lines"])
+        selected_logfiles = []
+        num_logfiles = len(cursors)
+    else:
+        scan = LogScan(charset, bytewise, limit_lines, limit_bytes, reverse,
+                       before, after, timed)
+        cursors = []
+
+    # the catalog tells about the logfiles which have been read completely
+    # before, e.g. which of them lie outside of the time range
+    catalog = load_catalog(catalog_file) if catalog_file else None
+    if catalog and timings is not None:
+        timings.add_error(catalog.error)
+    timestamp_re = (re.compile(timestamp.encode()) if catalog and timestamp
+                    else None)
+
+    def is_unchanged(path, fingerprint):
+        # tells whether a logfile has not changed while it was searched
+        try:
+            return logfile_fingerprint(os.stat(path)) == fingerprint
+        except OSError:
+            return False
+
+    # the result of a logfile searched on its own is taken from the result
+    # cache unless the logfile has changed since
+    fingerprints = [None] * len(selected_logfiles)
+    cache_keys = [None] * len(selected_logfiles)
+    results = [None] * len(selected_logfiles)
+    if cache_size or cache_dir or catalog:
+        for num_logfile, logfile in enumerate(selected_logfiles):
+            if num_logfile <= first:
+                continue
+            try:
+                fingerprint = logfile_fingerprint(os.stat(logfile["path"]))
+            except OSError:
+                continue
+            fingerprints[num_logfile] = fingerprint
+            entry = catalog and catalog.get(logfile["path"], fingerprint)
+            if catalog:
+                metrics.add_catalog(entry is not None)
+            if (time_range and entry and entry["first"] is not None and
+                    entry["last"] is not None and
+                    ((time_range[1] is not None and
+                      entry["last"] < time_range[1]) or
+                     (time_range[2] is not None and
+                      entry["first"] > time_range[2]))):
+                # no line of the logfile lies within the time range
+                results[num_logfile] = (None, 0, None)
+                continue
+            if not (cache_size or cache_dir):
+                continue
+            cache_keys[num_logfile] = (logfile["path"], *fingerprint,
+                                       *params[:-1])
+            cached = result_cache.get(cache_keys[num_logfile], cache_dir,
+                                      cache_size)
+            if cached:
+                results[num_logfile] = (None, *cached)
+
+    # each logfile is searched on its own by a pool of worker processes,
+    # then the results are merged in order, which may require to search a
+    # logfile again if the lines shown for its predecessors interfere; just
+    # as many logfiles as there are workers are submitted ahead of the one
+    # being merged, so that few scans are wasted once the limits are
+    # reached; in reverse mode, any logfile after the first one showing
+    # lines would be searched again, thus no pool is used at all
+    executor = None
+    futures = {}
+    uncached = collections.deque(
+        num_logfile for num_logfile, result in enumerate(results)
+        if result is None and num_logfile > first)
+    workers = options.workers
+    if workers > 1 and not reverse and len(uncached) > 1:
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(
+            min(workers, len(uncached)))
+
+    def submit_logfiles():
+        while executor and uncached and len(futures) < workers:
+            num_logfile = uncached.popleft()
+            futures[num_logfile] = executor.submit(
+                scan_logfile_worker, selected_logfiles[num_logfile]["path"],
+                options, catalog is not None, timed)
+
+    submit_logfiles()
+
+    metrics.start_search()
+    try:
+        for num_logfiles, logfile in enumerate(selected_logfiles, 1):
+            if num_logfiles - 1 < first:
+                # shown by previous pages
+                continue
+
+            # in reverse mode, subsequent logfiles cannot add any lines,
+            # whereas in fast mode, they would just add to the totals
+            if (reverse or fast) and scan.limits_reached():
+                if pageable and not next_page:
+                    next_page = (num_logfiles - 1, logfile["path"], 0, 0, 0)
+                scan.partial = True
+                if executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    uncached.clear()
+                cursors.append({"path": logfile["path"], "lines": None})
+                continue
+
+            start = time.perf_counter()
+            total_lines, total_bytes = scan.total_lines, scan.total_bytes
+            partial = scan.partial
+            fingerprint = fingerprints[num_logfiles - 1]
+            key = cache_keys[num_logfiles - 1]
+            result = results[num_logfiles - 1]
+            source = ("scanned" if result is None else
+                      "catalog" if result[2] is None else "cached")
+            if result is None and num_logfiles - 1 in futures:
+                result = futures.pop(num_logfiles - 1).result()
+                submit_logfiles()
+                source = "worker"
+            elif result is None and key and (
+                    not reverse or scan.shown_lines == scan.shown_bytes == 0):
+                # searched on its own, so that the result can be cached,
+                # which merge() in reverse mode takes over for the first
+                # logfile showing any lines only
+                other = LogScan(charset, bytewise, limit_lines, limit_bytes,
+                                reverse, before, after, timed)
+                error, line_number = scan_logfile(other, logfile["path"],
+                                                  tester, finder, invert,
+                                                  fast, index_dir, trigrams,
+                                                  time_range, timestamp_re)
+                other.file_times["scan"] = time.perf_counter() - start
+                other.b4buf.clear()
+                other.pending.clear()
+                result = (error, line_number, other)
+
+            if result and result[2] is None:
+                # according to the catalog
+                scan.start_file()
+                error, line_number, _ = result
+            else:
+                if result:
+                    error, line_number, other = result
+                    if (not error and key and
+                            result is not results[num_logfiles - 1] and
+                            is_unchanged(logfile["path"], fingerprint)):
+                        result_cache.put(key, (line_number, other),
+                                         cache_size, cache_dir)
+                if not result or (not error and not scan.merge(other)):
+                    scan_start = time.perf_counter()
+                    error, line_number = scan_logfile(
+                        scan, logfile["path"], tester, finder, invert, fast,
+                        index_dir, trigrams, time_range, timestamp_re,
+                        (resume["ino"], resume["offset"], resume["anchor"],
+                         resume["line"])
+                        if num_logfiles - 1 == first else None)
+                    scan.file_times["scan"] = time.perf_counter() - scan_start
+                    source = "scanned"
+            if error:
+                return "", (f"Error: {html.escape(error)}",)
+
+            if (catalog and fingerprint and scan.file_stats and
+                    not catalog.get(logfile["path"], fingerprint) and
+                    is_unchanged(logfile["path"], fingerprint)):
+                catalog.update(logfile["path"], fingerprint, scan.file_stats)
+
+            num_lines = None
+            if line_number > 0 and scan.lines and scan.lines[0][3] < 0:
+                line_number = -line_number
+                # the catalog may know the number of lines of the logfile
+                entry = (catalog and fingerprint and
+                         catalog.get(logfile["path"], fingerprint))
+                if entry and is_unchanged(logfile["path"], fingerprint):
+                    num_lines = entry["lines"]
+
+            if pageable and not next_page and scan.limits_reached():
+                # the lines in front of the first match not shown are before
+                # context, unless shown already, as the lines shown end in
+                # front of it; a search stopped in fast mode continues behind
+                # the last line read
+                offset, shown = scan.file_start
+                if scan.lines:
+                    shown = max(shown, scan.lines[-1][3])
+                if scan.first_rejected is not None:
+                    resume_line = max(scan.first_rejected - 1 - before,
+                                      shown)
+                elif scan.partial and not partial:
+                    resume_line = line_number
+                else:
+                    resume_line = None
+                if resume_line is not None:
+                    next_page = (num_logfiles - 1, logfile["path"], offset,
+                                 scan.file_start[1], resume_line)
+
+            if source in ("scanned", "worker"):
+                metrics.add_logfile(logfile["path"],
+                                    scan.total_lines - total_lines,
+                                    scan.total_bytes - total_bytes)
+            if timed:
+                timings.add_logfile(logfile, source, scan, total_lines,
+                                    total_bytes)
+            if timings is not None:
+                timings.measure("search", start)
+            yield from render_logfile(logfile["path"], scan.lines,
+                                      line_number, num_lines)
+            if tail is not None:
+                cursors.append(logfile_cursor(scan, logfile["path"],
+                                              line_number))
+    finally:
+        metrics.end_search()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if catalog:
+            catalog.save()
+            if timings is not None:
+                timings.add_error(catalog.error)
+    if not refreshed:
+        # the totals of a refreshed search include the previous search
+        metrics.add_search(scan)
+
+    if tail is not None:
+        # the lines shown are kept by the cursors only
+        scan.start_file()
+        tail.update(params=params, scan=scan, cursors=cursors)
+
+    if next_page:
+        num_logfile, path, offset, anchor, resume_line = next_page
+        try:
+            ino = os.stat(path).st_ino
+        except OSError:
+            ino = None
+        paging["next"] = {"search": search_id, "file": num_logfile,
+                          "ino": ino, "offset": offset, "anchor": anchor,
+                          "line": resume_line,
+                          "page": resume["page"] + 1 if resume else 2}
+
+    html_totals = (
+        f"{scan.matching_lines} ({bytes_pretty(scan.matching_bytes)}) "
+        f"matching, "
+        f"{scan.total_lines} ({bytes_pretty(scan.total_bytes)}) total"
+    )
+    entries = []
+    if catalog:
+        entries = [catalog.get(logfile["path"], fingerprint)
+                   for logfile, fingerprint in zip(selected_logfiles,
+                                                   fingerprints)]
+    if scan.partial and not time_range and entries and all(entries):
+        # the catalog knows the totals, whereas the matches are lower bounds
+        html_totals = (
+            '<span title="Search stopped as soon as the limits were reached">'
+            f"&ge;{scan.matching_lines} "
+            f"(&ge;{bytes_pretty(scan.matching_bytes)}) matching, "
+            f"{sum(entry['lines'] for entry in entries)} "
+            f"({bytes_pretty(sum(entry['bytes'] for entry in entries))}) "
+            "total</span>"
+        )
+    elif scan.partial:
+        # the totals are lower bounds only
+        html_totals = (
+            '<span title="Search stopped as soon as the limits were reached">'
+            f"&ge;{scan.matching_lines} "
+            f"(&ge;{bytes_pretty(scan.matching_bytes)}) matching, "
+            f"&ge;{scan.total_lines} (&ge;{bytes_pretty(scan.total_bytes)}) "
+            "total</span>"
+        )
 
     html_status = (
-        f"""<span{' class="red"' if shown_lines >= limit_lines else ""}>"""
-        f"{shown_lines}</span> (<span"
-        f"""{' class="red"' if shown_bytes >= limit_bytes else ""}>"""
-        f"{bytes_pretty(shown_bytes)}</span>) lines shown, "
-        f"{matching_lines} ({bytes_pretty(matching_bytes)}) matching, "
-        f"{total_lines} ({bytes_pretty(total_bytes)}) total lines in "
+        f"""<span{' class="red"' if scan.shown_lines >= limit_lines else ""}>"""
+        f"{scan.shown_lines}</span> (<span"
+        f"""{' class="red"' if scan.shown_bytes >= limit_bytes else ""}>"""
+        f"{bytes_pretty(scan.shown_bytes)}</span>) lines shown, "
+        f"{html_totals} lines in "
         f'{num_logfiles} selected log file{"" if num_logfiles == 1 else "s"}'
     )
+    if resume:
+        html_status += f" on page {resume['page']}"
+
+    return html_status, None
+
+
+def search(logdirs, logfiles, fileselect, options, tail=None, cache_size=0,
+           cache_dir="", catalog_file="", timings=None, paging=None):
+    # returns the HTML status line and all HTML lines of a search at once
+    html_lines = []
+    lines = search_lines(logdirs, logfiles, fileselect, options, tail,
+                         cache_size, cache_dir, catalog_file, timings,
+                         paging)
+    while True:
+        try:
+            html_lines.append(next(lines))
+        except StopIteration as stop:
+            html_status, error_lines = stop.value
+            return html_status, error_lines or html_lines
+
+
+def search_ndjson(charset, logdirs, logfiles, fileselect, query, ignorecase,
+                  invert, regex, boolean, before, after, limitlines):
+    # yields each line shown by a search as a JSON object on a line of its
+    # own, followed by the totals, or an error which ends the search, in
+    # chunks of about STREAM_CHUNK_SIZE characters; no line is kept beyond
+    # its chunk, thus limitlines may be empty to search without any limit
+    limit_lines = int(limitlines) if limitlines else sys.maxsize
+    before = int(before) if before else 0
+    after = int(after) if after else 0
+
+    error, tester, matcher, finder, bytewise = compile_matcher(
+        query, charset, ignorecase, regex, boolean)
+    if error:
+        yield json.dumps({"error": f"Invalid {'query' if boolean else 'regex'}"
+                                   f": {error}"}) + "\n"
+        return
+
+    # the same logfiles as search_lines() would search
+    selected_logfiles = [
+        logfile["path"] for logdir in logdirs
+        if logdir in logfiles.dir2files
+        for logfile in logfiles.dir2files[logdir]
+        if "path" in logfile and logfile["path"] in fileselect]
+
+    scan = LogScan(charset, bytewise, limit_lines, sys.maxsize, False, before,
+                   after)
+    chunk = []
+    chunk_len = 0
+    metrics.start_search()
+    try:
+        for path in selected_logfiles:
+            if scan.limits_reached():
+                scan.partial = True
+                break
+
+            total_lines, total_bytes = scan.total_lines, scan.total_bytes
+            lines = context_lines(scan, path, tester, finder, invert)
+            try:
+                for line_number, offset, line, matched in lines:
+                    line, matches = decode_matches(line, matched, matcher,
+                                                   invert, charset, bytewise)
+                    chunk.append(json.dumps({"file": path,
+                                             "line": line_number,
+                                             "offset": offset,
+                                             "match": matched,
+                                             "text": line.removesuffix("\n"),
+                                             "spans": matches}))
+                    chunk_len += len(chunk[-1]) + 1
+                    if chunk_len >= STREAM_CHUNK_SIZE:
+                        yield "\n".join(chunk) + "\n"
+                        chunk = []
+                        chunk_len = 0
+                    if scan.limits_reached():
+                        scan.partial = True
+                        break
+            except Exception as e:
+                chunk.append(json.dumps({"file": path, "error": str(e)}))
+                yield "\n".join(chunk) + "\n"
+                return
+            finally:
+                # adds the lines read up to where the search has stopped to
+                # the totals
+                lines.close()
+                metrics.add_logfile(path, scan.total_lines - total_lines,
+                                    scan.total_bytes - total_bytes)
+    finally:
+        metrics.end_search()
+    metrics.add_search(scan)
+
+    chunk.append(json.dumps({"files": len(selected_logfiles),
+                             "shown_lines": scan.shown_lines,
+                             "shown_bytes": scan.shown_bytes,
+                             "matching_lines": scan.matching_lines,
+                             "matching_bytes": scan.matching_bytes,
+                             "total_lines": scan.total_lines,
+                             "total_bytes": scan.total_bytes,
+                             "partial": scan.partial}))
+    yield "\n".join(chunk) + "\n"
+
+
+def render_timings(timings, run_time):
+    # returns the run time, which expands to the phases of the request, and
+    # to how each logfile has been searched, and the errors which did not
+    # fail the request; matching the lines is not timed itself, as timing
+    # each line would slow it down, thus Other is what remains of scanning a
+    # logfile besides waiting for its content and decoding it
+    html_timings = ['<details class="tm">',
+                    f"<summary>Run time: {run_time:.1f}s</summary>",
+                    '<div class="tp">',
+                    "<table>",
+                    "<tr><th>Phase</th><th>Seconds</th></tr>"]
+    for phase, secs in timings.phases.items():
+        html_timings.append(f"<tr><td>{phase}</td><td>{secs:.3f}</td></tr>")
+    html_timings += [
+        "</table>",
+        "<table>",
+        "<tr><th>Logfile</th><th>Source</th><th>Scan</th><th>Wait</th>"
+        "<th>Decompress</th><th>Decode</th>"
+        '<th title="Scan minus Wait and Decode, mostly matching">Other</th>'
+        "<th>Lines</th>"
+        "<th>Bytes</th><th>Lines/s</th><th>Bytes/s</th><th>Ratio</th></tr>"]
+    for logfile in timings.logfiles:
+        cells = [html.escape(logfile["path"]), logfile["source"]]
+        if logfile["source"] in ("scanned", "worker"):
+            secs = logfile["scan"]
+            other = secs - logfile["wait"] - logfile["decode"]
+            cells += [f"{secs:.3f}", f"{logfile['wait']:.3f}",
+                      f"{logfile['decompress']:.3f}",
+                      f"{logfile['decode']:.3f}", f"{max(other, 0):.3f}",
+                      str(logfile["lines"]), bytes_pretty(logfile["bytes"]),
+                      f"{logfile['lines'] / secs:.0f}" if secs > 0 else "",
+                      (bytes_pretty(int(logfile["bytes"] / secs)) + "/s"
+                       if secs > 0 else "")]
+        else:
+            cells += [""] * 5 + [str(logfile["lines"]),
+                                 bytes_pretty(logfile["bytes"]), "", ""]
+        # the compression ratio is known once a logfile has been read
+        # completely
+        stats = logfile["stats"]
+        cells.append(f"{stats['bytes'] / logfile['size']:.1f}"
+                     if stats and logfile["size"] and
+                     re.search(r"(?i:\.(bz2|gz|xz))$", logfile["path"])
+                     else "")
+        html_timings.append("<tr><td>" + "</td><td>".join(cells) +
+                            "</td></tr>")
+    html_timings.append("</table>")
+    if timings.errors:
+        html_timings += (["<table>", "<tr><th>Error</th></tr>"] +
+                         [f"<tr><td>{html.escape(error)}</td></tr>"
+                          for error in timings.errors] +
+                         ["</table>"])
+    html_timings += ["</div>",
+                     "</details>"]
+    return "".join(html_timings)
 
-    return html_status, html_lines
+
+def stream_page(parts):
+    # joins parts by newlines just like "\n".join(parts), whereas a part may
+    # also be a function returning a string, which is called once all parts
+    # before have been joined, or an iterable of strings, which is consumed
+    # just in time; yields chunks of about STREAM_CHUNK_SIZE characters, and
+    # whatever has been joined before an iterable is consumed, so that the
+    # browser can render the page while the logfiles are searched
+    chunk = []
+    chunk_len = 0
+    separator = ""
+
+    for part in parts:
+        if callable(part):
+            part = part()
+        if isinstance(part, str):
+            part = (part,)
+        elif chunk:
+            yield "".join(chunk)
+            chunk = []
+            chunk_len = 0
+
+        for subpart in part:
+            chunk += [separator, subpart]
+            chunk_len += len(subpart) + 1
+            separator = "\n"
+            if chunk_len >= STREAM_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+                chunk_len = 0
+
+    if chunk:
+        yield "".join(chunk)
 
 
 def re_compile_with_error(filter_text):
@@ -310,18 +3907,81 @@ def re_compile_with_error(filter_text):
     return None, filter_re
 
 
-def pocgi(environ, is_wsgi):
-    class Form(dict):
-        def getvalue(self, key, default):
-            value = self.get(key, None)
-            return value[0] if value else default
+def load_config(configfile):
+    # returns the parsed config file, the options of each section which
+    # decide whether a user may select it as role, and the compiled regexes
+    # of all sections by their pattern; a WSGI process keeps them until the
+    # config file is replaced or modified
+    try:
+        stat = os.stat(configfile)
+        fingerprint = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        fingerprint = None
+
+    cached = config_cache.get(configfile)
+    if cached and cached[0] == fingerprint:
+        return cached[1:]
+
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(configfile)
+
+    regexes = {}
+    role_options = []
+    for section, options in config.items():
+        patterns = ["", options.get("dirfilter", ""),
+                    options.get("filefilter", ""),
+                    TIMESTAMP_FORMATS.get(options.get("timestamp", ""),
+                                          options.get("timestamp", "")),
+                    options.get("profile_users", ""),
+                    options.get("metrics_clients", "")]
+        role_options.append((section, []))
+        for k, v in options.items():
+            if k == "users" or k.startswith("env_"):
+                role_options[-1][1].append((k, v))
+                patterns.append(v)
+        for pattern in patterns:
+            if pattern not in regexes:
+                regexes[pattern] = re_compile_with_error(pattern)
+
+    config_cache[configfile] = (fingerprint, config, role_options, regexes)
+    return config, role_options, regexes
+
+
+def is_datetime(text):
+    try:
+        datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return False
+
+    return True
+
+
+class Form(dict):
+    def getvalue(self, key, default):
+        value = self.get(key, None)
+        return value[0] if value else default
+
+    def getlist(self, key):
+        return self.get(key, [])
+
+
+def selected_dirs(fileselect):
+    # returns the directories of the selected logfiles along with their
+    # parents, i.e. those which a lazy filetree expands
+    expand = set()
+    for path in fileselect:
+        path = os.path.dirname(path)
+        while path not in expand and path != os.path.dirname(path):
+            expand.add(path)
+            path = os.path.dirname(path)
+    return expand
 
-        def getlist(self, key):
-            return self.get(key, [])
 
+def pocgi(environ, is_wsgi):
     clen = environ.get("CONTENT_LENGTH", None)
     if not type(clen) is str or not clen.isdecimal():
-        return {}
+        return Form()
 
     clen = int(clen)
     if is_wsgi:
@@ -334,6 +3994,11 @@ def pocgi(environ, is_wsgi):
 
 
 def logblitz(environ, is_wsgi, start_time):
+    timings = Timings()
+    # a CGI process has to load this script first
+    start = (time.perf_counter() if is_wsgi else
+             timings.measure("startup", start_time))
+
     rawcookies = http.cookies.SimpleCookie()
     try:
         rawcookies.load(environ.get("HTTP_COOKIE", ""))
@@ -344,10 +4009,18 @@ def logblitz(environ, is_wsgi, start_time):
     sane_ruser = re.sub(r"[^a-zA-Z0-9.-]", "_",
                         (remote_user if remote_user else ""))
     is_post = (environ.get("REQUEST_METHOD", "GET") == "POST")
+    # scripts search through ?search, which takes the same fields as the
+    # form, either in the URL or posted, see search_ndjson()
+    is_api = "search" in urllib.parse.parse_qs(
+        environ.get("QUERY_STRING", ""), keep_blank_values=True)
 
     if is_post:
         form = pocgi(environ, is_wsgi)
         role = form.getvalue("role", "")
+    elif is_api:
+        form = Form(urllib.parse.parse_qs(environ.get("QUERY_STRING", ""),
+                                          encoding=HTML_CHARSET))
+        role = form.getvalue("role", "")
     elif remote_user and "role_%s" % sane_ruser in rawcookies:
         role = rawcookies["role_%s" % sane_ruser].value
     else:
@@ -364,6 +4037,11 @@ def logblitz(environ, is_wsgi, start_time):
                for x in rawcookies.items()
                if x[0].endswith(csuffix)}
 
+    # identifies the state kept for autorefresh across requests
+    session = rawcookies["session"].value if "session" in rawcookies else ""
+    if not re.fullmatch(r"[0-9a-f]{32}", session):
+        session = ""
+
     rawcookies.clear()
 
     configfile = environ.get("SCRIPT_FILENAME", None)
@@ -376,18 +4054,18 @@ def logblitz(environ, is_wsgi, start_time):
 
     configfile = os.path.join(configfile, os.pardir, "etc", "logblitz.ini")
 
-    config = configparser.ConfigParser()
-    config.optionxform = str
-    config.read(configfile)
+    start = timings.measure("parse", start)
+    config, role_options, regexes = load_config(configfile)
+    start = timings.measure("config", start)
 
     roles = []
     roles_error = None
     if remote_user:
-        for section, options in config.items():
+        for section, options in role_options:
             add_section = None
-            for k, v in options.items():
+            for k, v in options:
                 if k == "users":
-                    err, users_re = re_compile_with_error(v)
+                    err, users_re = regexes[v]
                     if err:
                         roles_error = "[%s]: %s: %s: %s" % (section, k, v,
                                                             str(err))
@@ -397,7 +4075,7 @@ def logblitz(environ, is_wsgi, start_time):
                                        users_re.search(remote_user))
                 elif k.startswith("env_"):
                     envname = k.removeprefix("env_")
-                    err, env_re = re_compile_with_error(v)
+                    err, env_re = regexes[v]
                     if err:
                         roles_error = "[%s]: %s: %s: %s" % (section, k, v,
                                                             str(err))
@@ -408,6 +4086,7 @@ def logblitz(environ, is_wsgi, start_time):
                                        env_re.search(environ[envname]))
             if add_section:
                 roles.append(section)
+    start = timings.measure("roles", start)
 
     if role and role in roles:
         config_section = role
@@ -451,11 +4130,196 @@ def logblitz(environ, is_wsgi, start_time):
     else:
         nice_username_env = ""
 
+    if config.has_option(config_section, "workers"):
+        workers = config.get(config_section, "workers")
+    else:
+        workers = ""
+    workers = int(workers) if workers.isdecimal() else 1
+    if is_wsgi:
+        # forking a WSGI process, which may run other requests in threads,
+        # is unsafe, whereas spawning a worker would run the webserver's
+        # executable; multiple WSGI processes serve requests in parallel
+        workers = 1
+
+    if config.has_option(config_section, "index_dir"):
+        index_dir = config.get(config_section, "index_dir")
+    else:
+        index_dir = ""
+
+    if config.has_option(config_section, "timestamp"):
+        timestamp = config.get(config_section, "timestamp")
+    else:
+        timestamp = ""
+    timestamp = TIMESTAMP_FORMATS.get(timestamp, timestamp)
+
+    if config.has_option(config_section, "session_dir"):
+        session_dir = config.get(config_section, "session_dir")
+    else:
+        session_dir = ""
+
+    if config.has_option(config_section, "dircache"):
+        dircache = config.get(config_section, "dircache")
+    else:
+        dircache = ""
+
+    if config.has_option(config_section, "filetree"):
+        filetree = config.get(config_section, "filetree")
+    else:
+        filetree = ""
+
+    if config.has_option(config_section, "result_cache"):
+        result_cache_size = config.get(config_section, "result_cache")
+    else:
+        result_cache_size = ""
+    result_cache_size = (int(result_cache_size) * 1024**2
+                         if result_cache_size.isdecimal() else 0)
+
+    if config.has_option(config_section, "result_cache_dir"):
+        result_cache_dir = config.get(config_section, "result_cache_dir")
+    else:
+        result_cache_dir = ""
+
+    if config.has_option(config_section, "catalog"):
+        catalog_file = config.get(config_section, "catalog")
+    else:
+        catalog_file = ""
+
+    if config.has_option(config_section, "debug"):
+        debug = config.get(config_section, "debug")
+    else:
+        debug = ""
+
+    timings.detailed = (debug == "timings")
+
+    if config.has_option(config_section, "page_secret"):
+        page_secret = config.get(config_section, "page_secret")
+    else:
+        page_secret = ""
+
+    # a token for the next page must be signed by the same key, which is
+    # unique to this process unless page_secret is set, as CGI requires
+    page_secret = (page_secret.encode() if page_secret else
+                   page_key if is_wsgi else None)
+
+    if config.has_option(config_section, "metrics_clients"):
+        metrics_clients = config.get(config_section, "metrics_clients")
+    else:
+        metrics_clients = ""
+
+    # Prometheus scrapes the metrics of this process from ?metrics, if the
+    # address of the client is allowed to
+    if (metrics_clients and not is_post and
+            "metrics" in urllib.parse.parse_qs(
+                environ.get("QUERY_STRING", ""), keep_blank_values=True)):
+        _, metrics_clients_re = regexes[metrics_clients]
+        if (metrics_clients_re and
+                metrics_clients_re.search(environ.get("REMOTE_ADDR", ""))):
+            result = metrics.render()
+            return ([("Content-Type", "text/plain; version=0.0.4")],
+                    [result.encode() if is_wsgi else result])
+
+    if config.has_option(config_section, "profile_dir"):
+        profile_dir = config.get(config_section, "profile_dir")
+    else:
+        profile_dir = ""
+
+    if config.has_option(config_section, "profile_users"):
+        profile_users = config.get(config_section, "profile_users")
+    else:
+        profile_users = ""
+
+    # a request is profiled if it carries the debug form field, which may
+    # also be given in the URL to profile each search submitted from there
+    profile = None
+    if profile_dir and profile_users and remote_user:
+        debug_fields = urllib.parse.parse_qs(
+            environ.get("QUERY_STRING", "")).get("debug", [])
+        if is_post:
+            debug_fields += form.getlist("debug")
+        _, profile_users_re = regexes[profile_users]
+        if ((set(debug_fields) & {"profile", "tracemalloc"}) and
+                profile_users_re and profile_users_re.search(remote_user)):
+            profile = RequestProfile(profile_dir,
+                                     "tracemalloc" in debug_fields)
+
+    if is_api:
+        start = timings.measure("parse", start)
+        filefilter = form.getvalue("filefilter", "")
+        fileselect = form.getlist("fileselect")
+        error_ff, filefilter_re = re_compile_with_error(filefilter)
+        error_cfgff, cfgfilefilter_re = regexes[cfgfilefilter]
+        error_cfgdf, cfgdirfilter_re = regexes[cfgdirfilter]
+        if roles_error:
+            error = f"Invalid roles in INI file: {roles_error}"
+        elif not cfgdirfilter_re:
+            error = (f"Invalid dirfilter in INI file: {cfgdirfilter}: "
+                     f"{error_cfgdf}")
+        elif not cfgfilefilter_re:
+            error = (f"Invalid filefilter in INI file: {cfgfilefilter}: "
+                     f"{error_cfgff}")
+        elif not filefilter_re:
+            error = f"Invalid filefilter: {filefilter}: {error_ff}"
+        else:
+            error = None
+
+        # the same logfiles as shown in the filetree may be searched, of
+        # which just the directories of the selected ones are traversed
+        logfiles = LogFiles()
+        if not error:
+            for logdir in logdirs:
+                traverse_logdir(logdir.removesuffix(os.path.sep),
+                                cfgdirfilter_re, cfgfilefilter_re,
+                                filefilter_re, logfiles,
+                                "showdotfiles" in form, False,
+                                use_inotify=(dircache == "inotify"),
+                                expand=selected_dirs(fileselect))
+        start = timings.measure("tree", start)
+
+        charset = form.getvalue("charset", "") or charset
+        try:
+            codecs.lookup(charset)
+        except LookupError:
+            charset = "ISO-8859-1"
+        before, after, limitlines = (
+            tmp if tmp.isnumeric() else ""
+            for tmp in (form.getvalue("before", ""),
+                        form.getvalue("after", ""),
+                        form.getvalue("limitlines", "")))
+
+        def stream_ndjson():
+            if error:
+                lines = iter([json.dumps({"error": error}) + "\n"])
+            else:
+                lines = search_ndjson(
+                    charset, logdirs, logfiles, fileselect,
+                    form.getvalue("query", ""), "ignorecase" in form,
+                    "invert" in form, "regex" in form, "boolean" in form,
+                    before, after, limitlines)
+            while True:
+                start = time.perf_counter()
+                chunk = next(lines, None)
+                timings.measure("search", start)
+                if chunk is None:
+                    break
+                yield chunk.encode() if is_wsgi else chunk
+            metrics.add_request("api", timings,
+                                time.perf_counter() - start_time)
+
+        headers = [("Content-Type", "application/x-ndjson"),
+                   ("Server-Timing", timings.server_timing())]
+        if profile:
+            profile.params = {"user": remote_user, "role": role,
+                              "api": dict(form), "phases": timings.phases}
+            return headers, profile.page(stream_ndjson())
+        return headers, stream_ndjson()
+
     query = cookies["query"] if "query" in cookies else ""
     reverse = "reverse" in cookies and cookies["reverse"] == "True"
     ignorecase = "ignorecase" in cookies and cookies["ignorecase"] == "True"
     invert = "invert" in cookies and cookies["invert"] == "True"
     regex = "regex" in cookies and cookies["regex"] == "True"
+    boolean = "boolean" in cookies and cookies["boolean"] == "True"
+    fast = "fast" in cookies and cookies["fast"] == "True"
     showlinenumbers = ("showlinenumbers" in cookies and
                        cookies["showlinenumbers"] == "True")
     wraplines = ("wraplines" in cookies and
@@ -478,6 +4342,10 @@ def logblitz(environ, is_wsgi, start_time):
     tmp = cookies["after"] if "after" in cookies else "0"
     if tmp == "" or tmp.isnumeric():
         after = tmp
+    tmp = cookies["timefrom"] if "timefrom" in cookies else ""
+    timefrom = tmp if tmp == "" or is_datetime(tmp) else ""
+    tmp = cookies["timeto"] if "timeto" in cookies else ""
+    timeto = tmp if tmp == "" or is_datetime(tmp) else ""
     fileselect = (cookies["fileselect"].split(os.pathsep)
                   if "fileselect" in cookies else [])
     oldfileselect = [c for c in cookies.keys()
@@ -496,6 +4364,8 @@ def logblitz(environ, is_wsgi, start_time):
             ignorecase = "ignorecase" in form
             invert = "invert" in form
             regex = "regex" in form
+            boolean = "boolean" in form
+            fast = "fast" in form
             showlinenumbers = "showlinenumbers" in form
             wraplines = "wraplines" in form
             showdotfiles = "showdotfiles" in form
@@ -515,6 +4385,10 @@ def logblitz(environ, is_wsgi, start_time):
             tmp = form.getvalue("after", "")
             if tmp == "" or tmp.isnumeric():
                 after = tmp
+            tmp = form.getvalue("timefrom", "")
+            timefrom = tmp if tmp == "" or is_datetime(tmp) else ""
+            tmp = form.getvalue("timeto", "")
+            timeto = tmp if tmp == "" or is_datetime(tmp) else ""
             autorefresh = "autorefresh" in form
             tmp = form.getvalue("refreshsec", "")
             refreshsec = tmp if tmp.isnumeric() else "2"
@@ -524,8 +4398,12 @@ def logblitz(environ, is_wsgi, start_time):
             cookies["ignorecase"] = ignorecase
             cookies["invert"] = invert
             cookies["regex"] = regex
+            cookies["boolean"] = boolean
+            cookies["fast"] = fast
             cookies["before"] = before
             cookies["after"] = after
+            cookies["timefrom"] = timefrom
+            cookies["timeto"] = timeto
             cookies["showlinenumbers"] = showlinenumbers
             cookies["wraplines"] = wraplines
             cookies["showdotfiles"] = showdotfiles
@@ -544,6 +4422,10 @@ def logblitz(environ, is_wsgi, start_time):
         if remote_user:
             rawcookies["role_%s" % sane_ruser] = role
 
+    if session_dir and not session:
+        session = secrets.token_hex(16)
+        rawcookies["session"] = session
+
     try:
         codecs.lookup(charset)
     except LookupError:
@@ -568,13 +4450,39 @@ def logblitz(environ, is_wsgi, start_time):
             rawcookies.pop(k)
 
     error_ff, filefilter_re = re_compile_with_error(filefilter)
-    error_cfgff, cfgfilefilter_re = re_compile_with_error(cfgfilefilter)
-    error_cfgdf, cfgdirfilter_re = re_compile_with_error(cfgdirfilter)
+    error_cfgff, cfgfilefilter_re = regexes[cfgfilefilter]
+    error_cfgdf, cfgdirfilter_re = regexes[cfgdirfilter]
+    error_ts, timestamp_re = regexes[timestamp]
+
+    # the filetree expands a collapsed directory by fetching ?ls=<directory>
+    ls = urllib.parse.parse_qs(environ.get("QUERY_STRING", "")).get("ls")
+    if ls and not is_post:
+        start = timings.measure("parse", start)
+        listing = None
+        if (not roles_error and cfgdirfilter_re and cfgfilefilter_re and
+                filefilter_re):
+            listing = list_logdir(ls[0], logdirs, cfgdirfilter_re,
+                                  cfgfilefilter_re, filefilter_re,
+                                  showdotfiles, showunreadables,
+                                  use_inotify=(dircache == "inotify"))
+        result = json.dumps(listing)
+        result = [result.encode() if is_wsgi else result]
+        timings.measure("tree", start)
+        metrics.add_request("ls", timings, time.perf_counter() - start_time)
+        headers = [("Content-Type", "application/json"),
+                   ("Server-Timing", timings.server_timing())]
+        if profile:
+            profile.params = {"user": remote_user, "role": role,
+                              "ls": ls[0], "phases": timings.phases}
+            return headers, profile.page(result)
+        return headers, result
 
     logfiles = LogFiles()
 
     html_status = ""
+    html_next_page = ""
     html_lines = []
+    kind = "page"
 
     if roles_error:
         html_lines = ("Error: Invalid roles in INI file:",
@@ -587,11 +4495,19 @@ def logblitz(environ, is_wsgi, start_time):
         html_lines = ("Error: Invalid filefilter in INI file:",
                       html.escape(cfgfilefilter), ":",
                       html.escape(str(error_cfgff)))
+    elif not timestamp_re:
+        html_lines = ("Error: Invalid timestamp in INI file:",
+                      html.escape(timestamp), ":",
+                      html.escape(str(error_ts)))
     elif not filefilter_re:
         html_lines = ("Error: Invalid filefilter:",
                       html.escape(filefilter), ":",
                       html.escape(str(error_ff)))
     else:
+        start = timings.measure("parse", start)
+        # only the directories of the selected logfiles are traversed
+        expand = selected_dirs(fileselect) if filetree == "lazy" else None
+
         for logdir in logdirs:
             logfiles.total_dirs += 1
 
@@ -600,15 +4516,60 @@ def logblitz(environ, is_wsgi, start_time):
 
             if traverse_logdir(logdir, cfgdirfilter_re, cfgfilefilter_re,
                                filefilter_re, logfiles, showdotfiles,
-                               showunreadables):
+                               showunreadables,
+                               use_inotify=(dircache == "inotify"),
+                               expand=expand):
                 logfiles.shown_dirs += 1
+        timings.measure("tree", start)
 
         if (is_post and (role == oldrole)) or autorefresh:
-            html_status, html_lines = search(charset, logdirs, logfiles,
-                                             fileselect, query, reverse,
-                                             ignorecase, invert, regex,
-                                             before, after, limitlines,
-                                             limitmemory)
+            # a search submitted by the user starts afresh, whereas
+            # autorefresh continues the previous search
+            tail = None
+            if session_dir and autorefresh:
+                tailfile = tail_filename(session_dir, session, csuffix)
+                tail = {} if is_post else load_tail(tailfile)
+
+            # the next page button submits where the next page starts
+            paging = None
+            if page_secret and tail is None:
+                paging = {}
+                token = form.getvalue("continue", "") if is_post else ""
+                if token:
+                    paging["resume"] = decode_page_token(page_secret, token)
+
+            # the logfiles are searched while the page is sent, see
+            # stream_page()
+            kind = "search"
+
+            def stream_search():
+                nonlocal html_status, html_next_page
+
+                html_status, error_lines = yield from search_lines(
+                    logdirs, logfiles, fileselect, SearchOptions(
+                        charset, query, reverse, ignorecase, invert, regex,
+                        boolean, before, after, limitlines, limitmemory,
+                        fast, workers, index_dir, timestamp, timefrom,
+                        timeto),
+                    tail, result_cache_size, result_cache_dir, catalog_file,
+                    timings, paging)
+                if error_lines:
+                    yield from error_lines
+                elif paging and paging.get("next"):
+                    token = encode_page_token(page_secret, paging["next"])
+                    html_next_page = (
+                        '<button type="submit" name="continue" value="'
+                        f'{token}" style="margin-left:10px" title="Continue '
+                        'the search behind the lines shown">Next page'
+                        "</button>")
+
+                if tail:
+                    try:
+                        save_tail(session_dir, tailfile, tail)
+                    except OSError:
+                        pass
+
+            html_lines = stream_search()
 
     result = ["""<!DOCTYPE html>
 <html>
@@ -667,6 +4628,28 @@ optgroup {
 .red {
   color: red;
 }
+.tm {
+  display: inline-block;
+}
+.tm summary {
+  cursor: pointer;
+}
+.tp {
+  position: fixed;
+  right: 10px;
+  bottom: 2em;
+  max-width: 90%;
+  max-height: 60%;
+  overflow: auto;
+  padding: 5px;
+  font-family: monospace;
+  background-color: white;
+  border: 1px solid darkgray;
+}
+.tp td {
+  padding-right: 1em;
+  white-space: nowrap;
+}
 .bar {
   cursor: col-resize;
   border-left: 1px solid darkgray;
@@ -754,6 +4737,14 @@ optgroup {
  onclick="toggle('regex')">Regular expression</span>
 </span>
 <span class="box">
+<input type="checkbox" name="boolean" style="margin-left:10px" ''' +
+              ('checked="checked" ' if boolean else "") +
+              '''id="boolean"
+ title="Combine search terms by AND, OR, NOT, and parentheses">
+<span title="Combine search terms by AND, OR, NOT, and parentheses"
+ onclick="toggle('boolean')">Boolean</span>
+</span>
+<span class="box">
 <input type="checkbox" name="showlinenumbers" style="margin-left:10px" ''' +
               ('checked="checked" ' if showlinenumbers else "") +
               '''id="showlinenumbers"
@@ -802,7 +4793,20 @@ optgroup {
               '''"
  title="Charset of logfiles" style="width:7em">
 </span>
-<span class="box">
+''' + ("" if not timestamp else '''<span class="box">
+<span title="Search lines within this time range"
+ style="margin-left:10px">Time:</span>
+<input type="datetime-local" step="1" name="timefrom" id="timefrom" value="''' +
+              html.escape(timefrom) +
+              '''"
+ title="Search lines from this time on">
+<span title="Search lines within this time range">-</span>
+<input type="datetime-local" step="1" name="timeto" id="timeto" value="''' +
+              html.escape(timeto) +
+              '''"
+ title="Search lines up to this time">
+</span>
+''') + '''<span class="box">
 <span title="Limit search results" style="margin-left:10px">Limits:</span>
 <input type="text" name="limitlines" id="limitlines" value="''' +
               html.escape(limitlines) +
@@ -818,6 +4822,14 @@ optgroup {
 <span title="Limit search results to this amount of memory">MiB</span>
 </span>
 <span class="box">
+<input type="checkbox" name="fast" style="margin-left:10px" ''' +
+              ('checked="checked" ' if fast else "") +
+              '''id="fast"
+ title="Stop searching as soon as the limits are reached">
+<span title="Stop searching as soon as the limits are reached"
+ onclick="toggle('fast')">Fast</span>
+</span>
+<span class="box">
 <input type="checkbox" name="autorefresh" style="margin-left:10px" ''' +
               ('checked="checked" ' if autorefresh else "") +
               '''id="autorefresh"
@@ -859,6 +4871,9 @@ optgroup {
 
     logfiles_selected_files = 0
     logfiles_selected_bytes = 0
+    catalog = load_catalog(catalog_file) if catalog_file else None
+    if catalog:
+        timings.add_error(catalog.error)
 
     for logdir in sorted(logfiles.dir2files):
         result += ['<optgroup label="' +
@@ -880,21 +4895,47 @@ optgroup {
 
                 style = ("" if logfile["readable"] else
                          ' style="text-decoration:line-through"')
+                size_human = bytes_pretty(logfile["size"])
+                # what the catalog knows about a logfile read completely
+                entry = catalog and catalog.get(logfile["path"],
+                                                logfile["fingerprint"])
+                title = ""
+                if entry:
+                    title = (f"{entry['lines']} lines, "
+                             f"{bytes_pretty(entry['bytes'])} uncompressed")
+                    if entry["first"] is not None:
+                        title += ", from " + datetime.datetime.fromtimestamp(
+                            entry["first"]).strftime(DATETIME_FMT)
+                    if entry["last"] is not None:
+                        title += " until " + datetime.datetime.fromtimestamp(
+                            entry["last"]).strftime(DATETIME_FMT)
+                    title = ' title="' + html.escape(title) + '"'
                 result += ['<option value="' +
                            html.escape(logfile["path"]) +
                            '"' +
                            selected +
                            style +
+                           title +
                            ">" +
                            "&nbsp;" * 2 * logfile["indent"] +
                            html.escape(logfile["name"]) +
                            "&nbsp;" * filler +
                            " " +
-                           "&nbsp;" * (8 - len(logfile["size_human"])) +
-                           logfile["size_human"] +
+                           "&nbsp;" * (8 - len(size_human)) +
+                           size_human +
                            "&nbsp;&nbsp;" +
-                           logfile["mtime_human"] +
+                           datetime.datetime.fromtimestamp(
+                               logfile["mtime"]).strftime(DATETIME_FMT) +
                            "&nbsp;</option>"]
+            elif "ls" in logfile:
+                result += ['<option data-ls="' +
+                           html.escape(logfile["ls"]) +
+                           '" data-indent="' +
+                           str(logfile["indent"]) +
+                           '" title="Double-click to expand">' +
+                           "&nbsp;" * 2 * logfile["indent"] +
+                           html.escape(logfile["name"]) +
+                           "</option>"]
             else:
                 result += ["<option>" +
                            "&nbsp;" * 2 * logfile["indent"] +
@@ -908,7 +4949,7 @@ optgroup {
                '<div class="bar" id="barm"></div>',
                '<div style="font-family: monospace; vertical-align: top;' +
                ' overflow: scroll">']
-    result += html_lines
+    result += [html_lines]
     result += ["</div>",
                '<div class="sbb" id="filestatusbox">',
                str(logfiles_selected_files) + "/" +
@@ -924,7 +4965,8 @@ optgroup {
                "folders shown</div>",
                '<div class="bar"></div>',
                '<div class="sbb">',
-               html_status,
+               lambda: html_status,
+               lambda: html_next_page,
                '<span style="float:right">',
                '<span title="Role" style="margin-right:10px">Role:',
                '<select name="role" id="role">',
@@ -938,11 +4980,25 @@ optgroup {
 
     result += ["</select>",
                "</span>",
-               '<span style="margin-right:10px">',
-               "Run time:",
-               "%.1fs" % (time.perf_counter() - start_time,),
-               "</span>",
-               '<span style="margin-right:10px">',
+               '<span style="margin-right:10px">']
+    if debug == "timings":
+        result += [lambda: render_timings(timings,
+                                          time.perf_counter() - start_time)]
+    else:
+        result += ["Run time:",
+                   lambda: "%.1fs" % (time.perf_counter() - start_time,)]
+    result += ["</span>"]
+
+    if result_cache_size or result_cache_dir:
+        result += ['<span style="margin-right:10px" title="Searches of '
+                   'single logfiles taken from the result cache of this '
+                   'process, or not">',
+                   "Result cache:",
+                   lambda: "%d hits, %d misses" % (result_cache.hits,
+                                                   result_cache.misses),
+                   "</span>"]
+
+    result += ['<span style="margin-right:10px">',
                "Regex module:",
                RE_MODULE,
                "</span>",
@@ -990,6 +5046,48 @@ document.querySelectorAll(".bar").forEach(function (elem) {
   };
 });
 
+var nameIndentLen = """ + str(logfiles.max_name_indent_len) + """;
+
+document.getElementById("fileselect").ondblclick = function (ev) {
+  var option = ev.target;
+  if (option.tagName != "OPTION" || !option.dataset.ls) {
+    return;
+  }
+
+  var path = option.dataset.ls;
+  var indent = Number(option.dataset.indent) + 1;
+  delete option.dataset.ls;
+  option.removeAttribute("title");
+
+  fetch("?ls=" + encodeURIComponent(path)).then(function (response) {
+    return response.json();
+  }).then(function (listing) {
+    var next = option.nextSibling;
+    (listing || []).forEach(function (entry) {
+      var elem = document.createElement("option");
+      var nbsp = "\\u00a0";
+      var text = nbsp.repeat(2 * (indent + entry.indent)) + entry.name;
+      if (entry.path) {
+        elem.value = entry.path;
+        if (!entry.readable) {
+          elem.style.textDecoration = "line-through";
+        }
+        text += nbsp.repeat(Math.max(nameIndentLen + 1 - text.length, 1)) +
+                " " + nbsp.repeat(Math.max(8 - entry.size_human.length, 0)) +
+                entry.size_human + nbsp + nbsp + entry.mtime_human + nbsp;
+      } else {
+        elem.dataset.ls = entry.ls;
+        elem.dataset.indent = indent + entry.indent;
+        elem.title = "Double-click to expand";
+      }
+      elem.textContent = text;
+      option.parentNode.insertBefore(elem, next);
+    });
+  }).catch(function () {
+    option.dataset.ls = path;
+  });
+};
+
 function toggle (elemId)
 {
   var elem = document.getElementById(elemId);
@@ -1047,6 +5145,7 @@ function autoRefresh ()
             "ignorecase",
             "invert",
             "regex",
+            "boolean",
             "showlinenumbers",
             "wraplines",
             "showdotfiles",
@@ -1056,11 +5155,17 @@ function autoRefresh ()
             "fileselect",
             "limitlines",
             "limitmemory",
+            "fast",
+            "timefrom",
+            "timeto",
             "before",
             "after",
             "refreshsec",
             "role").forEach(function (id) {
-    document.getElementById(id).disabled = autorefresh;
+    var element = document.getElementById(id);
+    if (element) {
+      element.disabled = autorefresh;
+    }
 });
 }
 
@@ -1069,27 +5174,107 @@ autoRefresh();
 </body>
 </html>"""]
 
-    result = "\n".join(result)
-    bresult = result.encode(HTML_CHARSET)
+    # the length of the page is unknown until the search has finished, thus
+    # Server-Timing covers the phases up to the search only
     headers = [
         ("Content-Type", "text/html; charset=" + HTML_CHARSET),
-        ("Content-Length", str(len(bresult)))
+        ("Server-Timing", timings.server_timing())
     ] + [tuple(str(cookie).split(": ", 1)) for cookie in rawcookies.values()]
 
-    return headers, bresult if is_wsgi else result
+    def encode_page():
+        for chunk in stream_page(result):
+            start = time.perf_counter()
+            chunk = chunk.encode(HTML_CHARSET)
+            timings.measure("encode", start)
+            yield chunk
+        metrics.add_request(kind, timings, time.perf_counter() - start_time)
+
+    page = encode_page() if is_wsgi else stream_page(result)
+    if profile:
+        profile.params = {
+            "user": remote_user, "role": role, "query": query,
+            "reverse": reverse, "ignorecase": ignorecase, "invert": invert,
+            "regex": regex, "boolean": boolean, "fast": fast,
+            "before": before, "after": after, "timefrom": timefrom,
+            "timeto": timeto, "charset": charset, "filefilter": filefilter,
+            "limitlines": limitlines, "limitmemory": limitmemory,
+            "fileselect": fileselect, "autorefresh": autorefresh,
+            "phases": timings.phases}
+        return headers, profile.page(page)
+    return headers, page
 
 
 def application(environ, start_response):
     headers, bresult = logblitz(environ, True, time.perf_counter())
     start_response("200 Ok", headers)
 
-    return [bresult]
+    return bresult
+
+
+def build_indexes(configfile):
+    # builds the trigram indexes of all rotated logfiles of all sections
+    # which set index_dir
+    config, _, regexes = load_config(configfile)
+
+    done = set()
+    for section in config:
+        if not config.has_option(section, "index_dir"):
+            continue
+        index_dir = config.get(section, "index_dir")
+
+        if config.has_option(section, "logdirs"):
+            logdirs = config.get(section, "logdirs").split(os.path.pathsep)
+        else:
+            logdirs = []
+
+        if config.has_option(section, "dirfilter"):
+            cfgdirfilter = config.get(section, "dirfilter")
+        else:
+            cfgdirfilter = ""
+
+        if config.has_option(section, "filefilter"):
+            cfgfilefilter = config.get(section, "filefilter")
+        else:
+            cfgfilefilter = ""
+
+        error_cfgdf, cfgdirfilter_re = regexes[cfgdirfilter]
+        error_cfgff, cfgfilefilter_re = regexes[cfgfilefilter]
+        if error_cfgdf or error_cfgff:
+            print(f"[{section}]: {error_cfgdf or error_cfgff}",
+                  file=sys.stderr)
+            continue
+
+        logfiles = LogFiles()
+        for logdir in logdirs:
+            traverse_logdir(logdir.removesuffix(os.path.sep), cfgdirfilter_re,
+                            cfgfilefilter_re, re.compile(""), logfiles, True,
+                            False)
+
+        for logfile in [logfile for files in logfiles.dir2files.values()
+                        for logfile in files]:
+            if ("path" not in logfile or
+                    not is_rotated(logfile["path"], logfile["mtime"]) or
+                    (index_dir, logfile["path"]) in done):
+                continue
+            done.add((index_dir, logfile["path"]))
+            try:
+                built = build_index(index_dir, logfile["path"])
+            except Exception as e:
+                print(f"{logfile['path']}: {e}", file=sys.stderr)
+            else:
+                print(f"{logfile['path']}: "
+                      f"{'built' if built else 'up to date'}")
 
 
-if __name__ == "__main__":
+if __name__ == "__main__" and sys.argv[1:] == ["--build-index"]:
+    build_indexes(os.path.join(os.path.dirname(sys.argv[0]), os.pardir,
+                               "etc", "logblitz.ini"))
+elif __name__ == "__main__":
     headers, result = logblitz(os.environ, False, load_time)
     print("Status: 200 Ok")
     for hdr in headers:
        print(": ".join(hdr))
+    print(flush=True)
+    for chunk in result:
+        print(chunk, end="", flush=True)
     print()
-    print(result)
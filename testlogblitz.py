@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+
+# Usage: python3 -m unittest testlogblitz
+# Searches small logfiles in a temporary directory, and checks that the
+# search paths of logblitz.py show the same lines as the plain ones.
+
+import os
+import re
+import html
+import gzip
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+import logblitz
+from benchlogblitz import run_search
+
+
+def shown_lines(result):
+    # returns the line numbers and texts of the lines shown by a search
+    lines = []
+    for html_line in result[1]:
+        m = re.match(r'<div class="sl"><span class="ln">\s*(-?\d+)</span>'
+                     r'(.*)</div>$', html_line, re.S)
+        if m:
+            text = html.unescape(re.sub(r"<[^>]*>", "", m.group(2)))
+            lines.append((int(m.group(1)), text.rstrip("\n")))
+    return lines
+
+
+def make_lines(count):
+    # returns the lines of a syslog like logfile, about every third of
+    # which contains "foo"
+    rnd = random.Random(count)
+    return ["Oct 17 %02d:%02d:%02d host prog[%d]: %s" % (
+                num // 3600 % 24, num // 60 % 60, num % 60, num,
+                rnd.choice(("foo", "bar", "baz qux")))
+            for num in range(count)]
+
+
+class LogfileTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+
+    def write_logfile(self, name, lines, charset="utf-8"):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w", encoding=charset) as fp:
+            fp.writelines(line + "\n" for line in lines)
+        return path
+
+    def write_compressed(self, name, lines):
+        path = os.path.join(self.tmpdir, name)
+        with gzip.open(path, "wt", encoding="utf-8") as fp:
+            fp.writelines(line + "\n" for line in lines)
+        return path
+
+
+class TestBytewise(LogfileTestCase):
+    # matching undecoded lines must show just the lines matching decoded
+    # lines shows
+    LINES = ("xää", "xy", "z", "xäy", "ä", "Ärger", "abc 12")
+
+    def assert_bytewise(self, query, expected, charset="utf-8", **kwargs):
+        logfile = self.write_logfile("messages", self.LINES, charset)
+        result = run_search(logfile, query, charset=charset, **kwargs)
+        with unittest.mock.patch.object(logblitz, "is_bytewise_query",
+                                        return_value=False):
+            decoded = run_search(logfile, query, charset=charset, **kwargs)
+        self.assertEqual(result, decoded)
+        self.assertEqual([text for _, text in shown_lines(result)], expected)
+
+    def test_quantified_multibyte_character(self):
+        self.assert_bytewise("ä{2}", ["xää"], regex=True)
+        self.assert_bytewise("xä?y", ["xy", "xäy"], regex=True)
+        self.assert_bytewise("ü*z", ["z"], regex=True)
+
+    def test_unicode_escapes(self):
+        self.assert_bytewise(r"\N{LATIN SMALL LETTER A WITH DIAERESIS}y",
+                             ["xäy"], regex=True)
+        self.assert_bytewise(r"\u00e4\u00e4", ["xää"], regex=True)
+        self.assert_bytewise(r"\U000000c4r", ["Ärger"], regex=True)
+
+    def test_single_byte_charset(self):
+        self.assert_bytewise("ä{2}", ["xää"], charset="latin-1", regex=True)
+        self.assert_bytewise("x[äy]", ["xää", "xy", "xäy"],
+                             charset="latin-1", regex=True)
+
+    def test_literal(self):
+        self.assert_bytewise("äy", ["xäy"])
+        self.assert_bytewise("ärg", ["Ärger"], ignorecase=True)
+        self.assert_bytewise(r"\d+", ["abc 12"], regex=True)
+
+
+class TestCatalog(LogfileTestCase):
+    def test_missing_directory(self):
+        # a catalog which cannot be written must not fail the search
+        catalog = logblitz.Catalog(os.path.join(self.tmpdir, "missing",
+                                                "catalog.json"))
+        catalog.update("/var/log/messages", [1, 2, 3], {"lines": 1})
+        catalog.save()
+        self.assertIn("Cannot write catalog", catalog.error)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+class TestRequestProfile(LogfileTestCase):
+    def test_lock(self):
+        # the lock is held just while the page is sent
+        profile = logblitz.RequestProfile(self.tmpdir, True)
+        page = profile.page(["<html>", "</html>"])
+        self.assertFalse(logblitz.RequestProfile.lock.locked())
+        self.assertEqual(list(page), ["<html>", "</html>"])
+        self.assertFalse(logblitz.RequestProfile.lock.locked())
+        self.assertEqual(len(os.listdir(self.tmpdir)), 2)
+
+    def test_failing_page(self):
+        def chunks():
+            yield "<html>"
+            raise ValueError("failed")
+
+        profile = logblitz.RequestProfile(self.tmpdir, False)
+        with self.assertRaises(ValueError):
+            list(profile.page(chunks()))
+        self.assertFalse(logblitz.RequestProfile.lock.locked())
+
+
+class TestReverse(LogfileTestCase):
+    # a reverse search shows the lines of a forward search in reverse order,
+    # or just the last of them if the limits are reached
+    LINES = make_lines(2000)
+
+    def assert_reverse(self, logfile, **kwargs):
+        forward = shown_lines(run_search(logfile, "foo", limitlines="",
+                                         **kwargs))
+        for limitlines in ("", "5"):
+            # read backwards across many blocks
+            with unittest.mock.patch.object(logblitz, "BACKWARD_BLOCK_SIZE",
+                                            100):
+                result = run_search(logfile, "foo", reverse=True,
+                                    limitlines=limitlines, **kwargs)
+            # lines counted backwards from the end of the logfile
+            reverse = [(num if num > 0 else len(self.LINES) + 1 + num, text)
+                       for num, text in shown_lines(result)]
+            self.assertEqual(reverse, forward[::-1][:len(reverse)])
+            if limitlines:
+                self.assertGreaterEqual(len(reverse), int(limitlines))
+            else:
+                self.assertEqual(len(reverse), len(forward))
+
+    def test_uncompressed(self):
+        logfile = self.write_logfile("messages", self.LINES)
+        self.assert_reverse(logfile)
+        self.assert_reverse(logfile, before="2", after="1")
+        self.assert_reverse(logfile, invert=True)
+
+    def test_compressed(self):
+        logfile = self.write_compressed("messages.1.gz", self.LINES)
+        self.assert_reverse(logfile)
+        self.assert_reverse(logfile, before="2", after="1")
+
+
+
+class TestIndex(LogfileTestCase):
+    # searching a rotated logfile by its trigram index must show just the
+    # lines of a search without index, whether the index is built by the
+    # search itself or beforehand
+    LINES = make_lines(8000)
+    QUERIES = ({"query": "prog[1234]"},
+               {"query": "PROG[4321]: BAR", "ignorecase": True},
+               {"query": r"prog\[77\d\d\]: baz", "regex": True},
+               {"query": "prog[12345]"},
+               {"query": "prog[55 OR prog[66 AND foo", "boolean": True},
+               {"query": "prog[5", "before": "1", "after": "1"},
+               {"query": "foo", "invert": True})
+
+    def setUp(self):
+        super().setUp()
+        self.index_dir = os.path.join(self.tmpdir, "index")
+        os.mkdir(self.index_dir)
+        # many small blocks, most of which can be skipped
+        patcher = unittest.mock.patch.object(logblitz, "INDEX_BLOCK_SIZE",
+                                             16 * 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_index(self, logfile):
+        for kwargs in self.QUERIES:
+            with self.subTest(**kwargs):
+                plain = run_search(logfile, **kwargs)
+                self.assertEqual(run_search(logfile, index_dir=self.index_dir,
+                                            **kwargs), plain)
+                self.assertEqual(run_search(logfile, index_dir=self.index_dir,
+                                            **kwargs), plain)
+
+        index = logblitz.LogIndex.load(
+            self.index_dir, logfile,
+            logblitz.logfile_fingerprint(os.stat(logfile)))
+        self.assertGreater(len(index.blocks), 10)
+        trigrams = logblitz.query_trigrams("prog[1234]", "utf-8", False,
+                                           False, False, False, True)
+        self.assertLess(sum(index.candidates(trigrams)), len(index.blocks) / 2)
+
+    def test_uncompressed(self):
+        self.assert_index(self.write_logfile("messages.1", self.LINES))
+
+    def test_compressed(self):
+        self.assert_index(self.write_compressed("messages.1.gz", self.LINES))
+
+    def test_build_index(self):
+        logfile = self.write_compressed("messages.1.gz", self.LINES)
+        plain = [run_search(logfile, **kwargs) for kwargs in self.QUERIES]
+        self.assertTrue(logblitz.build_index(self.index_dir, logfile))
+        self.assertFalse(logblitz.build_index(self.index_dir, logfile))
+        self.assertEqual([run_search(logfile, index_dir=self.index_dir,
+                                     **kwargs) for kwargs in self.QUERIES],
+                         plain)
+
+
+class TestBoolean(LogfileTestCase):
+    # a boolean query must show just the lines for which its terms combine
+    # to true, where NOT binds tightest and OR loosest
+    LINES = make_lines(3000)
+
+    def assert_boolean(self, query, predicate, **kwargs):
+        logfile = self.write_logfile("messages", self.LINES)
+        result = run_search(logfile, query, boolean=True, limitlines="",
+                            **kwargs)
+        with unittest.mock.patch.object(logblitz, "is_bytewise_query",
+                                        return_value=False):
+            decoded = run_search(logfile, query, boolean=True,
+                                 limitlines="", **kwargs)
+        self.assertEqual(result, decoded)
+        expected = [(num, line) for num, line in enumerate(self.LINES, 1)
+                    if bool(predicate(line)) != kwargs.get("invert", False)]
+        self.assertTrue(expected)
+        self.assertEqual(shown_lines(result), expected)
+
+    def test_precedence(self):
+        self.assert_boolean("foo OR bar prog[12",
+                            lambda line: "foo" in line or
+                            ("bar" in line and "prog[12" in line))
+        self.assert_boolean("foo OR bar AND prog[12",
+                            lambda line: "foo" in line or
+                            ("bar" in line and "prog[12" in line))
+        self.assert_boolean("NOT foo prog[2",
+                            lambda line: "foo" not in line and
+                            "prog[2" in line)
+        self.assert_boolean("NOT NOT foo OR prog[2",
+                            lambda line: "foo" in line or "prog[2" in line)
+
+    def test_parentheses(self):
+        self.assert_boolean("(foo OR bar) prog[12",
+                            lambda line: ("foo" in line or "bar" in line) and
+                            "prog[12" in line)
+        self.assert_boolean("-(foo OR bar) (prog[3 OR prog[4)",
+                            lambda line: "baz" in line and
+                            ("prog[3" in line or "prog[4" in line))
+
+    def test_terms(self):
+        self.assert_boolean("-foo -bar", lambda line: "baz" in line)
+        self.assert_boolean('"baz qux" prog[7',
+                            lambda line: "baz qux" in line and
+                            "prog[7" in line)
+        self.assert_boolean(r"/prog\[1\d\]:/ OR qux prog[3",
+                            lambda line: re.search(r"prog\[1\d\]:", line) or
+                            ("qux" in line and "prog[3" in line))
+        self.assert_boolean(r"foo prog\[2\d\]:", lambda line: "foo" in line
+                            and re.search(r"prog\[2\d\]:", line),
+                            regex=True)
+        self.assert_boolean("FOO prog[1",
+                            lambda line: "foo" in line and "prog[1" in line,
+                            ignorecase=True)
+        self.assert_boolean("foo OR bar", lambda line: "foo" in line or
+                            "bar" in line, invert=True)
+
+    def test_parse(self):
+        a, b, c = (("term", text, False) for text in "abc")
+        self.assertEqual(logblitz.parse_boolean_query("a b OR c", False),
+                         ("or", [("and", [a, b]), c]))
+        self.assertEqual(logblitz.parse_boolean_query("a (b OR c)", False),
+                         ("and", [a, ("or", [b, c])]))
+        self.assertEqual(logblitz.parse_boolean_query("NOT a AND -b", False),
+                         ("and", [("not", a), ("not", b)]))
+        self.assertEqual(logblitz.parse_boolean_query("-(a OR b) c", False),
+                         ("and", [("not", ("or", [a, b])), c]))
+        self.assertEqual(logblitz.parse_boolean_query('"a b" /c/', False),
+                         ("and", [("term", "a b", False),
+                                  ("term", "c", True)]))
+        for query in ("a AND", "(a OR b", "a) b", "OR a", ""):
+            with self.subTest(query=query):
+                with self.assertRaises(ValueError):
+                    logblitz.parse_boolean_query(query, False)
+
+    def test_invalid(self):
+        logfile = self.write_logfile("messages", self.LINES)
+        self.assertEqual(run_search(logfile, "(foo", boolean=True),
+                         ("", ("Error: Invalid query: missing ), "
+                               "unterminated parenthesis",)))
+
+
+class TestPaging(LogfileTestCase):
+    # the pages of a search stopped by the limits must together show just
+    # the lines of a single search without limits
+    LINES = make_lines(1500)
+    OTHER_LINES = [line.replace("host", "other") for line in make_lines(700)]
+
+    def search(self, logfiles, paging=None, **kwargs):
+        fields = {"charset": "utf-8", "query": "foo", "reverse": False,
+                  "ignorecase": False, "invert": False, "regex": False,
+                  "boolean": False, "before": "0", "after": "0",
+                  "limitlines": "", "limitmemory": "1", "fast": False,
+                  "workers": 1, "index_dir": "", "timestamp": "",
+                  "timefrom": "", "timeto": ""}
+        fields.update(kwargs)
+        found = logblitz.LogFiles()
+        logblitz.traverse_logdir(self.tmpdir, re.compile(""), re.compile(""),
+                                 re.compile(""), found, False, True)
+        return logblitz.search([self.tmpdir], found, logfiles,
+                               logblitz.SearchOptions(**fields),
+                               paging=paging)
+
+    def assert_paging(self, logfiles, limitlines, **kwargs):
+        unpaged = shown_lines(self.search(logfiles, **kwargs))
+        self.assertTrue(unpaged)
+        paged = []
+        paging = {}
+        for num_pages in range(1, len(unpaged) + 1):
+            result = self.search(logfiles, paging, limitlines=limitlines,
+                                 **kwargs)
+            self.assertNotIn("Error", result[0])
+            page = shown_lines(result)
+            paged += page
+            if not paging.get("next"):
+                break
+            self.assertTrue(page)
+            paging = {"resume": paging["next"]}
+        self.assertGreater(num_pages, 1)
+        self.assertEqual(paged, unpaged)
+
+    def test_paging(self):
+        logfiles = [self.write_logfile("messages", self.LINES),
+                    self.write_compressed("other.1.gz", self.OTHER_LINES)]
+        for kwargs in ({"limitlines": "7"},
+                       {"limitlines": "50", "before": "2", "after": "1"},
+                       {"limitlines": "3", "before": "0", "after": "3"},
+                       {"limitlines": "10", "query": r"prog\[1\d+\]: b",
+                        "regex": True},
+                       {"limitlines": "40", "query": "FOO", "ignorecase": True,
+                        "fast": True},
+                       {"limitlines": "100", "invert": True}):
+            with self.subTest(**kwargs):
+                self.assert_paging(logfiles, **kwargs)
+
+    def test_changed_search(self):
+        # a page of another search starts from the beginning
+        logfile = self.write_logfile("messages", self.LINES)
+        paging = {}
+        first = self.search([logfile], paging, limitlines="5")
+        paging = {"resume": paging["next"]}
+        self.assertEqual(self.search([logfile], paging, query="bar",
+                                     limitlines="5"),
+                         self.search([logfile], query="bar", limitlines="5"))
+        self.assertNotEqual(shown_lines(first), [])
+
+
+class TestCheckpoints(LogfileTestCase):
+    # searching a gzip compressed logfile from the checkpoints of its index
+    # must show just the lines of a search decompressing it from its start,
+    # which is what happens if libz cannot be loaded
+    LINES = [line.replace("Oct 17 ", "2026-10-17T", 1)
+             for line in make_lines(20000)]
+    QUERIES = ({"query": "prog[17777]"},
+               {"query": "prog[4242]", "before": "3", "after": "3"},
+               {"query": "foo", "timestamp": "iso8601",
+                "timefrom": LINES[-500][:19]},
+               {"query": "bar", "timestamp": "iso8601",
+                "timefrom": LINES[5000][:19], "timeto": LINES[5100][:19]})
+
+    def setUp(self):
+        super().setUp()
+        self.index_dir = os.path.join(self.tmpdir, "index")
+        os.mkdir(self.index_dir)
+        for name, value in (("INDEX_BLOCK_SIZE", 16 * 1024),
+                            ("CHECKPOINT_SPAN", 16 * 1024)):
+            patcher = unittest.mock.patch.object(logblitz, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.logfile = self.write_compressed("messages.1.gz", self.LINES)
+        # the logfile has been written after its last line
+        os.utime(self.logfile, (os.stat(self.logfile).st_mtime + 86400,) * 2)
+
+    def search(self, index_dir="", **kwargs):
+        if kwargs.get("timestamp"):
+            kwargs["timestamp"] = logblitz.TIMESTAMP_FORMATS["iso8601"]
+        with unittest.mock.patch.object(
+                logblitz, "open_region", wraps=logblitz.open_region) as region:
+            result = run_search(self.logfile, index_dir=index_dir,
+                                limitlines="", **kwargs)
+        return result, region.called
+
+    def test_checkpoints(self):
+        if not logblitz.GzipReader.load_libz():
+            self.skipTest("libz is not available")
+        self.assertTrue(logblitz.build_index(self.index_dir, self.logfile))
+        index = logblitz.LogIndex.load(
+            self.index_dir, self.logfile,
+            logblitz.logfile_fingerprint(os.stat(self.logfile)))
+        self.assertGreater(len(index.checkpoints), 2)
+
+        for kwargs in self.QUERIES:
+            with self.subTest(**kwargs):
+                plain, _ = self.search(**kwargs)
+                self.assertTrue(shown_lines(plain))
+                self.assertEqual(self.search(self.index_dir, **kwargs),
+                                 (plain, True))
+                with unittest.mock.patch.object(logblitz.GzipReader, "libz",
+                                                False):
+                    self.assertEqual(self.search(self.index_dir, **kwargs),
+                                     (plain, False))
+
+    def test_libz_missing(self):
+        # an index built without libz has no checkpoints of gzip logfiles
+        with unittest.mock.patch.object(logblitz.GzipReader, "libz", False):
+            self.assertTrue(logblitz.build_index(self.index_dir,
+                                                 self.logfile))
+            for kwargs in self.QUERIES:
+                with self.subTest(**kwargs):
+                    self.assertEqual(self.search(self.index_dir, **kwargs),
+                                     self.search(**kwargs))
+        index = logblitz.LogIndex.load(
+            self.index_dir, self.logfile,
+            logblitz.logfile_fingerprint(os.stat(self.logfile)))
+        self.assertEqual(index.checkpoints, [])
+
+
+class TestDirCache(LogfileTestCase):
+    # a cached listing must show what listing the directory afresh shows,
+    # whether inotify reports the changes, or, if inotify is not available,
+    # the mtime of the directory is checked
+
+    def setUp(self):
+        super().setUp()
+        patcher = unittest.mock.patch.object(logblitz, "DIRCACHE_MTIME_SLACK",
+                                             0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.touches = 0
+
+    def listing(self, cache, use_inotify):
+        return [(entry["name"], entry["stat"].st_size)
+                for entry in cache.listing(self.tmpdir, use_inotify)]
+
+    def touch_dir(self):
+        # changes the mtime of the directory even with a coarse clock, but
+        # not into the future, which would never be cached
+        self.touches += 1
+        stat = os.stat(self.tmpdir)
+        os.utime(self.tmpdir, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns - self.touches * 10**9))
+
+    def assert_listings(self, cache, use_inotify):
+        self.write_logfile("messages", ["a"])
+        self.write_logfile("messages.1", ["b", "c"])
+        self.touch_dir()
+        self.assertEqual(self.listing(cache, use_inotify),
+                         [("messages", 2), ("messages.1", 4)])
+        self.assertEqual(self.listing(cache, use_inotify),
+                         [("messages", 2), ("messages.1", 4)])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # the logfile still written is stat()ed again
+        with open(os.path.join(self.tmpdir, "messages"), "a") as fp:
+            fp.write("d\n")
+        self.assertEqual(self.listing(cache, use_inotify),
+                         [("messages", 4), ("messages.1", 4)])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # the directory is listed again
+        os.rename(os.path.join(self.tmpdir, "messages.1"),
+                  os.path.join(self.tmpdir, "messages.2"))
+        os.rename(os.path.join(self.tmpdir, "messages"),
+                  os.path.join(self.tmpdir, "messages.1"))
+        self.write_logfile("messages", [])
+        self.touch_dir()
+        self.assertEqual(self.listing(cache, use_inotify),
+                         self.listing(logblitz.DirCache(), False))
+        self.assertEqual(self.listing(cache, use_inotify),
+                         [("messages", 0), ("messages.1", 4),
+                          ("messages.2", 4)])
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    def test_inotify(self):
+        cache = logblitz.DirCache()
+        if not cache.start_inotify():
+            self.skipTest("inotify is not available")
+        self.addCleanup(os.close, cache.inotify_fd)
+        self.assert_listings(cache, True)
+        self.assertEqual(list(cache.watches.values()), [self.tmpdir])
+
+    def test_inotify_missing(self):
+        cache = logblitz.DirCache()
+        with unittest.mock.patch("ctypes.CDLL", side_effect=OSError):
+            self.assert_listings(cache, True)
+        self.assertEqual(cache.inotify_fd, -1)
+        self.assertEqual(cache.watches, {})
+
+    def test_mtime(self):
+        cache = logblitz.DirCache()
+        self.assert_listings(cache, False)
+        self.assertIsNone(cache.inotify_fd)
+
+if __name__ == "__main__":
+    unittest.main()